@@ -0,0 +1,234 @@
+import collections
+import logging
+import threading
+
+import vtech_stream_codes as vtech
+
+log = logging.getLogger(__name__)
+
+# Adaptive stream quality. When the session falls back to a relay or the
+# link degrades, the camera keeps sending full quality and frames back up
+# and go missing. Every EVAL_INTERVAL the controller looks at what the
+# receive loop counted in that window (throughput, frame rate, frame gaps
+# and SDK-reported losses) and steps the camera's quality level down
+# (IOTYPE_USER_IPCAM_SETSTREAMCTRL_REQ) while the window is congested, and
+# back up after a run of clean windows. Every change and, a window later,
+# its effect are logged.
+
+# Seconds per evaluation window
+EVAL_INTERVAL = 5.0
+
+# A window is congested with at least this many frame gaps or lost frames...
+GAP_LIMIT = 2
+# ...or a frame rate below this share of the recent best
+FPS_FLOOR = 0.8
+
+# Windows of frame rate history for the recent best
+FPS_HISTORY = 12
+
+# Clean windows in a row before stepping up. Doubled (up to UP_BACKOFF_MAX
+# times) each time a step up had to be taken back, halved when one holds.
+UP_WINDOWS = 6
+UP_BACKOFF_MAX = 8
+
+# Unanswered requests in a row before the camera is taken not to support
+# stream control and the controller stops sending
+MAX_TIMEOUTS = 3
+
+# Quality levels the controller moves between, best first
+QUALITY_LEVELS = (vtech.AVIOCTRL_QUALITY_MAX, vtech.AVIOCTRL_QUALITY_HIGH, vtech.AVIOCTRL_QUALITY_MIDDLE,
+                  vtech.AVIOCTRL_QUALITY_LOW, vtech.AVIOCTRL_QUALITY_MIN)
+
+class Window:
+    """
+    What the receive loop counted during one evaluation window.
+    """
+    __slots__ = ("seconds", "nbytes", "frames", "gaps", "lost", "reconnects")
+
+    def __init__(self, seconds, nbytes, frames, gaps, lost, reconnects):
+        self.seconds = seconds
+        self.nbytes = nbytes
+        self.frames = frames
+        self.gaps = gaps
+        self.lost = lost
+        self.reconnects = reconnects
+
+    @property
+    def fps(self):
+        return self.frames / self.seconds if self.seconds else 0.0
+
+    @property
+    def kbps(self):
+        return self.nbytes * 8 / 1000 / self.seconds if self.seconds else 0.0
+
+    def describe(self):
+        return f"{self.kbps:.0f} kbit/s, {self.fps:.1f} fps, {self.gaps} gaps, {self.lost} lost"
+
+def _name(quality):
+    return vtech.QUALITY_NAMES.get(quality, str(quality))
+
+class AbrController(threading.Thread):
+    """
+    Runs next to a CameraStream and reads its metrics counters. Requests go
+    through the stream's current IOCtrlChannel (stream.ioctrl), which is
+    replaced on every reconnect. evaluate() holds the decision logic and
+    can be fed synthetic windows.
+    """
+
+    def __init__(self, stream, interval=EVAL_INTERVAL):
+        super().__init__(name=f"abr-{stream.name}", daemon=True)
+        self.stream = stream
+        self.interval = interval
+        self.log = log.getChild(stream.name)
+        self.tag = stream.tag
+        self._stop_event = threading.Event()
+
+        self.level = 0 # index into QUALITY_LEVELS; the camera starts at its best
+        self.fps_history = collections.deque(maxlen=FPS_HISTORY)
+        self.clean = 0
+        self.backoff = 1
+        self.change = None # (from level, to level, window before) until its effect is logged
+        self.timeouts = 0
+        self.enabled = True
+
+        # Stats
+        self.steps_down = 0
+        self.steps_up = 0
+        self.undone = 0
+        self.rejected = 0
+
+    @property
+    def quality(self):
+        return QUALITY_LEVELS[self.level]
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _counters(self):
+        m = self.stream.metrics
+        return (m.bytes.value, m.frames.value, m.gaps.value, m.lost.value, m.reconnects.value)
+
+    def run(self):
+        self._query()
+        prev = self._counters()
+        idle = self.stream.idle
+        pauses = idle.pauses if idle else 0
+        while self.enabled and not self._stop_event.wait(self.interval):
+            cur = self._counters()
+            if idle and (idle.paused or idle.pauses != pauses):
+                # No frames by design: not a congested window. The camera
+                # keeps its quality over STOP/START, so only the frame rate
+                # history starts over.
+                pauses = idle.pauses
+                self.fps_history.clear()
+                self.change = None
+            else:
+                self.evaluate(Window(self.interval, *(c - p for c, p in zip(cur, prev))))
+            prev = cur
+
+    def _request(self, io_type, quality, resp_type):
+        ioctrl = self.stream.ioctrl
+        if ioctrl is None:
+            return None
+        data = ioctrl.request(io_type, vtech.create_stream_ctrl_payload(quality, self.stream.session.channel), resp_type)
+        if data is None:
+            if not ioctrl.closed:
+                self.timeouts += 1
+                if self.timeouts >= MAX_TIMEOUTS:
+                    self.log.warning("%s [ABR] Camera does not answer stream control requests, adaptive quality off",
+                                     self.tag)
+                    self.enabled = False
+            return None
+        self.timeouts = 0
+        return data
+
+    def _query(self):
+        data = self._request(vtech.IOTYPE_USER_IPCAM_GETSTREAMCTRL_REQ, vtech.AVIOCTRL_QUALITY_UNKNOWN,
+                             vtech.IOTYPE_USER_IPCAM_GETSTREAMCTRL_RESP)
+        quality = vtech.parse_stream_ctrl_quality(data) if data else None
+        if quality in QUALITY_LEVELS:
+            self.level = QUALITY_LEVELS.index(quality)
+        self.log.info("%s [ABR] Camera quality %s%s", self.tag, _name(self.quality),
+                      "" if quality in QUALITY_LEVELS else " (assumed)")
+
+    def _set_level(self, level):
+        """
+        Asks the camera for QUALITY_LEVELS[level]; True if it accepted.
+        """
+        data = self._request(vtech.IOTYPE_USER_IPCAM_SETSTREAMCTRL_REQ, QUALITY_LEVELS[level],
+                             vtech.IOTYPE_USER_IPCAM_SETSTREAMCTRL_RESP)
+        if data is None:
+            return False
+        result = vtech.parse_stream_ctrl_result(data)
+        if result != 0:
+            self.rejected += 1
+            self.log.warning("%s [ABR] Camera rejected quality %s: %s", self.tag, _name(QUALITY_LEVELS[level]), result)
+            return False
+        return True
+
+    def _step(self, level, window, why):
+        old = self.level
+        if not self._set_level(level):
+            return False
+        self.level = level
+        self.change = (old, level, window)
+        self.clean = 0
+        # The frame rate may differ per level; judge the new one on its own
+        self.fps_history.clear()
+        if level > old:
+            self.steps_down += 1
+        else:
+            self.steps_up += 1
+        self.log.info("%s [ABR] Quality %s -> %s: %s (%s)", self.tag, _name(QUALITY_LEVELS[old]),
+                      _name(QUALITY_LEVELS[level]), why, window.describe())
+        return True
+
+    def evaluate(self, window):
+        if window.reconnects:
+            # A new AV channel starts at the camera's default quality
+            self.log.info("%s [ABR] Reconnected, camera back at its default quality", self.tag)
+            self.level = 0
+            self.change = None
+            self.clean = 0
+            self.fps_history.clear()
+            return
+
+        best = max(self.fps_history) if self.fps_history else 0.0
+        self.fps_history.append(window.fps)
+        reasons = []
+        if window.gaps >= GAP_LIMIT:
+            reasons.append(f"{window.gaps} frame gaps")
+        if window.lost >= GAP_LIMIT:
+            reasons.append(f"{window.lost} lost frames")
+        if best and window.fps < best * FPS_FLOOR:
+            reasons.append(f"{window.fps:.1f} fps of recent best {best:.1f}")
+        congested = bool(reasons)
+
+        if self.change:
+            old, new, before = self.change
+            self.change = None
+            self.log.info("%s [ABR] Effect of %s -> %s: %s -> %s", self.tag, _name(QUALITY_LEVELS[old]),
+                          _name(QUALITY_LEVELS[new]), before.describe(), window.describe())
+            if new < old:
+                if congested:
+                    # Stepping up brought the trouble back: undo, wait longer next time
+                    self.backoff = min(self.backoff * 2, UP_BACKOFF_MAX)
+                    if self._step(old, window, f"undoing step up ({', '.join(reasons)}), next try in "
+                                               f"{UP_WINDOWS * self.backoff * self.interval:.0f}s"):
+                        self.undone += 1
+                    return
+                self.backoff = max(self.backoff // 2, 1)
+
+        if congested:
+            self.clean = 0
+            if self.level < len(QUALITY_LEVELS) - 1:
+                self._step(self.level + 1, window, ", ".join(reasons))
+            return
+        self.clean += 1
+        if self.level > 0 and self.clean >= UP_WINDOWS * self.backoff:
+            self._step(self.level - 1, window, f"{self.clean} clean windows")
+
+    def stats_line(self):
+        state = _name(self.quality) if self.enabled else "off (no stream control)"
+        return (f"quality {state}, steps down {self.steps_down}, up {self.steps_up} ({self.undone} undone), "
+                f"rejected {self.rejected}")
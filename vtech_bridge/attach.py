@@ -0,0 +1,80 @@
+import argparse
+import os
+import socket
+import sys
+import time
+
+# Attach client for bridge.py --daemon.
+# Copies the stream from the daemon's Unix socket to stdout so go2rtc can use
+# it as an exec source. If the daemon restarts its worker we reconnect and keep
+# stdout open, so go2rtc only sees a short gap instead of a dead source.
+# With --fifo it does the same for the bridge's audio FIFO, reopening it
+# whenever the bridge (or its worker) closes its end.
+
+def connect(path, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+            return sock
+        except OSError:
+            sock.close()
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.1)
+
+def open_fifo(path, timeout):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(0.1)
+    # Blocks until the bridge opens its end; the bridge only writes once a
+    # reader has the FIFO open, so this never misses the start
+    return open(path, "rb", buffering=0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Attach to a running VTech bridge daemon")
+    parser.add_argument("--socket", default="/tmp/vtech_bridge.sock", help="Daemon socket path")
+    parser.add_argument("--fifo", help="Read this FIFO (the bridge's audio output) instead of the socket")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for the daemon")
+    args = parser.parse_args()
+    path = args.fifo or args.socket
+
+    out = sys.stdout.fileno()
+    buf = bytearray(256 * 1024)
+    view = memoryview(buf)
+
+    while True:
+        t0 = time.monotonic()
+        if args.fifo:
+            sock = open_fifo(args.fifo, args.timeout)
+            recv_into = sock.readinto if sock else None
+        else:
+            sock = connect(args.socket, args.timeout)
+            recv_into = sock.recv_into if sock else None
+        if sock is None:
+            print(f"[Attach] Daemon not reachable at {path}", file=sys.stderr)
+            sys.exit(1)
+        print(f"[Attach] Connected to {path} in {(time.monotonic() - t0) * 1000:.0f} ms", file=sys.stderr)
+
+        try:
+            while True:
+                n = recv_into(buf)
+                if n == 0:
+                    break
+                written = 0
+                while written < n:
+                    written += os.write(out, view[written:n])
+        except BrokenPipeError:
+            # go2rtc closed the source
+            sys.exit(0)
+        except ConnectionError:
+            pass
+        finally:
+            sock.close()
+        print("[Attach] Daemon closed the stream, reconnecting...", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import errno
+import logging
+import os
+import select
+import stat
+import struct
+import threading
+import time
+
+import iotc
+from ts_mux import TsMuxer
+
+log = logging.getLogger(__name__)
+
+AUDIO_FORMATS = ("mpegts", "framed", "raw")
+
+# Record header for the "framed" format, little endian:
+#   u32 timestamp (ms, camera clock - same clock as video FRAMEINFO)
+#   u16 codec id (MEDIA_CODEC_AUDIO_*)
+#   u8  FRAMEINFO flags (sample rate / bits / channels)
+#   u8  reserved
+#   u32 payload length
+RECORD_HEADER = struct.Struct("<IHBBI")
+
+# mpegts: PAT/PMT every this many frames (and for every new reader), so a
+# reader can start anywhere
+PSI_INTERVAL = 25
+
+# mpegts: TS buffer for one audio frame, grown for larger frames
+TS_CAPACITY = 16 * 1024
+
+# How long to wait before trying to open the FIFO again when nobody reads it
+REOPEN_INTERVAL = 1.0
+
+class FifoWriter:
+    """
+    Non-blocking writer for a named pipe. It never blocks the caller: if
+    nobody has the FIFO open, or the reader is too slow, the data is dropped
+    and counted.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        self._next_open = 0.0
+        self.frames = 0
+        self.dropped = 0
+
+        if os.path.exists(path):
+            if not stat.S_ISFIFO(os.stat(path).st_mode):
+                os.unlink(path)
+                os.mkfifo(path)
+        else:
+            os.mkfifo(path)
+
+    def _open(self):
+        now = time.monotonic()
+        if now < self._next_open:
+            return False
+        try:
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+            log.info("[Audio] Reader attached to %s", self.path)
+            return True
+        except OSError as e:
+            if e.errno != errno.ENXIO: # ENXIO = no reader yet
+                log.warning("[Audio] Failed to open %s: %s", self.path, e)
+            self._next_open = now + REOPEN_INTERVAL
+            return False
+
+    def write(self, *views):
+        if self.fd is None and not self._open():
+            self.dropped += 1
+            return False
+
+        total = sum(len(v) for v in views)
+        try:
+            written = os.writev(self.fd, views)
+        except BlockingIOError:
+            # Reader is behind; nothing was written, so the stream stays aligned
+            self.dropped += 1
+            return False
+        except OSError:
+            log.info("[Audio] Reader detached from %s", self.path)
+            self.close()
+            self.dropped += 1
+            return False
+
+        if written < total and not self._finish(views, written, total):
+            # Could not complete the record; the reader has to start over
+            self.close()
+            self.dropped += 1
+            return False
+        self.frames += 1
+        return True
+
+    def _finish(self, views, written, total):
+        # Writes above PIPE_BUF can be partial; give the reader a moment
+        rest = b"".join(views)[written:]
+        deadline = time.monotonic() + 0.1
+        while rest:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                return False
+            select.select([], [self.fd], [], timeout)
+            try:
+                n = os.write(self.fd, rest)
+            except BlockingIOError:
+                continue
+            except OSError:
+                return False
+            rest = rest[n:]
+        return True
+
+    def close(self):
+        if self.fd is not None:
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+            self.fd = None
+
+class AudioThread(threading.Thread):
+    """
+    Receives audio with its own AudioReceiver (own preallocated buffers) and
+    writes it to a FIFO, so audio can never hold up the video loop.
+      mpegts - MPEG-TS with a PTS per frame (AAC ADTS or G.711 A-law), which
+               go2rtc reads as an exec source
+      framed - RECORD_HEADER + payload per frame, timestamps preserved
+      raw    - bare codec payload
+    """
+
+    def __init__(self, receiver, sink, fmt="mpegts"):
+        super().__init__(name="audio", daemon=True)
+        self.receiver = receiver
+        self.sink = sink
+        self.framed = fmt == "framed"
+        self.muxer = TsMuxer(None, TS_CAPACITY, audio=True) if fmt == "mpegts" else None
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        receiver = self.receiver
+        sink = self.sink
+        header = bytearray(RECORD_HEADER.size)
+        first_frame = True
+        while not self._stop_event.is_set():
+            ret, frame_idx, frame_info = receiver.recv()
+            if ret > 0:
+                if first_frame:
+                    log.info("[Audio] First frame: %s bytes, %s", ret, frame_info)
+                    first_frame = False
+                if self.muxer:
+                    # A reader attaching (no fd yet) must get PAT/PMT first
+                    psi = sink.fd is None or self.muxer.frames % PSI_INTERVAL == 0
+                    packets = self.muxer.mux(receiver.view[:ret], psi, frame_info.codec_id, frame_info.timestamp)
+                    if packets is not None:
+                        sink.write(packets)
+                elif self.framed:
+                    RECORD_HEADER.pack_into(header, 0, frame_info.timestamp, frame_info.codec_id,
+                                            frame_info.flags, 0, ret)
+                    sink.write(header, receiver.view[:ret])
+                else:
+                    sink.write(receiver.view[:ret])
+            elif ret == iotc.AV_ER_DATA_NOREADY:
+                self._stop_event.wait(0.01)
+            elif ret == iotc.AV_ER_LOSED_THIS_FRAME:
+                continue
+            else:
+                log.warning("[Audio] Error receiving audio: %s", ret)
+                break
+        sink.close()
+        log.info("[Audio] Stopped. Frames written %s, dropped %s", sink.frames, sink.dropped)
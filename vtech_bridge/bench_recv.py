@@ -0,0 +1,75 @@
+import ctypes
+import sys
+import time
+import tracemalloc
+
+# Microbenchmark for the per-frame Python/ctypes overhead of avRecvFrameData2.
+#
+# Calls are made against an invalid AV index, so the native side returns
+# straight away and what is left is the cost of setting up and unpacking the
+# call. "legacy" is the old bridge_worker loop (fresh lists + per-call
+# argtypes/from_buffer/c_int setup), "receiver" is iotc.FrameReceiver.
+
+sys.path.append('/')
+
+import iotc
+
+BUF_SIZE = 1024 * 1024
+INVALID_AV_INDEX = -1
+
+def legacy_recv(av_index, buf, size, out_buf_size, out_frame_size, out_frame_info, frame_idx):
+    # Copy of the original iotc.avRecvFrameData2 body
+    fn = iotc._av_lib.avRecvFrameData2
+    c_buf = (ctypes.c_char * len(buf)).from_buffer(buf)
+    c_out_buf_size = ctypes.c_int(0)
+    c_out_frame_size = ctypes.c_int(0)
+    c_frame_idx = ctypes.c_int(0)
+    c_frame_info_size = ctypes.c_int(0)
+    c_frame_info = (ctypes.c_byte * 128)()
+    fn.argtypes = [ctypes.c_int, ctypes.POINTER(ctypes.c_char), ctypes.c_int,
+                   ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int),
+                   ctypes.POINTER(ctypes.c_byte), ctypes.c_int, ctypes.POINTER(ctypes.c_int),
+                   ctypes.POINTER(ctypes.c_int)]
+    fn.restype = ctypes.c_int
+    ret = fn(av_index, c_buf, size, ctypes.byref(c_out_buf_size), ctypes.byref(c_out_frame_size),
+             c_frame_info, 128, ctypes.byref(c_frame_info_size), ctypes.byref(c_frame_idx))
+    if out_buf_size: out_buf_size[0] = c_out_buf_size.value
+    if out_frame_size: out_frame_size[0] = c_out_frame_size.value
+    if frame_idx: frame_idx[0] = c_frame_idx.value
+    return ret
+
+def legacy_loop(n, buf):
+    for _ in range(n):
+        out_buf_size = [0]
+        out_frame_size = [0]
+        out_frame_info = [0] * 10
+        frame_idx = [0]
+        legacy_recv(INVALID_AV_INDEX, buf, len(buf), out_buf_size, out_frame_size, out_frame_info, frame_idx)
+
+def receiver_loop(n, receiver):
+    recv = receiver.recv
+    for _ in range(n):
+        recv()
+
+def measure(name, loop, state, n):
+    loop(1000, state) # warm up
+    t0 = time.perf_counter()
+    loop(n, state)
+    elapsed = time.perf_counter() - t0
+
+    # Buffers are allocated up front, so this only sees per-call garbage
+    tracemalloc.start()
+    loop(1000, state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    per_call_us = elapsed / n * 1e6
+    print(f"{name:<10} {per_call_us:8.2f} us/call   peak transient {peak:6d} B   ({n} calls)")
+    return per_call_us
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(f"IOTC Version: {iotc.IOTC_Get_Version()}")
+    before = measure("legacy", legacy_loop, bytearray(BUF_SIZE), n)
+    after = measure("receiver", receiver_loop, iotc.FrameReceiver(INVALID_AV_INDEX, BUF_SIZE), n)
+    print(f"speedup: {before / after:.2f}x")
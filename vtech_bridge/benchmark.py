@@ -0,0 +1,472 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import select
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.request
+
+# Benchmarks for the bridge without a camera: everything runs against the
+# fake TUTK backend (fake_tutk.py, IOTC_BACKEND=fake).
+#
+# Two passes per scenario:
+#   e2e    bridge.py in a subprocess, stdout read here. Frames/s, CPU per
+#          frame (whole process group), latency from the moment a frame
+#          "arrived" at the SDK to the moment it came out of stdout, and
+#          output jitter (spread of the intervals between frames on stdout).
+#   alloc  the same receive pipeline (CameraSession + CameraStream) in this
+#          process under tracemalloc: blocks still held per frame (leaks)
+#          and the transient peak.
+#
+# The resume_* scenarios instead compare what a viewer waits for and what
+# an unwatched camera costs: a new bridge process per viewer (teardown), a
+# daemon that always streams (always_on) and a daemon that pauses the camera
+# without readers (idle). Time from connecting to the first picture, and CPU
+# and camera bandwidth while nobody watches.
+#
+# The fake's own cost is part of the CPU numbers, so compare runs with each
+# other rather than with a real camera. Results are appended to a JSON lines
+# file; every run is compared with the previous run of the same scenario on
+# the same host and regressions beyond --threshold are flagged.
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+os.environ["IOTC_BACKEND"] = "fake"
+sys.path.insert(0, SCRIPT_DIR)
+
+import fake_tutk
+
+SCENARIOS = {
+    "baseline": {"fps": 25, "bitrate": 1000},
+    "hd": {"fps": 30, "bitrate": 6000},
+    "lossy": {"fps": 25, "bitrate": 1000, "jitter_ms": 20, "loss": 0.02},
+    # Unpaced: as many frames as the bridge asks for
+    "max": {"fps": 0, "bitrate": 1000},
+    # Frames delivered in 200 ms bursts, passed on as they come / paced by
+    # the adaptive jitter buffer
+    "bursty": {"fps": 25, "bitrate": 1000, "burst_ms": 200},
+    "bursty_paced": {"fps": 25, "bitrate": 1000, "burst_ms": 200, "buffer_ms": 400},
+    # Viewer comes and goes: new process per viewer / always streaming /
+    # camera paused while nobody watches
+    "resume_teardown": {"fps": 25, "bitrate": 1000, "resume": "teardown"},
+    "resume_always_on": {"fps": 25, "bitrate": 1000, "resume": "always_on"},
+    "resume_idle": {"fps": 25, "bitrate": 1000, "resume": "idle"},
+}
+
+# Seconds of output ignored at the start (race, connect, first keyframe)
+WARMUP = 2.0
+
+# Viewer attaches per resume_* scenario, and the idle_seconds of resume_idle
+RESUME_TRIES = 5
+RESUME_IDLE_SECONDS = 1
+
+# Results history; /data survives add-on restarts and updates
+RESULTS = "/data/benchmark_results.jsonl" if os.path.isdir("/data") else os.path.join(SCRIPT_DIR, "benchmark_results.jsonl")
+
+# Metric -> True if higher is better
+DIRECTIONS = {
+    "fps": True,
+    "cpu_us_per_frame": False,
+    "latency_p50_ms": False,
+    "latency_p95_ms": False,
+    "latency_p99_ms": False,
+    "output_jitter_ms": False,
+    "alloc_blocks_per_frame": False,
+    "alloc_peak_kib": False,
+    "resume_ms": False,
+    "idle_cpu_pct": False,
+    "idle_kbps": False,
+}
+
+def scenario_env(params):
+    env = {"IOTC_BACKEND": "fake",
+           "FAKE_TUTK_FPS": str(params.get("fps", 25)),
+           "FAKE_TUTK_BITRATE": str(params.get("bitrate", 1000)),
+           "FAKE_TUTK_JITTER_MS": str(params.get("jitter_ms", 0)),
+           "FAKE_TUTK_BURST_MS": str(params.get("burst_ms", 0)),
+           "FAKE_TUTK_LOSS": str(params.get("loss", 0)),
+           "FAKE_TUTK_GOP": str(params.get("gop", 25))}
+    if params.get("file"):
+        env["FAKE_TUTK_FILE"] = params["file"]
+    return env
+
+def bridge_args(params):
+    # Bridge options a scenario sets (buffer_ms: adaptive jitter buffer)
+    if params.get("buffer_ms"):
+        return ["--jitter-ms", str(params["buffer_ms"]), "--jitter-adaptive"]
+    return []
+
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def group_cpu_seconds(pgid):
+    """
+    utime + stime of all live processes in the process group.
+    """
+    total = 0
+    ticks = os.sysconf("SC_CLK_TCK")
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[2]) == pgid:
+            total += int(fields[11]) + int(fields[12])
+    return total / ticks
+
+class StdoutReader(threading.Thread):
+    """
+    Splits the bridge's stdout at Annex B start codes, counts pictures and
+    reads the arrival stamps fake_tutk puts into synthetic frames.
+    """
+
+    def __init__(self, fd, stamped=True):
+        super().__init__(name="bench-reader", daemon=True)
+        self.fd = fd
+        self.stamped = stamped
+        self.frames = 0
+        self.latencies = [] # seconds
+        self.intervals = [] # seconds between pictures
+        self.last_picture = None
+        self.measuring = False
+
+    def run(self):
+        tail = b""
+        stamp_end = fake_tutk.STAMP_OFFSET + fake_tutk.STAMP_SIZE
+        while True:
+            chunk = os.read(self.fd, 1 << 20)
+            if not chunk:
+                break
+            now = time.monotonic_ns()
+            data = tail + chunk
+            pos = 0
+            while True:
+                i = data.find(b"\x00\x00\x01", pos)
+                if i < 0 or i + stamp_end > len(data):
+                    break
+                nal_type = data[i + 3] & 0x1f
+                if nal_type in (1, 5) and self.measuring:
+                    self.frames += 1
+                    if self.last_picture is not None:
+                        self.intervals.append((now - self.last_picture) / 1e9)
+                    self.last_picture = now
+                    stamp = fake_tutk.read_stamp(data[i - 1:i - 1 + stamp_end]) if self.stamped and i else None
+                    if stamp:
+                        self.latencies.append((now - stamp) / 1e9)
+                pos = i + 3
+            tail = data[pos:]
+
+def run_e2e(params, duration):
+    env = dict(os.environ, **scenario_env(params))
+    scoreboard = os.path.join("/tmp", f"bench_scores_{os.getpid()}.json")
+    cmd = [sys.executable, os.path.join(SCRIPT_DIR, "bridge.py"), "--uid", "BENCHMARK", "--auth_key", "bench",
+           "--race", "1", "--scoreboard", scoreboard] + bridge_args(params)
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env, start_new_session=True)
+    # Replayed files carry no arrival stamps
+    reader = StdoutReader(proc.stdout.fileno(), stamped=not params.get("file"))
+    reader.start()
+    try:
+        time.sleep(WARMUP)
+        if proc.poll() is not None:
+            raise RuntimeError(f"bridge.py exited with {proc.returncode} during warm-up")
+        cpu0 = group_cpu_seconds(proc.pid)
+        t0 = time.monotonic()
+        reader.measuring = True
+        time.sleep(duration)
+        reader.measuring = False
+        elapsed = time.monotonic() - t0
+        cpu = group_cpu_seconds(proc.pid) - cpu0
+    finally:
+        try:
+            os.killpg(proc.pid, 15)
+        except ProcessLookupError:
+            pass
+        proc.wait()
+        try:
+            os.unlink(scoreboard)
+        except OSError:
+            pass
+
+    frames = reader.frames
+    results = {"frames": frames, "fps": round(frames / elapsed, 2),
+               "cpu_us_per_frame": round(cpu / frames * 1e6, 1) if frames else None}
+    if reader.latencies:
+        for name, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            results[f"latency_{name}_ms"] = round(_percentile(reader.latencies, p) * 1000, 2)
+        results["latency_max_ms"] = round(max(reader.latencies) * 1000, 2)
+    if reader.intervals:
+        # p95 deviation from the median interval: 0 for perfectly even output
+        median = _percentile(reader.intervals, 0.5)
+        results["output_jitter_ms"] = round(_percentile([abs(i - median) for i in reader.intervals], 0.95) * 1000, 2)
+    return results
+
+def wait_picture(fd, timeout):
+    """
+    Reads fd until the first Annex B picture (NAL type 1 or 5). Returns the
+    seconds that took, or None on EOF or timeout.
+    """
+    t0 = time.monotonic()
+    deadline = t0 + timeout
+    tail = b""
+    while True:
+        left = deadline - time.monotonic()
+        if left <= 0 or not select.select([fd], [], [], left)[0]:
+            return None
+        chunk = os.read(fd, 1 << 16)
+        if not chunk:
+            return None
+        data = tail + chunk
+        pos = 0
+        while True:
+            i = data.find(b"\x00\x00\x01", pos)
+            if i < 0 or i + 3 >= len(data):
+                break
+            if data[i + 3] & 0x1f in (1, 5):
+                return time.monotonic() - t0
+            pos = i + 3
+        tail = data[-3:]
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _bytes_received(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics.json", timeout=5) as r:
+        snapshot = json.load(r)
+    return sum(m["value"] for m in snapshot.get("vtech_bytes_total", []))
+
+def run_resume(params, duration):
+    env = dict(os.environ, **scenario_env(params))
+    scoreboard = os.path.join("/tmp", f"bench_scores_{os.getpid()}.json")
+    cmd = [sys.executable, os.path.join(SCRIPT_DIR, "bridge.py"), "--uid", "BENCHMARK", "--auth_key", "bench",
+           "--race", "1", "--scoreboard", scoreboard]
+    resumes = []
+    results = {}
+    try:
+        if params["resume"] == "teardown":
+            # Nothing runs while nobody watches; every viewer pays a cold start
+            for _ in range(RESUME_TRIES):
+                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env,
+                                        start_new_session=True)
+                try:
+                    resumes.append(wait_picture(proc.stdout.fileno(), 30))
+                finally:
+                    os.killpg(proc.pid, 15)
+                    proc.wait()
+            results.update(idle_cpu_pct=0.0, idle_kbps=0.0)
+        else:
+            idle_seconds = RESUME_IDLE_SECONDS if params["resume"] == "idle" else 0
+            path = os.path.join("/tmp", f"bench_{os.getpid()}.sock")
+            port = _free_port()
+            cmd += ["--daemon", "--socket", path, "--idle-seconds", str(idle_seconds), "--metrics-port", str(port)]
+            proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env,
+                                    start_new_session=True)
+            try:
+                time.sleep(WARMUP + idle_seconds)
+                if proc.poll() is not None:
+                    raise RuntimeError(f"bridge.py exited with {proc.returncode} during warm-up")
+                cpu0, bytes0, t0 = group_cpu_seconds(proc.pid), _bytes_received(port), time.monotonic()
+                time.sleep(duration)
+                elapsed = time.monotonic() - t0
+                results["idle_cpu_pct"] = round((group_cpu_seconds(proc.pid) - cpu0) / elapsed * 100, 2)
+                results["idle_kbps"] = round((_bytes_received(port) - bytes0) * 8 / 1000 / elapsed, 1)
+                for _ in range(RESUME_TRIES):
+                    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                        t0 = time.monotonic()
+                        sock.connect(path)
+                        # Connect included
+                        took = wait_picture(sock.fileno(), 30)
+                        resumes.append(time.monotonic() - t0 if took is not None else None)
+                    # Long enough for the idle daemon to pause again
+                    time.sleep(idle_seconds + 1)
+            finally:
+                try:
+                    os.killpg(proc.pid, 15)
+                except ProcessLookupError:
+                    pass
+                proc.wait()
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+    finally:
+        try:
+            os.unlink(scoreboard)
+        except OSError:
+            pass
+
+    done = [r for r in resumes if r is not None]
+    results["resumes"] = f"{len(done)}/{len(resumes)}"
+    if done:
+        results["resume_ms"] = round(_percentile(done, 0.5) * 1000, 1)
+        results["resume_max_ms"] = round(max(done) * 1000, 1)
+    return results
+
+def run_alloc(params, duration):
+    os.environ.update(scenario_env(params))
+    fake_tutk.reset()
+
+    import bridge
+    import session as session_mod
+    from output import FrameWriter
+    from stream import CameraStream
+
+    opts = bridge.build_parser().parse_args(["--uid", "BENCHMARK", "--auth_key", "bench"] + bridge_args(params))
+    session_mod.initialize(0)
+    session = session_mod.CameraSession(opts.uid, opts.auth_key, name="Bench")
+    if not session.connect() or not session.start_av():
+        raise RuntimeError("fake session did not start")
+    session.start_stream()
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    stream = CameraStream("Bench", session, FrameWriter(devnull, opts.flush_policy, opts.flush_ms, opts.flush_bytes),
+                          opts, label="bench")
+    thread = threading.Thread(target=stream.run, name="bench-stream", daemon=True)
+    thread.start()
+    try:
+        time.sleep(WARMUP)
+        tracemalloc.start()
+        # The ring keeps per-slot metadata until the slot is reused and frame
+        # numbers up to 256 are cached small ints, so wait until the ring has
+        # wrapped under tracing and past that point; after that the two
+        # snapshots only differ by real growth
+        settle = max(stream.ring.frames_in, 256) + opts.ring_frames + 1
+        while stream.ring.frames_in < settle and thread.is_alive():
+            time.sleep(0.1)
+        # A full collection also empties the tuple/float free lists, which
+        # would otherwise look like retained blocks
+        gc.collect()
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        frames0 = stream.metrics.frames.value
+        time.sleep(duration)
+        gc.collect()
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        frames = stream.metrics.frames.value - frames0
+    finally:
+        stream.stop()
+        thread.join(timeout=5)
+        session.close()
+        session_mod.deinitialize()
+        os.close(devnull)
+
+    # The fake camera runs in this process too; its allocations don't count
+    ignore = [tracemalloc.Filter(False, fake_tutk.__file__), tracemalloc.Filter(False, tracemalloc.__file__)]
+    diff = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+    blocks = sum(stat.count_diff for stat in diff)
+    results = {"alloc_frames": frames,
+               "alloc_blocks_per_frame": round(blocks / frames, 3) if frames else None,
+               "alloc_peak_kib": round((peak - current) / 1024, 1),
+               "alloc_top": [f"{stat.traceback[0].filename.rsplit('/', 1)[-1]}:{stat.traceback[0].lineno} {stat.count_diff:+d}"
+                             for stat in diff[:3] if stat.count_diff]}
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def load_results(path):
+    records = []
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass
+    except FileNotFoundError:
+        pass
+    return records
+
+def compare(record, previous, threshold):
+    """
+    Returns lines describing metrics that got worse by more than
+    `threshold` (a fraction) since `previous`.
+    """
+    regressions = []
+    for name, higher_is_better in DIRECTIONS.items():
+        new = record["results"].get(name)
+        old = previous["results"].get(name)
+        if new is None or old is None or old == 0:
+            continue
+        change = (new - old) / abs(old)
+        worse = -change if higher_is_better else change
+        # Tiny absolute values (e.g. 0.01 blocks/frame) are noise
+        if worse > threshold and abs(new - old) > 0.05:
+            regressions.append(f"{name} {old} -> {new} ({change * 100:+.0f}%)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bridge against the fake TUTK backend")
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument("--file", help="Replay this H.264 Annex B file instead of synthetic frames (scenario 'custom')")
+    parser.add_argument("--fps", type=float, help="Override the frame rate (0: unpaced)")
+    parser.add_argument("--bitrate", type=float, help="Override the synthetic bitrate (kbit/s)")
+    parser.add_argument("--jitter-ms", type=float, help="Override the arrival jitter (+/- ms)")
+    parser.add_argument("--loss", type=float, help="Override the frame loss probability")
+    parser.add_argument("--burst-ms", type=float, help="Override the arrival burst period (ms)")
+    parser.add_argument("--buffer-ms", type=int, help="Override the bridge's jitter buffer ceiling (ms, 0: off)")
+    parser.add_argument("--duration", type=float, default=10, help="Measured seconds per pass")
+    parser.add_argument("--skip-alloc", action="store_true", help="Only run the end-to-end pass")
+    parser.add_argument("--results", default=RESULTS, help="Results history (JSON lines)")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Flag metrics that are this much worse than last time")
+    parser.add_argument("--check", action="store_true", help="Exit with status 1 if anything regressed")
+    args = parser.parse_args()
+
+    overrides = {k: v for k, v in (("file", args.file), ("fps", args.fps), ("bitrate", args.bitrate),
+                                   ("jitter_ms", args.jitter_ms), ("loss", args.loss), ("burst_ms", args.burst_ms),
+                                   ("buffer_ms", args.buffer_ms)) if v is not None}
+    names = args.scenarios or (["custom"] if overrides else list(SCENARIOS))
+    for name in names:
+        if name != "custom" and name not in SCENARIOS:
+            parser.error(f"unknown scenario {name} (choose from {', '.join(SCENARIOS)}, custom)")
+
+    history = load_results(args.results)
+    commit = git_commit()
+    regressed = False
+    for name in names:
+        params = dict(SCENARIOS.get(name, SCENARIOS["baseline"]), **overrides)
+        print(f"[Bench] {name}: {params}", file=sys.stderr)
+        if params.get("resume"):
+            results = run_resume(params, args.duration)
+        else:
+            results = run_e2e(params, args.duration)
+        if not args.skip_alloc and not params.get("resume"):
+            results.update(run_alloc(params, args.duration))
+        record = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": commit, "host": platform.node(),
+                  "python": platform.python_version(), "scenario": name, "params": params, "results": results}
+
+        print(f"{name}: " + ", ".join(f"{k}={v}" for k, v in results.items()))
+        previous = next((r for r in reversed(history)
+                         if r.get("scenario") == name and r.get("host") == record["host"] and r.get("params") == params), None)
+        if previous:
+            regressions = compare(record, previous, args.threshold)
+            for line in regressions:
+                print(f"  REGRESSION vs {previous.get('commit') or previous['time']}: {line}")
+            regressed = regressed or bool(regressions)
+        history.append(record)
+        with open(args.results, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+
+    if args.check and regressed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
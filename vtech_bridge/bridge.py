@@ -3,38 +3,45 @@ import time
 import struct
 import argparse
 import signal
-import json
 import os
 import multiprocessing
 
 # Ensure we can import from root if needed
 sys.path.append('/')
 
-import vtech_stream_codes as vtech
+from output import FrameWriter, FLUSH_POLICIES
+from audio import AUDIO_FORMATS
+from ts_mux import OUTPUT_FORMATS
+from fanout import FanoutServer
+from scoreboard import Scoreboard
+import metrics
+import recorder
+import logs
+from watchdog import Heartbeat, Watchdog, STALL_SECONDS
+from standby import Standby, FailoverLog
 
-# Mock iotc for demonstration if not installed
+# iotc/session/stream are required; exit if the native wrapper cannot be imported
 try:
     import iotc
-    from iotc import IOTC_Initialize2, IOTC_DeInitialize, IOTC_Connect_ByUID_Parallel, IOTC_Connect_ByUID, avClientStart, avClientStartEx, avSendIOCtrl, avRecvFrameData2, avInitialize, avDeInitialize, IOTC_Set_Log_Attr, IOTC_Get_SessionID, TUTK_SDK_Set_Region, TUTK_SDK_Set_License_Key
+    import session as session_mod
+    from session import CameraSession
+    from stream import CameraStream
+    import multicam
 except ImportError:
     print("CRITICAL ERROR: 'iotc' library not found.", file=sys.stderr)
-    # Define mocks so the script structure is visible, but exit early if run
-    def IOTC_Initialize2(port): return 0
-    def IOTC_DeInitialize(): return 0
-    def IOTC_Connect_ByUID_Parallel(uid, sid): return -1
-    def IOTC_Connect_ByUID(uid): return -1
-    def avInitialize(max_channel_num): return 0
-    def avDeInitialize(): return 0
-    def avClientStart(sid, user, pwd, timeout, serv_type, channel): return -1
-    def avClientStartEx(sid, user, pwd, timeout, channel, resend=0, security_mode=0, auth_type=0): return -1
-    def avSendIOCtrl(av_index, type, payload): pass
-    def avRecvFrameData2(av_index, buf, size, out_buf_size, out_frame_size, out_frame_info, frame_idx): return -1
-    def IOTC_Set_Log_Attr(log_level, path): pass
-    def IOTC_Get_SessionID(): return -1
-    def TUTK_SDK_Set_Region(region_code): return 0
-    def TUTK_SDK_Set_License_Key(key): return 0
-
-STATE_FILE = "/data/bridge_state.json"
+    sys.exit(1)
+
+# Pause between worker restarts in daemon mode
+DAEMON_RESTART_DELAY = 2
+
+# Seconds a strategy gets to reach CONNECTED
+CONNECT_TIMEOUT = 15
+
+# Seconds between failover gap checks when there is no watchdog
+FAILOVER_POLL = 0.5
+
+# Seconds between a waiting standby's checks that its supervisor is alive
+STANDBY_PARENT_POLL = 1.0
 
 STRATEGIES = [
     {"region": 0, "method": "sequential", "name": "Global / Sequential"},
@@ -46,223 +53,361 @@ STRATEGIES = [
     {"region": 3, "method": "parallel", "name": "US (Wyze) / Parallel"},
 ]
 
-def load_state():
-    if os.path.exists(STATE_FILE):
-        try:
-            with open(STATE_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            pass
-    return {"index": 0, "status": "new"}
-
-def save_state(state):
-    try:
-        with open(STATE_FILE, 'w') as f:
-            json.dump(state, f)
-    except:
-        pass
-
-def bridge_worker(uid, auth_key, region, method, status_queue):
+def bridge_worker(uid, auth_key, region, method, status_queue, opts, strategy_idx=0, decision=None, heartbeat=None, go=None):
     """
     Runs the actual bridge logic in a separate process.
+    Reports ("CONNECTED"|"FAILED", strategy_idx) on status_queue. When racing,
+    a connected worker waits for the supervisor to set decision to 1 (go on)
+    or -1 (another strategy won) before starting AV. The stream reports
+    progress on heartbeat and reconnects on SIGUSR1 (see watchdog.py).
+    With go, the worker is a warm standby: it reports ("READY", strategy_idx)
+    after the SDK setup and only connects once go is set (see standby.py).
     """
+    # The supervisor's SIGTERM handler is inherited; terminate() must still
+    # end a worker at once, even inside a native call
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    parent = os.getppid()
+    logs.setup(opts.log_level)
     print(f"[Worker] Starting. Region={region}, Method={method}", file=sys.stderr)
-    
-    # 0. Enable Logging
-    try:
-        IOTC_Set_Log_Attr(255, "/var/log/iotc_native.log")
-        print("[Worker] Enabled IOTC native logging", file=sys.stderr)
-    except Exception as e:
-        print(f"[Worker] Failed to set log attr: {e}", file=sys.stderr)
 
-    # 0.5 Set Region
-    try:
-        TUTK_SDK_Set_Region(region)
-        print(f"[Worker] Set Region: {region}", file=sys.stderr)
-    except Exception as e:
-        print(f"[Worker] Failed to set region: {e}", file=sys.stderr)
-
-    # 0.6 Set License Key
-    sdk_key = os.getenv("SDK_KEY") or os.getenv("TUTK_LICENSE_KEY")
-    if sdk_key:
-        try:
-            print(f"[Worker] Setting License Key (len={len(sdk_key)})...", file=sys.stderr)
-            TUTK_SDK_Set_License_Key(sdk_key)
-        except Exception as e:
-            print(f"[Worker] Failed to set license key: {e}", file=sys.stderr)
-    else:
-        print("[Worker] No SDK_KEY provided. Connection may hang if library requires it.", file=sys.stderr)
-
-    # 1. Initialize IOTC
-    init_ret = IOTC_Initialize2(0)
-    if init_ret < 0:
-        print(f"[Worker] Failed to initialize IOTC: {init_ret}", file=sys.stderr)
+    # 0-1. Logging, region, license, IOTC/AV init
+    if not session_mod.initialize(region, log_level=opts.native_log_level, log_kb=opts.native_log_kb,
+                                  log_files=opts.native_log_files):
+        status_queue.put(("FAILED", strategy_idx))
         return
-    
-    # Initialize AV
-    av_ret = avInitialize(0)
-    if av_ret < 0:
-        print(f"[Worker] Failed to initialize AV: {av_ret}", file=sys.stderr)
+
+    if go is not None:
+        print("[Worker] Initialised, waiting as standby", file=sys.stderr)
+        status_queue.put(("READY", strategy_idx))
+        while not go.wait(STANDBY_PARENT_POLL):
+            # Re-parented: the supervisor is gone and nobody will promote us
+            if os.getppid() != parent:
+                print("[Worker] Supervisor exited, standby stopping", file=sys.stderr)
+                session_mod.deinitialize()
+                return
+        print("[Worker] Promoted from standby", file=sys.stderr)
 
     # 2. Connect
-    sid = -1
-    print(f"[Worker] Connecting...", file=sys.stderr)
-    
-    # Check if IOTC_Connect_ByUIDEx is available (via imports in bridge.py if updated, 
-    # but bridge.py only imports what we listed. We need to update imports or access via iotc module)
-    has_ex = hasattr(iotc, 'IOTC_Connect_ByUIDEx')
-
-    if method == "parallel" and not has_ex: # Only use parallel if Ex is not preferred or available?
-        try:
-            sid_pre = IOTC_Get_SessionID()
-            if sid_pre < 0:
-                print(f"[Worker] Failed to get Session ID: {sid_pre}", file=sys.stderr)
-            else:
-                sid_ret = IOTC_Connect_ByUID_Parallel(uid, sid_pre)
-                if sid_ret < 0:
-                    print(f"[Worker] Parallel connect failed: {sid_ret}", file=sys.stderr)
-                else:
-                    sid = sid_ret
-        except Exception as e:
-            print(f"[Worker] Parallel exception: {e}", file=sys.stderr)
-    else: 
-        # Prefer Ex if available, as VTech DTLS likely requires auth_key during connection
-        if has_ex:
-            try:
-                print(f"[Worker] Using IOTC_Connect_ByUIDEx with auth_key...", file=sys.stderr)
-                sid_pre = IOTC_Get_SessionID()
-                sid = iotc.IOTC_Connect_ByUIDEx(uid, sid_pre, auth_key)
-                if sid < 0:
-                    print(f"[Worker] ConnectEx failed: {sid}", file=sys.stderr)
-            except Exception as e:
-                print(f"[Worker] ConnectEx exception: {e}", file=sys.stderr)
-        else:
-            try:
-                sid = IOTC_Connect_ByUID(uid)
-                if sid < 0:
-                    print(f"[Worker] Sequential connect failed: {sid}", file=sys.stderr)
-            except Exception as e:
-                print(f"[Worker] Sequential exception: {e}", file=sys.stderr)
-
-    if sid < 0:
-        print("[Worker] Connection failed.", file=sys.stderr)
+    session = CameraSession(uid, auth_key, method)
+    if not session.connect():
+        status_queue.put(("FAILED", strategy_idx))
+        session_mod.deinitialize()
         return
-
-    print(f"[Worker] Connected! SID: {sid}", file=sys.stderr)
     
     # Notify Main Process of success
-    status_queue.put("CONNECTED")
+    status_queue.put(("CONNECTED", strategy_idx))
+
+    if decision is not None:
+        while decision.value == 0:
+            time.sleep(0.02)
+        if decision.value < 0:
+            print("[Worker] Another strategy won the race. Closing session.", file=sys.stderr)
+            session.close()
+            session_mod.deinitialize()
+            return
 
     # 3. Start AV Client
-    av_index = -1
-    # Simple retry for AV start
-    for i in range(3):
-        # Try avClientStartEx with DTLS (SecurityMode=2) as VTech uses it
-        print(f"[Worker] Starting AV Client (Attempt {i+1})...", file=sys.stderr)
-        # Using resend=1 as Wyze does
-        av_index = avClientStartEx(sid, "admin", auth_key, 30, 0, resend=1, security_mode=2, auth_type=0)
-        if av_index >= 0:
-            break
-        print(f"[Worker] AV start failed: {av_index}. Retrying...", file=sys.stderr)
-        time.sleep(1)
-
-    if av_index < 0:
-        print(f"[Worker] Failed to start AV client: {av_index}", file=sys.stderr)
-        iotc.IOTC_Session_Close(sid)
+    if not session.start_av():
+        session.close()
+        session_mod.deinitialize()
         return
 
-    print(f"[Worker] AV Client Started. AVIndex: {av_index}", file=sys.stderr)
-
     # 4. Start Stream
-    vtech.start_stream(sid, av_index, 0)
-    
+    session.start_stream()
+
     # 5. Receive Loop
-    buf = bytearray(1024 * 1024) # 1MB buffer
-    print("[Worker] Stream started. Outputting video...", file=sys.stderr)
-    
+    if opts.daemon:
+        writer = FanoutServer(opts.socket)
+        output = opts.socket
+    else:
+        writer = FrameWriter(sys.stdout.fileno(), opts.flush_policy, opts.flush_ms, opts.flush_bytes)
+        output = f"stdout, flush={opts.flush_policy}"
+    print(f"[Worker] Outputting video ({output})", file=sys.stderr)
+    stream = CameraStream("Worker", session, writer, opts, label="baby_monitor", heartbeat=heartbeat)
+    # The supervisor's watchdog asks for a targeted reconnect with SIGUSR1
+    signal.signal(signal.SIGUSR1, lambda signum, frame: stream.request_reconnect())
+    metrics_server, metrics_dumper = metrics.start(opts.metrics_port, opts.metrics_file)
+    if metrics_server:
+        recorder.add_routes(metrics_server)
     try:
-        while True:
-            out_buf_size = [0]
-            out_frame_size = [0]
-            out_frame_info = [0] * 10
-            frame_idx = [0]
-            # key_frame = [0]
-            
-            ret = avRecvFrameData2(av_index, buf, len(buf), out_buf_size, out_frame_size, out_frame_info, frame_idx)
-            
-            if ret > 0:
-                frame_data = buf[:ret] 
-                sys.stdout.buffer.write(frame_data)
-                sys.stdout.flush()
-            elif ret == -20012: # IOTC_ER_TIMEOUT
-                continue
-            elif ret < 0:
-                print(f"[Worker] Error receiving frame: {ret}", file=sys.stderr)
-                break
-                
+        stream.run()
     except KeyboardInterrupt:
         pass
     finally:
-        vtech.stop_stream(sid, av_index, 0)
-        iotc.avClientStop(av_index)
-        iotc.IOTC_Session_Close(sid)
-        avDeInitialize()
-        IOTC_DeInitialize()
+        stream.stop()
+        metrics.stop(metrics_server, metrics_dumper)
+        if opts.daemon:
+            writer.close()
+        session.close()
+        session_mod.deinitialize()
 
-def main():
-    parser = argparse.ArgumentParser(description="VTech Baby Monitor Bridge Smart Tester")
-    parser.add_argument("--uid", required=True, help="Camera UID")
-    parser.add_argument("--auth_key", required=True, help="Camera Auth Key")
-    args = parser.parse_args()
+def race_strategies(args, order, scoreboard=None, heartbeat=None):
+    """
+    Connects with several strategies at once and keeps the first one that
+    reaches CONNECTED. Each strategy runs in its own worker process because
+    the SDK region setting is process-global. At most args.race workers run
+    at the same time; a worker that fails or times out is replaced by the
+    next strategy in order.
+    Returns (process, strategy_index) of the winner, or (None, None).
+    """
+    queue = multiprocessing.Queue()
+    pending = list(order)
+    running = {} # idx -> (process, decision, start time)
+    t_race = time.monotonic()
 
-    # --- SMART STRATEGY SELECTION ---
-    state = load_state()
-    idx = state.get("index", 0)
-    
-    # If last run crashed/hung (status pending), move to next
-    if state.get("status") == "pending":
-        print(f"Previous strategy {idx} failed. Moving to next...", file=sys.stderr)
-        idx = (idx + 1) % len(STRATEGIES)
-        state["index"] = idx
-    
-    if idx >= len(STRATEGIES):
-        idx = 0
-        state["index"] = 0
+    def launch(idx):
+        strategy = STRATEGIES[idx]
+        decision = multiprocessing.Value('i', 0)
+        p = multiprocessing.Process(target=bridge_worker, args=(args.uid, args.auth_key, strategy["region"], strategy["method"], queue, args, idx, decision, heartbeat))
+        p.start()
+        running[idx] = (p, decision, time.monotonic())
+        print(f"[Race] Started {strategy['name']}", file=sys.stderr)
 
-    current_strategy = STRATEGIES[idx]
-    print(f"--- STRATEGY {idx+1}/{len(STRATEGIES)}: {current_strategy['name']} ---", file=sys.stderr)
-    
-    state["status"] = "pending"
-    save_state(state)
-    
-    # Run Worker
-    queue = multiprocessing.Queue()
-    p = multiprocessing.Process(target=bridge_worker, args=(args.uid, args.auth_key, current_strategy["region"], current_strategy["method"], queue))
-    p.start()
-    
-    # Wait for connection success
+    def finish(idx, result, success=None):
+        p, decision, t0 = running.pop(idx)
+        elapsed = time.monotonic() - t0
+        print(f"[Race] {STRATEGIES[idx]['name']}: {result} after {elapsed:.2f}s", file=sys.stderr)
+        if scoreboard is not None and success is not None:
+            scoreboard.record(args.uid, STRATEGIES[idx]["name"], success, elapsed)
+        return p, decision
+
+    winner = None
     try:
-        msg = queue.get(timeout=15) # Wait 15s for connection
-        if msg == "CONNECTED":
-            print("Strategy Successful! Marking state as connected.", file=sys.stderr)
-            state["status"] = "connected"
-            save_state(state)
-            
-            # Wait for worker to finish (forever)
-            p.join()
-            sys.exit(0)
-    except multiprocessing.queues.Empty:
-        print("Connection timed out (Hard Hang). Killing worker...", file=sys.stderr)
-        p.terminate()
-        p.join()
-        sys.exit(1) # Exit to restart with next strategy
-    except KeyboardInterrupt:
-        p.terminate()
+        while pending or running:
+            while pending and len(running) < max(1, args.race):
+                launch(pending.pop(0))
+
+            try:
+                kind, idx = queue.get(timeout=0.2)
+            except multiprocessing.queues.Empty:
+                kind, idx = None, None
+
+            if idx in running:
+                if kind == "CONNECTED":
+                    p, decision = finish(idx, "connected", True)
+                    decision.value = 1
+                    winner = (p, idx)
+                    t_connect = time.monotonic() - t_race
+                    break
+                p, _ = finish(idx, "failed", False)
+                p.join()
+
+            now = time.monotonic()
+            for i, (p, _, t0) in list(running.items()):
+                if now - t0 > CONNECT_TIMEOUT:
+                    p, _ = finish(i, "timed out (hard hang)", False)
+                    p.terminate()
+                    p.join()
+                elif not p.is_alive():
+                    finish(i, "exited early", False)
+    except (KeyboardInterrupt, SystemExit):
+        for p, _, _ in running.values():
+            p.terminate()
+        if winner:
+            winner[0].terminate()
         sys.exit(0)
-    
-    # If worker exited early without success
-    print("Worker exited early.", file=sys.stderr)
-    sys.exit(1)
+
+    # Losers that already connected close their session on their own, the
+    # rest are still stuck in a native connect call
+    for p, decision, _ in running.values():
+        decision.value = -1
+    for i in list(running):
+        p, _ = finish(i, "cancelled")
+        p.join(timeout=1)
+        if p.is_alive():
+            p.terminate()
+            p.join()
+
+    if winner:
+        print(f"[Race] Winner: {STRATEGIES[winner[1]]['name']} (time to connect {t_connect:.2f}s)", file=sys.stderr)
+        return winner
+    print(f"[Race] No strategy connected ({time.monotonic() - t_race:.2f}s)", file=sys.stderr)
+    return None, None
+
+def supervise(p, watchdog, failover):
+    """
+    Waits for the worker to exit. With a watchdog, its heartbeat is checked
+    every watchdog.interval: a stall gets a SIGUSR1 (reconnect in place),
+    a stuck loop or a failed reconnect gets the worker terminated. The
+    failover log is updated along the way.
+    """
+    while p.is_alive():
+        p.join(timeout=watchdog.interval if watchdog else FAILOVER_POLL)
+        failover.check()
+        if watchdog is None or not p.is_alive():
+            continue
+        action = watchdog.check(time.monotonic())
+        if action == "reconnect":
+            os.kill(p.pid, signal.SIGUSR1)
+        elif action == "restart":
+            failover.failed(time.monotonic())
+            p.terminate()
+            p.join(timeout=5)
+            if p.is_alive():
+                p.kill()
+                p.join()
+
+def race(args, heartbeat):
+    """
+    Races the strategies in scoreboard order (historically fastest first).
+    Returns (process, strategy_index) of the connected worker, or (None, None).
+    """
+    # --- SMART STRATEGY SELECTION ---
+    scoreboard = Scoreboard(args.scoreboard)
+    order = scoreboard.order(args.uid, STRATEGIES)
+    print(f"--- RACING {len(order)} STRATEGIES ({args.race} at a time) ---", file=sys.stderr)
+    for n, idx in enumerate(order):
+        name = STRATEGIES[idx]["name"]
+        print(f"  {n+1}. {name}: {scoreboard.describe(args.uid, name)}", file=sys.stderr)
+
+    heartbeat.starting()
+    p, winner_idx = race_strategies(args, order, scoreboard, heartbeat)
+    scoreboard.save()
+    if p is not None:
+        print(f"Strategy Successful! {STRATEGIES[winner_idx]['name']}", file=sys.stderr)
+    return p, winner_idx
+
+def start_standby(args, idx, heartbeat):
+    strategy = STRATEGIES[idx]
+    print(f"[Standby] Preparing {strategy['name']}", file=sys.stderr)
+    return Standby(bridge_worker, dict(uid=args.uid, auth_key=args.auth_key, region=strategy["region"],
+                                       method=strategy["method"], opts=args, strategy_idx=idx,
+                                       heartbeat=heartbeat), idx)
+
+def promote(args, standby, heartbeat):
+    """
+    Hands over to a ready standby. Returns its process, or None if there is
+    no ready standby or it could not connect.
+    """
+    if not standby.available():
+        print("[Standby] Not ready", file=sys.stderr)
+        standby.cancel()
+        return None
+    heartbeat.starting()
+    p = standby.promote(CONNECT_TIMEOUT)
+    scoreboard = Scoreboard(args.scoreboard)
+    scoreboard.record(args.uid, STRATEGIES[standby.strategy_idx]["name"], p is not None, standby.connect_time)
+    scoreboard.save()
+    return p
+
+def serve(args, heartbeat, watchdog=None, failover=None, cold_restart=True):
+    """
+    Keeps a worker streaming until interrupted. With --standby, a warm
+    standby for the winning strategy is prepared next to every active
+    worker and promoted when that worker exits or is restarted; otherwise
+    (or when the standby is not ready or fails) the strategies are raced
+    again. Without cold_restart (exec mode), returns instead of racing
+    again. Returns False if the first race found no strategy.
+    """
+    failover = failover or FailoverLog(heartbeat)
+    standby = None
+    raced = False
+    try:
+        while True:
+            p = None
+            if standby is not None:
+                p, idx = promote(args, standby, heartbeat), standby.strategy_idx
+                standby = None
+                if p is not None:
+                    failover.replaced("warm")
+            if p is None:
+                if raced and not cold_restart:
+                    return True
+                if raced:
+                    time.sleep(DAEMON_RESTART_DELAY)
+                raced = True
+                p, idx = race(args, heartbeat)
+                if p is None:
+                    if not cold_restart:
+                        return False
+                    continue
+                failover.replaced("cold")
+            if args.standby:
+                standby = start_standby(args, idx, heartbeat)
+            try:
+                supervise(p, watchdog, failover)
+            except (KeyboardInterrupt, SystemExit):
+                p.terminate()
+                p.join(timeout=5)
+                sys.exit(0)
+            failover.failed(time.monotonic())
+    finally:
+        if standby is not None:
+            standby.cancel()
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="VTech Baby Monitor Bridge Smart Tester")
+    parser.add_argument("--uid", help="Camera UID")
+    parser.add_argument("--auth_key", help="Camera Auth Key")
+    parser.add_argument("--cameras", help="Options JSON with a cameras list; serves all of them from this process")
+    parser.add_argument("--region", type=int, help="SDK region for --cameras (default: best known for the first camera)")
+    parser.add_argument("--flush-policy", default="immediate", choices=FLUSH_POLICIES, help="When to flush video to stdout")
+    parser.add_argument("--flush-ms", type=int, default=40, help="Max delay of batched output (keyframe/interval policies)")
+    parser.add_argument("--flush-bytes", type=int, default=64 * 1024, help="Max size of batched output (keyframe/interval policies)")
+    parser.add_argument("--output-format", default="raw", choices=OUTPUT_FORMATS, help="raw: H.264/H.265 elementary stream, mpegts: MPEG-TS with camera timestamps")
+    parser.add_argument("--ring-kb", type=int, default=4096, help="Frame ring size between receive and write threads (KiB)")
+    parser.add_argument("--buffer-ceiling-kb", type=int, default=8192, help="Upper bound for all receive buffers together (KiB); each grows on demand")
+    parser.add_argument("--ring-frames", type=int, default=128, help="Max frames queued between receive and write threads")
+    parser.add_argument("--jitter-ms", type=int, default=0, help="Pace output by camera timestamps with up to this much delay (0: off)")
+    parser.add_argument("--jitter-adaptive", action="store_true", help="Adapt the jitter buffer delay to the arrival spread (--jitter-ms is the ceiling)")
+    parser.add_argument("--abr", action="store_true", help="Step the camera's stream quality down on congestion and back up when it clears")
+    parser.add_argument("--audio", action="store_true", help="Also receive audio (AUDIOSTART) and write it to a FIFO")
+    parser.add_argument("--audio-fifo", default="/tmp/vtech_audio", help="FIFO path for audio output")
+    parser.add_argument("--audio-format", default="mpegts", choices=AUDIO_FORMATS, help="mpegts: MPEG-TS for go2rtc, framed: timestamped records, raw: bare payload")
+    parser.add_argument("--scoreboard", default="/data/strategy_scores.json", help="Per-camera strategy statistics file")
+    parser.add_argument("--race", type=int, default=3, help="How many connection strategies to try in parallel")
+    parser.add_argument("--daemon", action="store_true", help="Stay up and serve the stream on --socket instead of stdout")
+    parser.add_argument("--idle-seconds", type=float, default=0, help="Daemon mode: pause the camera stream after this long without readers, keeping the session (0: never)")
+    parser.add_argument("--socket", default="/tmp/vtech_bridge.sock", help="Unix socket for daemon mode (read with attach.py)")
+    parser.add_argument("--request-keyframe", action="store_true", help="Ask the camera for an I-frame after frame loss instead of waiting for the next GOP")
+    parser.add_argument("--record-dir", default="", help="Record into this directory (rolling segments + clips); empty: off")
+    parser.add_argument("--record-mb", type=int, default=1024, help="Disk space for rolling segments per camera (MiB, 0: clips only)")
+    parser.add_argument("--pre-event-seconds", type=float, default=10, help="Video kept in RAM for the start of a clip")
+    parser.add_argument("--clip-seconds", type=float, default=20, help="Video recorded after a clip trigger (POST /clip)")
+    parser.add_argument("--capture-dir", default="", help="Capture raw frames, FRAMEINFO and arrival times here for replay (capture.py); empty: off")
+    parser.add_argument("--capture-mb", type=int, default=512, help="Disk space for captures per camera (MiB); the oldest files are deleted")
+    parser.add_argument("--standby", action="store_true", help="Keep a second worker initialised up to the connect step for fast failover")
+    parser.add_argument("--stall-seconds", type=float, default=STALL_SECONDS, help="Reconnect/restart when no frames arrive for this long (0: off)")
+    parser.add_argument("--log-level", default="info", choices=logs.LOG_LEVELS, help="Level of the stream/session log")
+    parser.add_argument("--native-log-level", default="warning", choices=session_mod.NATIVE_LOG_CHOICES, help="TUTK SDK log level (/var/log/iotc_native.log)")
+    parser.add_argument("--native-log-kb", type=int, default=1024, help="Size of one native log file before it rotates (KiB)")
+    parser.add_argument("--native-log-files", type=int, default=2, help="Native log files kept in rotation")
+    parser.add_argument("--metrics-port", type=int, default=0, help="Serve Prometheus metrics on this port (0: off)")
+    parser.add_argument("--metrics-file", default="", help="Rewrite this JSON file with the metrics every minute")
+    return parser
+
+def _terminate(signum, frame):
+    # Unwind through the finally blocks so the standby and the active
+    # worker are stopped with us (go2rtc stops exec sources with SIGTERM)
+    raise SystemExit(0)
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    logs.setup(args.log_level)
+    signal.signal(signal.SIGTERM, _terminate)
+
+    if args.cameras:
+        # Multi-camera: one process, one SDK init, one socket per camera
+        multicam.run(args, STRATEGIES)
+        return
+    if not args.uid or not args.auth_key:
+        parser.error("--uid and --auth_key are required unless --cameras is given")
+
+    # One heartbeat and watchdog for the life of this process, so MTTR and
+    # failover gaps cover restarts
+    heartbeat = Heartbeat()
+    watchdog = Watchdog(heartbeat, args.stall_seconds) if args.stall_seconds > 0 else None
+
+    if not args.daemon:
+        # go2rtc exec mode: one race per process, go2rtc respawns us. A
+        # standby keeps writing to the same stdout.
+        sys.exit(0 if serve(args, heartbeat, watchdog, cold_restart=False) else 1)
+
+    # Daemon mode: nobody respawns us, so keep cycling strategies/restarting
+    # the worker ourselves. Readers attach through the socket.
+    print(f"[Daemon] Serving on {args.socket}", file=sys.stderr)
+    serve(args, heartbeat, watchdog)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,132 @@
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+# Receive buffer sizing (bytes). Streams start at INITIAL_BUFFER, grow on
+# demand up to MAX_BUFFER and never go below MIN_BUFFER.
+INITIAL_BUFFER = 256 * 1024
+MIN_BUFFER = 64 * 1024
+MAX_BUFFER = 4 * 1024 * 1024
+
+# Default budget for all receive buffers of the process together
+DEFAULT_CEILING = 8 * 1024 * 1024
+
+# Frames looked at before deciding to shrink; the buffer shrinks when the
+# largest of them would have fit in a quarter of it
+SHRINK_WINDOW = 1500
+
+def _round_up(n):
+    # Next power of two, so sizes settle instead of creeping
+    size = MIN_BUFFER
+    while size < n:
+        size *= 2
+    return size
+
+class BufferManager:
+    """
+    Hands out receive-buffer sizes to streams under one process-wide
+    ceiling, so several cameras on a low-RAM device cannot together
+    allocate more than `ceiling` bytes of receive buffers.
+    """
+
+    def __init__(self, ceiling=DEFAULT_CEILING):
+        self.ceiling = ceiling
+        self.sizes = {}
+        self._lock = threading.Lock()
+
+    def request(self, name, size):
+        """
+        Asks to hold `size` bytes for `name`. Returns the granted size,
+        which is smaller if the ceiling does not allow it. Every stream
+        gets at least MIN_BUFFER.
+        """
+        with self._lock:
+            others = self.total - self.sizes.get(name, 0)
+            granted = max(min(size, self.ceiling - others), MIN_BUFFER)
+            self.sizes[name] = granted
+            return granted
+
+    def release(self, name):
+        with self._lock:
+            self.sizes.pop(name, None)
+
+    @property
+    def total(self):
+        return sum(self.sizes.values())
+
+    def stats_line(self):
+        sizes = ", ".join(f"{name} {size // 1024}KiB" for name, size in sorted(self.sizes.items()))
+        return f"{self.total // 1024}/{self.ceiling // 1024} KiB ({sizes})"
+
+class AdaptiveBuffer:
+    """
+    Sizing policy for one FrameReceiver. grow() is called when the SDK
+    reported a frame that did not fit (AV_ER_BUFPARA_MAXSIZE_INSUFF) and
+    resizes to the reported frame size; frame() tracks recent frame sizes
+    and shrinks the buffer after SHRINK_WINDOW frames that were all small.
+    Both run on the receive thread, the only user of the buffer.
+    """
+
+    def __init__(self, name, receiver, manager, initial=INITIAL_BUFFER, tag=None):
+        self.name = name
+        self.receiver = receiver
+        self.manager = manager
+        self.tag = tag or f"[{name}]"
+        self.log = log.getChild(name)
+        self.grows = 0
+        self.shrinks = 0
+        self.oversize = 0
+        self._window_max = 0
+        self._window_frames = 0
+        size = manager.request(name, initial)
+        if size != len(receiver.buf):
+            receiver.resize(size)
+
+    @property
+    def size(self):
+        return len(self.receiver.buf)
+
+    def frame(self, n):
+        if n > self._window_max:
+            self._window_max = n
+        self._window_frames += 1
+        if self._window_frames >= SHRINK_WINDOW:
+            target = _round_up(self._window_max * 2)
+            if target * 2 <= self.size:
+                self._resize(target)
+                self.shrinks += 1
+                self.log.info("%s Receive buffer shrunk to %d KiB (largest of last %d frames: %d bytes)",
+                              self.tag, self.size // 1024, self._window_frames, self._window_max)
+            self._window_max = 0
+            self._window_frames = 0
+
+    def grow(self, frame_size):
+        """
+        Returns True if the buffer now fits frame_size.
+        """
+        self.oversize += 1
+        target = min(_round_up(frame_size + frame_size // 4), MAX_BUFFER)
+        before = self.size
+        if target > before:
+            self._resize(target)
+        if self.size > before:
+            self.grows += 1
+            self.log.info("%s Receive buffer grown to %d KiB for a %d byte frame (total %s)",
+                          self.tag, self.size // 1024, frame_size, self.manager.stats_line())
+        if frame_size > self.size:
+            self.log.warning("%s Frame of %d bytes exceeds the receive buffer limit (%d KiB), dropping it",
+                             self.tag, frame_size, self.size // 1024)
+            return False
+        # The buffer was only just big enough or it grew; either way the
+        # window starts over so we don't shrink right back
+        self._window_max = max(self._window_max, frame_size)
+        return True
+
+    def _resize(self, size):
+        granted = self.manager.request(self.name, size)
+        if granted != self.size:
+            self.receiver.resize(granted)
+
+    def close(self):
+        self.manager.release(self.name)
@@ -0,0 +1,514 @@
+import argparse
+import array
+import collections
+import datetime
+import glob
+import logging
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+
+import logs
+
+log = logging.getLogger(__name__)
+
+# Raw session capture: everything avRecvFrameData2 returned, for replaying
+# field problems offline.
+#
+# The receive thread packs records into preallocated chunks; a writer
+# thread writes full chunks to disk. If the disk falls CHUNKS chunks behind,
+# records are dropped (and counted) instead of stalling the receive loop.
+# Files rotate at file_bytes and the oldest captures of a camera are
+# deleted once all of them together exceed the budget.
+#
+# File layout:
+#   FILE_HEADER
+#   records: RECORD, FRAMEINFO blob (info_size bytes), frame (ret bytes if ret > 0)
+#   index: count * INDEX_ENTRY      (written on close)
+#   FOOTER                          (written on close)
+# A file without footer (crash, power loss) is read by scanning the records.
+
+CAPTURE_MAGIC = b"VTCP"
+INDEX_MAGIC = b"VTCX"
+CAPTURE_VERSION = 1
+# magic, version, reserved, start time (epoch seconds)
+FILE_HEADER = struct.Struct("<4sHHd")
+# arrival (ns since file start), avRecvFrameData2 return value (frame length
+# or error code), frame index, FRAMEINFO size
+RECORD = struct.Struct("<qiIH")
+# record offset, arrival (ns), flags
+INDEX_ENTRY = struct.Struct("<QqI")
+# index offset, index count, magic
+FOOTER = struct.Struct("<QI4s")
+
+FLAG_KEYFRAME = 1
+FLAG_ERROR = 2
+
+SUFFIX = ".vtcap"
+
+# Write chunks handed from the receive thread to the writer thread
+CHUNK_SIZE = 1024 * 1024
+CHUNKS = 8
+
+# Partly filled chunks are written after this many seconds, so a crash
+# loses at most this much
+FLUSH_INTERVAL = 1.0
+
+# Largest capture file before rotating
+FILE_BYTES = 64 * 1024 * 1024
+
+class CaptureWriter:
+    """
+    Appends records for one camera to <directory>/<name>_<time>.vtcap.
+    frame() and error() are called on the receive thread and only copy into
+    memory; all file I/O happens on the capture thread.
+    """
+
+    def __init__(self, directory, name, budget_bytes, file_bytes=FILE_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.name = name
+        self.budget_bytes = budget_bytes
+        self.file_bytes = max(min(file_bytes, budget_bytes // 2), CHUNK_SIZE)
+        self.records = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.files = 0
+        self.path = None
+        self._free = queue.Queue()
+        for _ in range(CHUNKS):
+            self._free.put(bytearray(CHUNK_SIZE))
+        self._jobs = queue.Queue()
+        self._chunk = self._free.get()
+        self._pos = 0
+        self._last_handoff = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name=f"capture-{name}", daemon=True)
+        self._thread.start()
+        self._open()
+
+    def _open(self):
+        now = time.time()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"{int(now * 1000) % 1000:03d}"
+        self.path = os.path.join(self.directory, f"{self.name}_{stamp}{SUFFIX}")
+        self._jobs.put(("open", self.path, FILE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, 0, now)))
+        self._t0 = time.perf_counter()
+        self._file_pos = FILE_HEADER.size
+        self._offsets = array.array('Q')
+        self._arrivals = array.array('q')
+        self._flags = array.array('I')
+        self.files += 1
+
+    def _handoff(self):
+        self._last_handoff = time.perf_counter()
+        if self._chunk is not None and self._pos:
+            self._jobs.put(("data", self._chunk, self._pos, True))
+            self._chunk = None
+        self._pos = 0
+        if self._chunk is None:
+            try:
+                self._chunk = self._free.get_nowait()
+            except queue.Empty:
+                pass
+
+    def _finish(self):
+        self._handoff()
+        self._jobs.put(("close", self._offsets, self._arrivals, self._flags))
+
+    def frame(self, t, n, frame_idx, info, info_size, view, keyframe):
+        """
+        Records a received frame. t is the time.perf_counter() of arrival.
+        """
+        self._append(t, n, frame_idx, info, info_size, view, n, FLAG_KEYFRAME if keyframe else 0)
+
+    def error(self, t, code, frame_idx):
+        """
+        Records an error return of avRecvFrameData2 (other than no data).
+        """
+        self._append(t, code, frame_idx, None, 0, None, 0, FLAG_ERROR)
+
+    def _append(self, t, ret, frame_idx, info, info_size, view, n, flags):
+        size = RECORD.size + info_size + n
+        if self._file_pos + size > self.file_bytes and self._offsets:
+            self._finish()
+            self._open()
+        if self._chunk is None or self._pos + size > CHUNK_SIZE or t - self._last_handoff > FLUSH_INTERVAL:
+            self._handoff()
+            if self._chunk is None:
+                self.dropped += 1
+                return
+        if size > CHUNK_SIZE:
+            # Larger than a chunk (huge keyframe): its own buffer, once
+            buf, pos = bytearray(size), 0
+        else:
+            buf, pos = self._chunk, self._pos
+
+        ns = int((t - self._t0) * 1e9)
+        RECORD.pack_into(buf, pos, ns, ret, frame_idx & 0xffffffff, info_size)
+        pos += RECORD.size
+        if info_size:
+            buf[pos:pos + info_size] = info[:info_size]
+            pos += info_size
+        if n:
+            buf[pos:pos + n] = view[:n]
+            pos += n
+
+        if buf is self._chunk:
+            self._pos = pos
+        else:
+            self._jobs.put(("data", buf, size, False))
+        self._offsets.append(self._file_pos)
+        self._arrivals.append(ns)
+        self._flags.append(flags)
+        self._file_pos += size
+        self.records += 1
+        self.bytes += size
+
+    def _run(self):
+        f = None
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            kind = job[0]
+            try:
+                if kind == "open":
+                    f = open(job[1], 'wb', buffering=0)
+                    f.write(job[2])
+                elif kind == "data":
+                    if f is not None:
+                        f.write(memoryview(job[1])[:job[2]])
+                elif kind == "close" and f is not None:
+                    offsets, arrivals, flags = job[1:]
+                    index = bytearray(len(offsets) * INDEX_ENTRY.size)
+                    for i in range(len(offsets)):
+                        INDEX_ENTRY.pack_into(index, i * INDEX_ENTRY.size, offsets[i], arrivals[i], flags[i])
+                    index_offset = f.tell()
+                    f.write(index)
+                    f.write(FOOTER.pack(index_offset, len(offsets), INDEX_MAGIC))
+                    f.close()
+                    f = None
+                    self._prune()
+            except OSError as e:
+                log.warning("[Capture] %s: write failed, capture stops until the next file: %s", self.name, e)
+                if f is not None:
+                    f.close()
+                f = None
+            finally:
+                if kind == "data" and job[3]:
+                    self._free.put(job[1])
+        if f is not None:
+            f.close()
+
+    def _prune(self):
+        files = sorted(glob.glob(os.path.join(self.directory, f"{glob.escape(self.name)}_*{SUFFIX}")))
+        sizes = {}
+        for path in files:
+            try:
+                sizes[path] = os.path.getsize(path)
+            except OSError:
+                sizes[path] = 0
+        total = sum(sizes.values())
+        for path in files:
+            if total <= self.budget_bytes or path == self.path:
+                break
+            try:
+                os.unlink(path)
+                log.info("[Capture] Deleted %s (over %d MiB)", os.path.basename(path), self.budget_bytes // 1048576)
+            except OSError:
+                pass
+            total -= sizes[path]
+
+    def stats_line(self):
+        return (f"{os.path.basename(self.path)}, {self.records} records, {self.bytes // 1048576} MiB, "
+                f"{self.files} files, dropped {self.dropped}")
+
+    def close(self):
+        self._finish()
+        self._jobs.put(None)
+        self._thread.join(timeout=10)
+
+class CaptureReader:
+    """
+    Sequential and indexed access to a capture file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, 'rb')
+        header = self.f.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size:
+            raise ValueError(f"{path}: not a capture file")
+        magic, version, _, self.start_time = FILE_HEADER.unpack(header)
+        if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+            raise ValueError(f"{path}: not a capture file (magic {magic!r}, version {version})")
+        self.data_start = FILE_HEADER.size
+        size = os.fstat(self.f.fileno()).st_size
+        self.end = size
+        self.index = None # [(offset, arrival ns, flags)]
+        if size >= self.data_start + FOOTER.size:
+            self.f.seek(size - FOOTER.size)
+            index_offset, count, magic = FOOTER.unpack(self.f.read(FOOTER.size))
+            if magic == INDEX_MAGIC and index_offset + count * INDEX_ENTRY.size + FOOTER.size == size:
+                self.f.seek(index_offset)
+                data = self.f.read(count * INDEX_ENTRY.size)
+                self.index = [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size) for i in range(count)]
+                self.end = index_offset
+        self.f.seek(self.data_start)
+
+    def seek(self, offset):
+        self.f.seek(offset)
+
+    def tell(self):
+        return self.f.tell()
+
+    def next_record(self):
+        """
+        Reads the next record header: (arrival ns, ret, frame_idx, info_size)
+        or None at the end. The FRAMEINFO blob and frame follow; read them
+        with read_into() or skip them with skip().
+        """
+        if self.f.tell() + RECORD.size > self.end:
+            return None
+        data = self.f.read(RECORD.size)
+        if len(data) < RECORD.size:
+            return None
+        return RECORD.unpack(data)
+
+    def read_into(self, view, n):
+        return self.f.readinto(view[:n]) == n
+
+    def skip(self, n):
+        self.f.seek(n, os.SEEK_CUR)
+
+    def entries(self):
+        """
+        The index, or the same list built by scanning a file without one.
+        """
+        if self.index is not None:
+            return self.index
+        entries = []
+        pos = self.f.tell()
+        self.f.seek(self.data_start)
+        while True:
+            offset = self.f.tell()
+            record = self.next_record()
+            if record is None:
+                break
+            arrival, ret, _, info_size = record
+            length = info_size + max(ret, 0)
+            if offset + RECORD.size + length > self.end:
+                break # truncated last record
+            flags = FLAG_ERROR if ret < 0 else 0
+            if ret > 0 and info_size >= 3:
+                # FRAMEINFO flags byte, bit 0: I-frame
+                if self.f.read(3)[2] & 1:
+                    flags |= FLAG_KEYFRAME
+                length -= 3
+            self.skip(length)
+            entries.append((offset, arrival, flags))
+        self.f.seek(pos)
+        return entries
+
+    def close(self):
+        self.f.close()
+
+class ReplayReceiver:
+    """
+    Plays a capture back with the FrameReceiver interface, so CameraStream
+    and everything behind it run exactly as for a live camera. Records are
+    due at their original arrival times divided by `speed` (0: as fast as
+    they are asked for); until then recv() returns AV_ER_DATA_NOREADY.
+    Recorded errors come back as they were. At the end of the capture
+    recv() reports a closed session, unless `loop` starts it over.
+    """
+
+    def __init__(self, path, speed=1.0, loop=False, start=0.0, buf_size=1024 * 1024):
+        import ctypes
+        import iotc
+        self.iotc = iotc
+        self.reader = CaptureReader(path)
+        self.speed = speed
+        self.loop = loop
+        self.av_index = 0
+        self.finished = False
+        self.resize(buf_size)
+        self._frame_info = (ctypes.c_byte * iotc.FRAME_INFO_MAX_SIZE)()
+        self.frame_info_raw = memoryview(self._frame_info).cast('B')
+        self.frame_info = iotc.FrameInfo.from_buffer(self._frame_info)
+        self._frame_info_size = 0
+        self._out_frame_size = 0
+        self._pending = None
+        self._t0 = None
+        self._first = self.reader.data_start
+        if start > 0:
+            # Start at the last keyframe at or before `start` seconds
+            for offset, arrival, flags in self.reader.entries():
+                if arrival > start * 1e9:
+                    break
+                if flags & FLAG_KEYFRAME:
+                    self._first = offset
+        self.reader.seek(self._first)
+
+    def resize(self, buf_size):
+        self.buf = bytearray(buf_size)
+        self.view = memoryview(self.buf)
+
+    @property
+    def out_frame_size(self):
+        return self._out_frame_size
+
+    @property
+    def frame_info_size(self):
+        return self._frame_info_size
+
+    def _next(self):
+        record = self.reader.next_record()
+        if record is None and self.loop:
+            self.reader.seek(self._first)
+            self._t0 = None
+            record = self.reader.next_record()
+        if record is None:
+            return None
+        info_size = record[3]
+        keep = min(info_size, len(self.frame_info_raw))
+        self.reader.read_into(self.frame_info_raw, keep)
+        if info_size > keep:
+            self.reader.skip(info_size - keep)
+        self._frame_info_size = keep
+        return record
+
+    def recv(self):
+        record = self._pending or self._next()
+        if record is None:
+            self.finished = True
+            return self.iotc.AV_ER_SESSION_CLOSE_BY_REMOTE, 0, self.frame_info
+        arrival, ret, frame_idx, _ = record
+        if self.speed:
+            now = time.monotonic()
+            if self._t0 is None:
+                self._t0 = now - arrival / 1e9 / self.speed
+            if now < self._t0 + arrival / 1e9 / self.speed:
+                self._pending = record
+                return self.iotc.AV_ER_DATA_NOREADY, frame_idx, self.frame_info
+        if ret > len(self.buf):
+            # Like the SDK, report the size so the caller can grow the buffer;
+            # unlike it, keep the frame for the next call
+            self._pending = record
+            self._out_frame_size = ret
+            return self.iotc.AV_ER_BUFPARA_MAXSIZE_INSUFF, frame_idx, self.frame_info
+        self._pending = None
+        if ret > 0:
+            self._out_frame_size = ret
+            if not self.reader.read_into(self.view, ret):
+                self.finished = True
+                return self.iotc.AV_ER_SESSION_CLOSE_BY_REMOTE, 0, self.frame_info
+        elif ret == self.iotc.AV_ER_BUFPARA_MAXSIZE_INSUFF:
+            self._out_frame_size = 0
+        return ret, frame_idx, self.frame_info
+
+class ReplaySession:
+    """
+    Stands in for CameraSession during replay: a recorded disconnect
+    "reconnects" at once, the end of the capture ends the stream.
+    """
+
+    def __init__(self, receiver):
+        self.receiver = receiver
+        self.sid = -1
+        self.av_index = receiver.av_index
+        self.channel = 0
+        self.reconnects = 0
+
+    def reconnect(self, should_stop=None):
+        if self.receiver.finished:
+            return False
+        self.reconnects += 1
+        return True
+
+    def close(self):
+        pass
+
+def summary(path):
+    reader = CaptureReader(path)
+    entries = reader.entries()
+    frames = keyframes = total = 0
+    errors = collections.Counter()
+    codec = None
+    for offset, arrival, flags in entries:
+        reader.seek(offset)
+        _, ret, _, info_size = reader.next_record()
+        if ret > 0:
+            frames += 1
+            total += ret
+            if flags & FLAG_KEYFRAME:
+                keyframes += 1
+            if codec is None and info_size >= 2:
+                codec = int.from_bytes(reader.f.read(2), "little")
+        else:
+            errors[ret] += 1
+    duration = entries[-1][1] / 1e9 if entries else 0
+    reader.close()
+    return {"path": path, "start": reader.start_time, "duration": duration, "records": len(entries),
+            "frames": frames, "keyframes": keyframes, "bytes": total, "errors": dict(errors),
+            "codec": codec, "indexed": reader.index is not None}
+
+def replay(path, out_fd, speed=1.0, loop=False, start=0.0):
+    """
+    Feeds a capture through CameraStream (ring, writer thread, loss
+    handling, metrics) into out_fd.
+    """
+    import bridge
+    from output import FrameWriter
+    from stream import CameraStream
+
+    opts = bridge.build_parser().parse_args(["--uid", "REPLAY", "--auth_key", "replay"])
+    receiver = ReplayReceiver(path, speed, loop, start)
+    session = ReplaySession(receiver)
+    writer = FrameWriter(out_fd, opts.flush_policy, opts.flush_ms, opts.flush_bytes)
+    label = os.path.basename(path).rsplit(".", 1)[0]
+    stream = CameraStream("Replay", session, writer, opts, receiver=receiver, label=label)
+    t0 = time.monotonic()
+    try:
+        stream.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stream.stop()
+    log.info("[Replay] %d frames in %.1fs (%d recorded disconnects)", stream.metrics.frames.value,
+             time.monotonic() - t0, session.reconnects)
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and replay VTech bridge session captures")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_info = sub.add_parser("info", help="Summarise capture files")
+    p_info.add_argument("files", nargs="+")
+    p_replay = sub.add_parser("replay", help="Replay a capture through the output pipeline to stdout")
+    p_replay.add_argument("file")
+    p_replay.add_argument("--speed", type=float, default=1.0, help="Playback speed (1: original timing, 0: as fast as possible)")
+    p_replay.add_argument("--loop", action="store_true", help="Start over at the end")
+    p_replay.add_argument("--start", type=float, default=0.0, help="Start at the keyframe before this many seconds in")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        for path in args.files:
+            s = summary(path)
+            start = datetime.datetime.fromtimestamp(s["start"]).isoformat(timespec="seconds")
+            fps = s["frames"] / s["duration"] if s["duration"] else 0
+            kbps = s["bytes"] * 8 / 1000 / s["duration"] if s["duration"] else 0
+            errors = ", ".join(f"{code}: {n}" for code, n in sorted(s["errors"].items())) or "none"
+            codec = f"0x{s['codec']:02X}" if s["codec"] is not None else "-"
+            print(f"{os.path.basename(path)}  {start}  {s['duration']:.1f}s  {s['frames']} frames "
+                  f"({s['keyframes']} keyframes, {fps:.1f} fps, {kbps:.0f} kbit/s, codec {codec})  "
+                  f"errors {errors}{'' if s['indexed'] else '  [no index, scanned]'}")
+        return
+
+    # Replay never talks to a camera, so it needs no native library
+    os.environ.setdefault("IOTC_BACKEND", "fake")
+    logs.setup()
+    replay(args.file, sys.stdout.fileno(), args.speed, args.loop, args.start)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,421 @@
+import collections
+import ctypes
+import os
+import random
+import sys
+import threading
+import time
+
+# Python stand-in for the parts of libIOTCAPIs/libAVAPIs that iotc.py uses.
+# Select it with IOTC_BACKEND=fake. Every function is a CFUNCTYPE callback,
+# so iotc.py binds and calls it exactly like the native library (argtypes,
+# byref out-params, buffers) and the bridge runs unmodified.
+#
+# Behaviour is configured through the environment, so it reaches worker
+# processes too:
+#   FAKE_TUTK_FILE        H.264 Annex B file to replay in a loop
+#                         (default: synthetic frames)
+#   FAKE_TUTK_FPS         frame rate, 0 = as fast as frames are requested (25)
+#   FAKE_TUTK_BITRATE     synthetic stream bitrate in kbit/s (1000)
+#   FAKE_TUTK_GOP         synthetic frames per keyframe (25)
+#   FAKE_TUTK_JITTER_MS   uniform arrival jitter, +/- ms (0)
+#   FAKE_TUTK_BURST_MS    hold frames back and deliver them together every
+#                         N ms, like a bursty relay; 0 = off (0)
+#   FAKE_TUTK_LOSS        probability a frame is lost in transit (0)
+#   FAKE_TUTK_LINK_KBPS   link capacity in kbit/s; frames beyond it are lost
+#                         in transit, 0 = unlimited (0)
+#   FAKE_TUTK_STREAMCTRL  answer SETSTREAMCTRL/GETSTREAMCTRL (quality levels
+#                         scale the synthetic frames), 0 = ignore them (1)
+#   FAKE_TUTK_DISCONNECT  drop the session every N frames, 0 = never (0)
+#   FAKE_TUTK_STALL       stop sending after N frames of a channel while the
+#                         session stays up, 0 = never (0)
+#   FAKE_TUTK_HANG        block inside avRecvFrameData2 after N frames of a
+#                         channel, 0 = never (0)
+#   FAKE_TUTK_CONNECT_MS  time IOTC_Connect_* takes (50)
+#   FAKE_TUTK_SEED        random seed (1)
+#
+# Synthetic frames carry their arrival time (CLOCK_MONOTONIC ns, 16 hex
+# digits right after the NAL header) so benchmark.py can measure latency
+# through the whole bridge. See stamp_time()/read_stamp().
+
+IOTYPE_USER_IPCAM_START = 0x1FF
+IOTYPE_USER_IPCAM_STOP = 0x2FF
+IOTYPE_USER_IPCAM_SETSTREAMCTRL_REQ = 0x320
+IOTYPE_USER_IPCAM_SETSTREAMCTRL_RESP = 0x321
+IOTYPE_USER_IPCAM_GETSTREAMCTRL_REQ = 0x322
+IOTYPE_USER_IPCAM_GETSTREAMCTRL_RESP = 0x323
+
+# Share of the synthetic frame size sent per quality level (max .. min)
+QUALITY_SCALE = {1: 1.0, 2: 0.75, 3: 0.5, 4: 0.3, 5: 0.15}
+
+MEDIA_CODEC_VIDEO_H264 = 0x4E
+
+AV_ER_BUFPARA_MAXSIZE_INSUFF = -20001
+AV_ER_INVALID_SID = -20010
+AV_ER_DATA_NOREADY = -20012
+AV_ER_SESSION_CLOSE_BY_REMOTE = -20015
+AV_ER_TIMEOUT = -20011
+
+STAMP_OFFSET = 5
+STAMP_SIZE = 16
+
+FAKE_VERSION = (4 << 24) | (3 << 16) | (2 << 8) | 1
+
+def _env(name, default, cast=float):
+    value = os.getenv(name)
+    return cast(value) if value not in (None, "") else default
+
+def read_stamp(frame):
+    """
+    Arrival time (monotonic ns) embedded in a synthetic frame, or None.
+    """
+    try:
+        return int(bytes(frame[STAMP_OFFSET:STAMP_OFFSET + STAMP_SIZE]), 16)
+    except ValueError:
+        return None
+
+def split_annexb(data):
+    """
+    Splits an H.264 Annex B stream into frames: any parameter sets/SEI plus
+    the slice that follows them. Multi-slice pictures come out as several
+    frames, which is close enough for replay. Returns [(bytes, keyframe)].
+    """
+    starts = []
+    i = data.find(b"\x00\x00\x01")
+    while i >= 0:
+        begin = i - 1 if i > 0 and data[i - 1] == 0 else i
+        starts.append((begin, i + 3))
+        i = data.find(b"\x00\x00\x01", i + 3)
+    frames = []
+    frame_start = None
+    keyframe = False
+    for n, (begin, payload) in enumerate(starts):
+        if frame_start is None:
+            frame_start = begin
+        nal_type = data[payload] & 0x1f if payload < len(data) else 0
+        if nal_type == 5:
+            keyframe = True
+        if nal_type in (1, 5):
+            end = starts[n + 1][0] if n + 1 < len(starts) else len(data)
+            frames.append((data[frame_start:end], keyframe))
+            frame_start = None
+            keyframe = False
+    return frames
+
+class FrameSource:
+    """
+    Preallocated frames the fake camera sends, either replayed from a file
+    or synthetic (IDR every `gop` frames, sizes from the bitrate).
+    """
+
+    def __init__(self, path=None, fps=25, bitrate_kbps=1000, gop=25):
+        self.synthetic = not path
+        if path:
+            with open(path, 'rb') as f:
+                self.frames = split_annexb(f.read())
+            if not self.frames:
+                raise ValueError(f"No H.264 frames found in {path}")
+        else:
+            avg = max(int(bitrate_kbps * 1000 / 8 / max(fps or 25, 1)), 64)
+            key = avg * 4 if gop > 1 else avg
+            p = max((avg * gop - key) // max(gop - 1, 1), 32)
+            self.frames = [(self._synthetic(key, True), True)] + [(self._synthetic(p, False), False)] * (gop - 1)
+
+    @staticmethod
+    def _synthetic(size, keyframe):
+        frame = bytearray(b"\xaa" * size)
+        frame[0:5] = b"\x00\x00\x00\x01" + (b"\x65" if keyframe else b"\x41")
+        return bytes(frame)
+
+class _Camera:
+    def __init__(self):
+        self.fps = _env("FAKE_TUTK_FPS", 25.0)
+        self.jitter = _env("FAKE_TUTK_JITTER_MS", 0.0) / 1000.0
+        self.burst = _env("FAKE_TUTK_BURST_MS", 0.0) / 1000.0
+        self.loss = _env("FAKE_TUTK_LOSS", 0.0)
+        self.link = _env("FAKE_TUTK_LINK_KBPS", 0.0) * 1000 / 8
+        self.streamctrl = _env("FAKE_TUTK_STREAMCTRL", 1, int)
+        self.disconnect = _env("FAKE_TUTK_DISCONNECT", 0, int)
+        self.stall = _env("FAKE_TUTK_STALL", 0, int)
+        self.hang = _env("FAKE_TUTK_HANG", 0, int)
+        self.connect_delay = _env("FAKE_TUTK_CONNECT_MS", 50.0) / 1000.0
+        self.random = random.Random(_env("FAKE_TUTK_SEED", 1, int))
+        self.source = FrameSource(os.getenv("FAKE_TUTK_FILE"), self.fps,
+                                  _env("FAKE_TUTK_BITRATE", 1000.0), _env("FAKE_TUTK_GOP", 25, int))
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.next_sid = 0
+        self.channels = {} # av_index -> _Channel
+
+class _Channel:
+    def __init__(self, sid):
+        self.sid = sid
+        self.streaming = False
+        self.frame_idx = 0
+        self.position = 0
+        self.next_due = time.monotonic()
+        self.burst_start = self.next_due
+        self.sent = 0
+        self.quality = 1
+        self.credit = 0.0
+        self.credit_time = self.next_due
+        self.ioctrl = collections.deque() # (type, payload) for avRecvIOCtrl
+
+_cam = None
+
+def _camera():
+    global _cam
+    if _cam is None:
+        _cam = _Camera()
+    return _cam
+
+def reset():
+    """
+    Forgets the simulated camera; the next call re-reads FAKE_TUTK_*.
+    """
+    global _cam
+    _cam = None
+
+# --- IOTC ---
+
+@ctypes.CFUNCTYPE(None, ctypes.c_void_p)
+def IOTC_Set_Log_Attr(attr):
+    pass
+
+@ctypes.CFUNCTYPE(ctypes.c_int)
+def IOTC_Get_SessionID():
+    cam = _camera()
+    with cam.lock:
+        cam.next_sid += 1
+        return cam.next_sid
+
+@ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_int)
+def TUTK_SDK_Set_Region(region):
+    return 0
+
+@ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_char_p)
+def TUTK_SDK_Set_License_Key(key):
+    return 0
+
+@ctypes.CFUNCTYPE(None, ctypes.c_void_p)
+def IOTC_Get_Version(out):
+    ctypes.c_uint.from_address(out).value = FAKE_VERSION
+
+@ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_ushort)
+def IOTC_Initialize2(port):
+    _camera()
+    return 0
+
+@ctypes.CFUNCTYPE(None, ctypes.c_uint)
+def IOTC_Set_Max_Session_Number(n):
+    pass
+
+@ctypes.CFUNCTYPE(ctypes.c_int)
+def IOTC_DeInitialize():
+    return 0
+
+def _connect(sid=None):
+    cam = _camera()
+    time.sleep(cam.connect_delay)
+    with cam.lock:
+        if sid is None:
+            cam.next_sid += 1
+            sid = cam.next_sid
+        cam.sessions.add(sid)
+    return sid
+
+@ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_char_p, ctypes.c_int)
+def IOTC_Connect_ByUID_Parallel(uid, sid):
+    return _connect(sid)
+
+@ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_char_p)
+def IOTC_Connect_ByUID(uid):
+    return _connect()
+
+@ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_void_p)
+def IOTC_Connect_ByUIDEx(uid, sid, connect_input):
+    return _connect(sid)
+
+@ctypes.CFUNCTYPE(None, ctypes.c_int)
+def IOTC_Session_Close(sid):
+    cam = _camera()
+    with cam.lock:
+        cam.sessions.discard(sid)
+
+@ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_int, ctypes.c_void_p)
+def IOTC_Session_Check(sid, info):
+    return 0 if sid in _camera().sessions else -14 # IOTC_ER_INVALID_SID
+
+# --- AV ---
+
+@ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_int)
+def avInitialize(n):
+    return 0
+
+@ctypes.CFUNCTYPE(ctypes.c_int)
+def avDeInitialize():
+    return 0
+
+def _start_channel(sid):
+    cam = _camera()
+    with cam.lock:
+        if sid not in cam.sessions:
+            return AV_ER_INVALID_SID
+        av_index = 0
+        while av_index in cam.channels:
+            av_index += 1
+        cam.channels[av_index] = _Channel(sid)
+        return av_index
+
+@ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_int, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_uint, ctypes.c_void_p, ctypes.c_uint)
+def avClientStart(sid, user, pwd, timeout, serv_type, channel):
+    return _start_channel(sid)
+
+@ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
+def avClientStartEx(cfg_in, cfg_out):
+    # AVClientStartInConfig: cb (u32), iotc_session_id (u32), ...
+    return _start_channel(ctypes.c_uint32.from_address(cfg_in + 4).value)
+
+@ctypes.CFUNCTYPE(None, ctypes.c_int)
+def avClientStop(av_index):
+    cam = _camera()
+    with cam.lock:
+        cam.channels.pop(av_index, None)
+
+@ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_int, ctypes.c_uint, ctypes.c_void_p, ctypes.c_int)
+def avSendIOCtrl(av_index, io_type, data, size):
+    ch = _camera().channels.get(av_index)
+    if ch is None:
+        return AV_ER_INVALID_SID
+    if io_type == IOTYPE_USER_IPCAM_START:
+        # (Re)starting the stream restarts the GOP, like the real cameras
+        ch.streaming = True
+        ch.position = 0
+        ch.next_due = min(ch.next_due, time.monotonic())
+    elif io_type == IOTYPE_USER_IPCAM_STOP:
+        ch.streaming = False
+    elif io_type == IOTYPE_USER_IPCAM_SETSTREAMCTRL_REQ and _camera().streamctrl:
+        quality = ctypes.c_uint8.from_address(data + 4).value if size >= 5 else 0
+        ok = quality in QUALITY_SCALE
+        if ok:
+            ch.quality = quality
+        ch.ioctrl.append((IOTYPE_USER_IPCAM_SETSTREAMCTRL_RESP, (0 if ok else -1).to_bytes(4, "little", signed=True) + bytes(4)))
+    elif io_type == IOTYPE_USER_IPCAM_GETSTREAMCTRL_REQ and _camera().streamctrl:
+        ch.ioctrl.append((IOTYPE_USER_IPCAM_GETSTREAMCTRL_RESP, bytes(4) + bytes((ch.quality, 0, 0, 0))))
+    return 0
+
+@ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p,
+                  ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
+def avRecvFrameData2(av_index, buf, buf_size, out_buf_size, out_frame_size, frame_info, info_size, out_info_size, out_frame_idx):
+    cam = _camera()
+    ch = cam.channels.get(av_index)
+    if ch is None:
+        return AV_ER_INVALID_SID
+    if not ch.streaming or (cam.stall and ch.sent >= cam.stall):
+        return AV_ER_DATA_NOREADY
+    if cam.hang and ch.sent >= cam.hang:
+        while True:
+            time.sleep(3600)
+
+    now = time.monotonic()
+    if cam.fps:
+        due = ch.next_due
+        if cam.burst:
+            # Delivered with the rest of its burst, at the end of the period
+            due = ch.burst_start + (int((due - ch.burst_start) / cam.burst) + 1) * cam.burst
+        if now < due:
+            return AV_ER_DATA_NOREADY
+        arrived = due
+        interval = 1.0 / cam.fps
+        if cam.jitter:
+            interval = max(0.0, interval + cam.random.uniform(-cam.jitter, cam.jitter))
+        ch.next_due += interval
+    else:
+        arrived = now
+
+    frames = cam.source.frames
+    data, keyframe = frames[ch.position]
+    ch.position = (ch.position + 1) % len(frames)
+    ch.frame_idx += 1
+    ch.sent += 1
+
+    if cam.disconnect and ch.sent % cam.disconnect == 0:
+        with cam.lock:
+            cam.channels.pop(av_index, None)
+        return AV_ER_SESSION_CLOSE_BY_REMOTE
+    if cam.loss and cam.random.random() < cam.loss:
+        # Lost in transit: the index moves on, nothing is delivered
+        return AV_ER_DATA_NOREADY
+
+    n = len(data)
+    if cam.source.synthetic and ch.quality != 1:
+        n = max(int(n * QUALITY_SCALE[ch.quality]), STAMP_OFFSET + STAMP_SIZE)
+    if cam.link:
+        # Token bucket holding up to half a second of the link's capacity
+        ch.credit = min(ch.credit + (arrived - ch.credit_time) * cam.link, cam.link / 2)
+        ch.credit_time = arrived
+        if n > ch.credit:
+            return AV_ER_DATA_NOREADY
+        ch.credit -= n
+    ctypes.c_int.from_address(out_frame_size).value = n
+    if n > buf_size:
+        return AV_ER_BUFPARA_MAXSIZE_INSUFF
+    ctypes.memmove(buf, data, n)
+    if cam.source.synthetic and n >= STAMP_OFFSET + STAMP_SIZE:
+        ctypes.memmove(buf + STAMP_OFFSET, b"%016x" % int(arrived * 1e9), STAMP_SIZE)
+    ctypes.c_int.from_address(out_buf_size).value = n
+
+    # FRAMEINFO_t: codec_id u16, flags u8, cam_index, online_num, reserved[3], reserved2 u32, timestamp u32
+    ctypes.memset(frame_info, 0, 16)
+    ctypes.c_uint16.from_address(frame_info).value = MEDIA_CODEC_VIDEO_H264
+    ctypes.c_uint8.from_address(frame_info + 2).value = 1 if keyframe else 0
+    ctypes.c_uint32.from_address(frame_info + 12).value = int(ch.frame_idx * 1000 / (cam.fps or 25)) & 0xffffffff
+    ctypes.c_int.from_address(out_info_size).value = 16
+    ctypes.c_int.from_address(out_frame_idx).value = ch.frame_idx
+    return n
+
+@ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p)
+def avRecvAudioData(av_index, buf, buf_size, frame_info, info_size, out_frame_idx):
+    return AV_ER_DATA_NOREADY
+
+@ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.c_uint)
+def avRecvIOCtrl(av_index, out_type, buf, size, timeout_ms):
+    deadline = time.monotonic() + timeout_ms / 1000.0
+    while True:
+        ch = _camera().channels.get(av_index)
+        if ch is None:
+            return AV_ER_INVALID_SID
+        if ch.ioctrl:
+            io_type, payload = ch.ioctrl.popleft()
+            n = min(len(payload), size)
+            ctypes.memmove(buf, payload, n)
+            ctypes.c_uint.from_address(out_type).value = io_type
+            return n
+        if time.monotonic() >= deadline:
+            return AV_ER_TIMEOUT
+        time.sleep(0.01)
+
+class FakeLibrary:
+    """
+    Looks like a ctypes.CDLL: symbols are attributes. Each attribute lookup
+    hands out the same callback object, so argtypes set by iotc.py stick.
+    """
+
+    def __init__(self, names):
+        module = sys.modules[__name__]
+        for name in names:
+            setattr(self, name, getattr(module, name))
+
+IOTC_SYMBOLS = ["IOTC_Set_Log_Attr", "IOTC_Get_SessionID", "TUTK_SDK_Set_Region", "TUTK_SDK_Set_License_Key",
+                "IOTC_Get_Version", "IOTC_Initialize2", "IOTC_Set_Max_Session_Number", "IOTC_DeInitialize",
+                "IOTC_Connect_ByUID_Parallel", "IOTC_Connect_ByUID", "IOTC_Connect_ByUIDEx",
+                "IOTC_Session_Close", "IOTC_Session_Check"]
+AV_SYMBOLS = ["avInitialize", "avDeInitialize", "avClientStart", "avClientStartEx", "avClientStop",
+              "avSendIOCtrl", "avRecvFrameData2", "avRecvAudioData", "avRecvIOCtrl"]
+
+def load():
+    """
+    Returns (iotc library, av library) stand-ins for iotc.py.
+    """
+    print("[FakeTUTK] Using the Python stand-in for libIOTCAPIs/libAVAPIs", file=sys.stderr)
+    return FakeLibrary(IOTC_SYMBOLS), FakeLibrary(AV_SYMBOLS)
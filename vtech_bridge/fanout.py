@@ -0,0 +1,247 @@
+import collections
+import logging
+import os
+import socket
+import threading
+import time
+
+from paramcache import ParamCache
+
+log = logging.getLogger(__name__)
+
+# Per-reader backlog before a slow reader is skipped to the next keyframe
+MAX_CLIENT_BACKLOG = 2 * 1024 * 1024
+
+class _Client:
+    def __init__(self, sock, max_backlog):
+        self.sock = sock
+        self.max_backlog = max_backlog
+        self.pending = bytearray()
+        # Stream positions (bytes ever queued) where the frames still in
+        # pending end, and the position just past the last one
+        self.frame_ends = collections.deque()
+        self.position = 0
+        self.waiting_keyframe = True
+        self.dead = False
+        self.dropped = 0
+        self.attached = time.monotonic()
+        self.first_picture = None # seconds from attach to the first keyframe queued
+        self.primed_bytes = 0
+
+    def prime(self, views):
+        """
+        Queues the cached parameter sets and keyframe. The live stream still
+        resumes at the next keyframe: the frames in between reference ones
+        this reader never got.
+        """
+        for view in views:
+            n = self._send(view) if not self.pending else 0
+            self._queue(view, n)
+            self.primed_bytes += len(view)
+        if views:
+            self.first_picture = time.monotonic() - self.attached
+
+    def send(self, view, keyframe):
+        if self.waiting_keyframe:
+            if not keyframe:
+                return
+            self.waiting_keyframe = False
+            if self.first_picture is None:
+                self.first_picture = time.monotonic() - self.attached
+
+        if self.pending:
+            self.drain()
+            if self.pending:
+                if len(self.pending) + len(view) > self.max_backlog:
+                    # Reader is too slow, resync it on the next keyframe
+                    self._drop_queued()
+                    self.waiting_keyframe = True
+                    self.dropped += 1
+                else:
+                    self._queue(view, 0)
+                return
+
+        n = self._send(view)
+        if not self.dead:
+            self._queue(view, n)
+
+    def _queue(self, view, sent):
+        """
+        Accounts for view, of which the first `sent` bytes went out already,
+        and queues the rest.
+        """
+        self.position += len(view)
+        if sent < len(view):
+            self.pending += view[sent:]
+            self.frame_ends.append(self.position)
+
+    def _drop_queued(self):
+        """
+        Drops the queued frames but keeps the unsent tail of the one being
+        written, so the reader never gets a cut-off frame (or, with MPEG-TS,
+        a stream that lost its packet alignment).
+        """
+        start = self.position - len(self.pending)
+        keep = self.frame_ends[0] - start if self.frame_ends else 0
+        del self.pending[keep:]
+        self.position = start + keep
+        while len(self.frame_ends) > (1 if keep else 0):
+            self.frame_ends.pop()
+
+    def drain(self):
+        if self.pending:
+            n = self._send(self.pending)
+            if n:
+                del self.pending[:n]
+                start = self.position - len(self.pending)
+                while self.frame_ends and self.frame_ends[0] <= start:
+                    self.frame_ends.popleft()
+
+    def _send(self, data):
+        try:
+            return self.sock.send(data)
+        except BlockingIOError:
+            return 0
+        except OSError:
+            self.dead = True
+            return 0
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+class FanoutServer:
+    """
+    Publishes the stream on a Unix socket to any number of readers (go2rtc
+    via attach.py, a recorder, a snapshotter...). Drop-in output stage for
+    WriterThread: write()/tick()/flush().
+
+    Sockets are non-blocking, so a slow reader only affects itself: it gets a
+    bounded backlog and is skipped to the next keyframe when that overflows.
+    New readers first get the last keyframe and parameter sets from the
+    ParamCache, then the live stream from the next keyframe on. The time
+    from attach to the first keyframe is logged per reader.
+    """
+
+    def __init__(self, path, max_backlog=MAX_CLIENT_BACKLOG):
+        self.path = path
+        self.max_backlog = max_backlog
+        self.clients = []
+        self.cache = ParamCache()
+        self._lock = threading.Lock()
+        self._closed = False
+        # Set whenever a reader attaches; wakes a paused stream (IdleControl)
+        self.attached = threading.Event()
+
+        # Time to first picture: readers primed from the cache / left waiting
+        # for a live keyframe, with their total seconds
+        self.primed = 0
+        self.primed_seconds = 0.0
+        self.unprimed = 0
+        self.unprimed_seconds = 0.0
+
+        if os.path.exists(path):
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(16)
+        self.sock.settimeout(1.0)
+
+        self._accept_thread = threading.Thread(target=self._accept_loop, name="fanout-accept", daemon=True)
+        self._accept_thread.start()
+        log.info("[Fanout] Listening on %s", path)
+
+    def _accept_loop(self):
+        while not self._closed:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            conn.setblocking(False)
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024 * 1024)
+            client = _Client(conn, self.max_backlog)
+            with self._lock:
+                client.prime(self.cache.prime())
+                self.clients.append(client)
+                count = len(self.clients)
+            self.attached.set()
+            if client.first_picture is not None:
+                self.primed += 1
+                self.primed_seconds += client.first_picture
+                log.info("[Fanout] Reader attached (%s total), first picture from cache after %.1f ms (%d KiB)",
+                         count, client.first_picture * 1000, client.primed_bytes // 1024)
+            else:
+                log.info("[Fanout] Reader attached (%s total), nothing cached yet", count)
+
+    def write(self, view, keyframe=False, codec=0, timestamp=0):
+        with self._lock:
+            if keyframe:
+                self.cache.update(view, codec)
+            dead = False
+            for client in self.clients:
+                waiting = client.first_picture is None
+                client.send(view, keyframe)
+                if waiting and client.first_picture is not None:
+                    self._first_live_picture(client)
+                dead = dead or client.dead
+            if dead:
+                self._reap()
+
+    def _first_live_picture(self, client):
+        self.unprimed += 1
+        self.unprimed_seconds += client.first_picture
+        log.info("[Fanout] Reader got its first picture after %.0f ms (live keyframe)", client.first_picture * 1000)
+
+    def clear_cache(self):
+        with self._lock:
+            self.cache.clear()
+
+    def stats_line(self):
+        primed = f"{self.primed_seconds / self.primed * 1000:.0f} ms" if self.primed else "-"
+        unprimed = f"{self.unprimed_seconds / self.unprimed * 1000:.0f} ms" if self.unprimed else "-"
+        return (f"readers {len(self.clients)}, first picture: cached {primed} over {self.primed}, "
+                f"live keyframe {unprimed} over {self.unprimed}, keyframes too large to cache {self.cache.oversize}")
+
+    def tick(self):
+        with self._lock:
+            dead = False
+            for client in self.clients:
+                client.drain()
+                dead = dead or client.dead
+            if dead:
+                self._reap()
+
+    flush = tick
+
+    def _reap(self):
+        alive = []
+        for client in self.clients:
+            if client.dead:
+                client.close()
+            else:
+                alive.append(client)
+        self.clients = alive
+        log.info("[Fanout] Reader detached (%s left)", len(alive))
+
+    @property
+    def client_count(self):
+        return len(self.clients)
+
+    def close(self):
+        self._closed = True
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        with self._lock:
+            for client in self.clients:
+                client.close()
+            self.clients = []
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
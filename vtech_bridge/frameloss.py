@@ -0,0 +1,90 @@
+# Minimum seconds between two keyframe requests to the camera
+KEYFRAME_REQUEST_INTERVAL = 2.0
+
+# Index jumps larger than this (or backwards) mean the camera restarted its
+# counter, not that frames were lost
+MAX_GAP = 10000
+
+class LossTracker:
+    """
+    Follows the frame index avRecvFrameData2 reports. A jump in the index
+    (or a frame the SDK reports as lost) starts a recovery: the caller stops
+    output until the next keyframe and, if request_keyframe is given, the
+    camera is asked for one right away (at most every
+    KEYFRAME_REQUEST_INTERVAL). The recovery ends at the next keyframe and
+    its duration - time to a clean picture - goes to on_recovery(seconds).
+    """
+
+    def __init__(self, request_keyframe=None, min_interval=KEYFRAME_REQUEST_INTERVAL, on_recovery=None):
+        self.request_keyframe = request_keyframe
+        self.on_recovery = on_recovery
+        self.min_interval = min_interval
+        self.expected = None
+        self.recovering_since = None
+        self.last_request = None
+        self.gaps = 0
+        self.missing = 0
+        self.requests = 0
+        self.recoveries = 0
+        self.last_recovery = None # seconds
+
+    def frame(self, frame_idx, keyframe, now):
+        """
+        Call for every received video frame. Returns True if frames are
+        missing before this one and output must be held until a keyframe.
+        """
+        gap = 0
+        if self.expected is not None and frame_idx != self.expected:
+            gap = frame_idx - self.expected
+            if gap < 0 or gap > MAX_GAP:
+                gap = 0
+        self.expected = frame_idx + 1
+
+        if gap:
+            self.gaps += 1
+            self.missing += gap
+            self._start(now)
+
+        if self.recovering_since is not None and keyframe:
+            return self._finish(now)
+        return self.recovering_since is not None and gap > 0
+
+    def lost(self, frame_idx, now):
+        """
+        Call when the SDK reports an incomplete or lost frame.
+        """
+        self.gaps += 1
+        self.missing += 1
+        if frame_idx:
+            self.expected = frame_idx + 1
+        self._start(now)
+
+    def reset(self):
+        """
+        After a reconnect the index starts over and the ring already waits
+        for a keyframe, so there is nothing to recover.
+        """
+        self.expected = None
+        self.recovering_since = None
+
+    def _start(self, now):
+        if self.recovering_since is None:
+            self.recovering_since = now
+        if self.request_keyframe and (self.last_request is None or now - self.last_request >= self.min_interval):
+            self.last_request = now
+            self.requests += 1
+            self.request_keyframe()
+
+    def _finish(self, now):
+        self.last_recovery = now - self.recovering_since
+        self.recovering_since = None
+        self.recoveries += 1
+        if self.on_recovery:
+            self.on_recovery(self.last_recovery)
+        return False
+
+    def stats_line(self):
+        line = f"gaps {self.gaps}, missing {self.missing} frames, keyframe requests {self.requests}"
+        if self.last_recovery is not None:
+            line += f", last clean picture after {self.last_recovery * 1000:.0f} ms"
+        return line
@@ -0,0 +1,103 @@
+import time
+
+# Idle mode for daemon outputs. With no reader attached for idle_seconds the
+# camera is told to stop sending video (IOTYPE_USER_IPCAM_STOP) while the
+# IOTC session and AV channel stay up, so nothing is sent over the air and
+# the receive loop sleeps. The first reader to attach sends START again and
+# gets video after one camera round trip and keyframe, instead of a full
+# connect. While paused the session is checked every KEEPALIVE_INTERVAL
+# (IOTC_Session_Check, no traffic) so a lost session is rebuilt before a
+# reader needs it.
+
+# Seconds between session checks while paused
+KEEPALIVE_INTERVAL = 10.0
+
+# Longest sleep of the paused loop, so the heartbeat keeps moving
+WAKE_INTERVAL = 1.0
+
+class IdleControl:
+    """
+    Pause/resume bookkeeping for a CameraStream that writes to a
+    FanoutServer. The stream asks should_pause() once per loop iteration,
+    and while paused waits in wait_for_reader(). Resume to first frame is
+    measured from resumed() to the first_frame() after it.
+    """
+
+    def __init__(self, fanout, idle_seconds):
+        self.fanout = fanout
+        self.idle_seconds = idle_seconds
+        self.paused = False
+        self.empty_since = None
+        self.paused_since = None
+        self.resume_started = None
+        self.next_keepalive = 0.0
+
+        # Stats
+        self.pauses = 0
+        self.paused_seconds = 0.0
+        self.resumes = 0
+        self.resume_seconds = 0.0
+        self.keepalives = 0
+        self.keepalive_failures = 0
+        self.started = time.monotonic()
+
+    def should_pause(self, now):
+        if self.fanout.client_count:
+            self.empty_since = None
+            return False
+        if self.empty_since is None:
+            self.empty_since = now
+            return False
+        return now - self.empty_since >= self.idle_seconds
+
+    def pause(self, now):
+        self.paused = True
+        self.paused_since = now
+        self.next_keepalive = now + KEEPALIVE_INTERVAL
+        self.pauses += 1
+        self.resume_started = None
+        # A reader attaching later should not be primed with a stale picture
+        self.fanout.clear_cache()
+        self.fanout.attached.clear()
+
+    def wait_for_reader(self):
+        """
+        Sleeps until a reader attaches (True) or WAKE_INTERVAL passes.
+        """
+        if self.fanout.client_count:
+            return True
+        return self.fanout.attached.wait(WAKE_INTERVAL) and self.fanout.client_count > 0
+
+    def keepalive_due(self, now):
+        if now < self.next_keepalive:
+            return False
+        self.next_keepalive = now + KEEPALIVE_INTERVAL
+        self.keepalives += 1
+        return True
+
+    def resumed(self, now):
+        self.paused = False
+        self.paused_seconds += now - self.paused_since
+        self.empty_since = None
+        self.resume_started = now
+        return now - self.paused_since
+
+    def first_frame(self, now):
+        """
+        Called for frames while a resume is pending; returns the seconds
+        from resume to this first frame.
+        """
+        elapsed = now - self.resume_started
+        self.resume_started = None
+        self.resumes += 1
+        self.resume_seconds += elapsed
+        return elapsed
+
+    def stats_line(self):
+        now = time.monotonic()
+        paused = self.paused_seconds + (now - self.paused_since if self.paused else 0)
+        share = paused / (now - self.started) * 100 if now > self.started else 0
+        resume = f"{self.resume_seconds / self.resumes * 1000:.0f} ms" if self.resumes else "-"
+        return (f"{'paused' if self.paused else 'streaming'}, paused {self.pauses} times ({share:.0f}% of the time), "
+                f"resume to first frame {resume} over {self.resumes}, "
+                f"keepalives {self.keepalives} ({self.keepalive_failures} failed)")
@@ -0,0 +1,131 @@
+import collections
+import logging
+import threading
+import time
+
+import iotc
+
+log = logging.getLogger(__name__)
+
+# Request/response layer for IOCtrl messages. A thread per AV channel sits
+# in avRecvIOCtrl next to the video receive loop and hands every message to
+# whoever waits for that type. TUTK IOCtrls carry no request id, so a
+# response is matched to the oldest request still waiting for its type;
+# anything nobody waits for is counted as unsolicited.
+
+# How long one avRecvIOCtrl call waits, i.e. how quickly stop() takes effect
+RECV_TIMEOUT_MS = 200
+
+# Default time a request waits for its response (seconds)
+REQUEST_TIMEOUT = 3.0
+
+# Requests waiting at once; more are refused rather than queued
+MAX_PENDING = 16
+
+class _Pending:
+    __slots__ = ("resp_type", "event", "data")
+
+    def __init__(self, resp_type):
+        self.resp_type = resp_type
+        self.event = threading.Event()
+        self.data = None
+
+class IOCtrlChannel(threading.Thread):
+    """
+    Owns an IOCtrlReceiver for one AV channel. request() may be called from
+    any thread except this one. Ends on stop() or when the channel fails
+    (session closed); outstanding requests then return None at once.
+    """
+
+    def __init__(self, receiver, name="ioctrl"):
+        super().__init__(name=f"ioctrl-{name}", daemon=True)
+        self.receiver = receiver
+        self.log = log.getChild(name)
+        self.tag = f"[{name}]"
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.closed = False
+
+        # Stats
+        self.requests = 0
+        self.answered = 0
+        self.timeouts = 0
+        self.unsolicited = 0
+        self.rtt_total = 0.0
+
+    def stop(self):
+        self._stop_event.set()
+
+    def request(self, io_type, payload, resp_type, timeout=REQUEST_TIMEOUT):
+        """
+        Sends io_type and waits for the next resp_type message. Returns its
+        payload (bytes), or None if sending failed, the channel closed or no
+        response came within timeout.
+        """
+        pending = _Pending(resp_type)
+        with self._lock:
+            if self.closed or len(self._pending) >= MAX_PENDING:
+                return None
+            self._pending.append(pending)
+        self.requests += 1
+        t0 = time.monotonic()
+        ret = iotc.avSendIOCtrl(self.receiver.av_index, io_type, payload)
+        if ret < 0:
+            self.log.warning("%s [IOCtrl] Sending 0x%X failed: %d", self.tag, io_type, ret)
+            self._forget(pending)
+            return None
+        if not pending.event.wait(timeout) or pending.data is None:
+            self._forget(pending)
+            if not self.closed:
+                self.timeouts += 1
+                self.log.info("%s [IOCtrl] No response 0x%X to 0x%X within %.1fs", self.tag, resp_type, io_type, timeout)
+            return None
+        self.answered += 1
+        self.rtt_total += time.monotonic() - t0
+        return pending.data
+
+    def _forget(self, pending):
+        with self._lock:
+            try:
+                self._pending.remove(pending)
+            except ValueError:
+                pass
+
+    def _dispatch(self, io_type, data):
+        with self._lock:
+            for pending in self._pending:
+                if pending.resp_type == io_type:
+                    self._pending.remove(pending)
+                    break
+            else:
+                pending = None
+        if pending is None:
+            self.unsolicited += 1
+            self.log.debug("%s [IOCtrl] Unsolicited 0x%X (%d bytes)", self.tag, io_type, len(data))
+            return
+        pending.data = data
+        pending.event.set()
+
+    def run(self):
+        receiver = self.receiver
+        try:
+            while not self._stop_event.is_set():
+                ret, io_type, view = receiver.recv(RECV_TIMEOUT_MS)
+                if ret >= 0:
+                    self._dispatch(io_type, bytes(view[:ret]))
+                elif ret not in (iotc.AV_ER_TIMEOUT, iotc.AV_ER_DATA_NOREADY):
+                    # The stream's own receive loop handles the reconnect
+                    self.log.info("%s [IOCtrl] Receive ended: %s", self.tag, ret)
+                    break
+        finally:
+            with self._lock:
+                self.closed = True
+                pending, self._pending = list(self._pending), collections.deque()
+            for p in pending:
+                p.event.set()
+
+    def stats_line(self):
+        rtt = self.rtt_total / self.answered * 1000 if self.answered else 0
+        return (f"requests {self.requests}, answered {self.answered} (mean {rtt:.0f} ms), timeouts {self.timeouts}, "
+                f"unsolicited {self.unsolicited}")
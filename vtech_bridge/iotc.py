@@ -3,39 +3,149 @@ import os
 import sys
 
 # Load IOTC Library
-# Try /usr/lib first (where Dockerfile will put it)
-lib_path = "/usr/lib/libIOTCAPIs.so"
-if not os.path.exists(lib_path):
-    # Try local
-    lib_path = os.path.join(os.path.dirname(__file__), "libIOTCAPIs.so")
-
-try:
-    # Load with RTLD_GLOBAL so symbols are available to libAVAPIs
-    _lib = ctypes.CDLL(lib_path, mode=ctypes.RTLD_GLOBAL)
-except OSError as e:
-    print(f"Failed to load library {lib_path}: {e}", file=sys.stderr)
-    raise
-
-# Load AV Library
-av_lib_path = "/usr/lib/libAVAPIs.so"
-if not os.path.exists(av_lib_path):
-    av_lib_path = os.path.join(os.path.dirname(__file__), "libAVAPIs.so")
-
-try:
-    _av_lib = ctypes.CDLL(av_lib_path)
-except OSError as e:
-    print(f"Failed to load AV library {av_lib_path}: {e}", file=sys.stderr)
-    raise
+# IOTC_LIB_DIR is set by run.sh from libselect.py; otherwise try /usr/lib
+# (where Dockerfile puts the default build), then next to this file
+_lib_dirs = [os.getenv("IOTC_LIB_DIR") or "/usr/lib", os.path.dirname(os.path.abspath(__file__))]
+
+def _find_lib(name):
+    for d in _lib_dirs:
+        path = os.path.join(d, name)
+        if os.path.exists(path):
+            return path
+    return os.path.join(_lib_dirs[-1], name)
+
+if os.getenv("IOTC_BACKEND") == "fake":
+    # Python stand-in for benchmarks and development without a camera
+    import fake_tutk
+    _lib, _av_lib = fake_tutk.load()
+    lib_path = av_lib_path = fake_tutk.__file__
+else:
+    lib_path = _find_lib("libIOTCAPIs.so")
+
+    try:
+        # Load with RTLD_GLOBAL so symbols are available to libAVAPIs
+        _lib = ctypes.CDLL(lib_path, mode=ctypes.RTLD_GLOBAL)
+    except OSError as e:
+        print(f"Failed to load library {lib_path}: {e}", file=sys.stderr)
+        raise
+
+    # Load AV Library
+    av_lib_path = _find_lib("libAVAPIs.so")
+
+    try:
+        _av_lib = ctypes.CDLL(av_lib_path)
+    except OSError as e:
+        print(f"Failed to load AV library {av_lib_path}: {e}", file=sys.stderr)
+        raise
 
 # Define constants
 IOTC_ER_TIMEOUT = -20012
 
+# AVAPIs error codes
+AV_ER_INVALID_ARG = -20000
+AV_ER_BUFPARA_MAXSIZE_INSUFF = -20001
+AV_ER_INVALID_SID = -20010
+AV_ER_TIMEOUT = -20011
+AV_ER_DATA_NOREADY = -20012
+AV_ER_INCOMPLETE_FRAME = -20013
+AV_ER_LOSED_THIS_FRAME = -20014
+AV_ER_SESSION_CLOSE_BY_REMOTE = -20015
+AV_ER_REMOTE_TIMEOUT_DISCONNECT = -20016
+AV_ER_IOTC_SESSION_CLOSED = -20025
+
+# FRAMEINFO_t codec ids (AVFRAMEINFO.h)
+MEDIA_CODEC_UNKNOWN = 0x00
+MEDIA_CODEC_VIDEO_MPEG4 = 0x4C
+MEDIA_CODEC_VIDEO_H263 = 0x4D
+MEDIA_CODEC_VIDEO_H264 = 0x4E
+MEDIA_CODEC_VIDEO_MJPEG = 0x4F
+MEDIA_CODEC_VIDEO_HEVC = 0x50
+MEDIA_CODEC_AUDIO_AAC_RAW = 0x86
+MEDIA_CODEC_AUDIO_AAC_ADTS = 0x87
+MEDIA_CODEC_AUDIO_AAC_LATM = 0x88
+MEDIA_CODEC_AUDIO_G711U = 0x89
+MEDIA_CODEC_AUDIO_G711A = 0x8A
+MEDIA_CODEC_AUDIO_ADPCM = 0x8B
+MEDIA_CODEC_AUDIO_PCM = 0x8C
+MEDIA_CODEC_AUDIO_SPEEX = 0x8D
+MEDIA_CODEC_AUDIO_MP3 = 0x8E
+MEDIA_CODEC_AUDIO_G726 = 0x8F
+
+CODEC_NAMES = {
+    MEDIA_CODEC_VIDEO_MPEG4: "mpeg4",
+    MEDIA_CODEC_VIDEO_H263: "h263",
+    MEDIA_CODEC_VIDEO_H264: "h264",
+    MEDIA_CODEC_VIDEO_MJPEG: "mjpeg",
+    MEDIA_CODEC_VIDEO_HEVC: "h265",
+    MEDIA_CODEC_AUDIO_AAC_RAW: "aac_raw",
+    MEDIA_CODEC_AUDIO_AAC_ADTS: "aac_adts",
+    MEDIA_CODEC_AUDIO_AAC_LATM: "aac_latm",
+    MEDIA_CODEC_AUDIO_G711U: "g711u",
+    MEDIA_CODEC_AUDIO_G711A: "g711a",
+    MEDIA_CODEC_AUDIO_ADPCM: "adpcm",
+    MEDIA_CODEC_AUDIO_PCM: "pcm",
+    MEDIA_CODEC_AUDIO_SPEEX: "speex",
+    MEDIA_CODEC_AUDIO_MP3: "mp3",
+    MEDIA_CODEC_AUDIO_G726: "g726",
+}
+
+# FRAMEINFO_t.flags
+IPC_FRAME_FLAG_PBFRAME = 0x00
+IPC_FRAME_FLAG_IFRAME = 0x01
+
+# For audio frames flags = (sample_rate << 2) | (data_bits << 1) | channel
+AUDIO_SAMPLE_RATES = (8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000)
+
 class LogAttr(ctypes.Structure):
     _fields_ = [("path", ctypes.c_char_p),
                 ("log_level", ctypes.c_int),
                 ("file_max_size", ctypes.c_int),
                 ("file_max_count", ctypes.c_int)]
 
+class FrameInfo(ctypes.Structure):
+    """
+    FRAMEINFO_t header the camera sends along with every frame.
+    timestamp is in milliseconds on the camera clock.
+    """
+    _fields_ = [
+        ("codec_id", ctypes.c_uint16),
+        ("flags", ctypes.c_uint8),
+        ("cam_index", ctypes.c_uint8),
+        ("online_num", ctypes.c_uint8),
+        ("reserved1", ctypes.c_uint8 * 3),
+        ("reserved2", ctypes.c_uint32),
+        ("timestamp", ctypes.c_uint32),
+    ]
+
+    @property
+    def is_keyframe(self):
+        return bool(self.flags & IPC_FRAME_FLAG_IFRAME)
+
+    @property
+    def is_audio(self):
+        return self.codec_id >= MEDIA_CODEC_AUDIO_AAC_RAW
+
+    @property
+    def audio_sample_rate(self):
+        rate = self.flags >> 2
+        return AUDIO_SAMPLE_RATES[rate] if rate < len(AUDIO_SAMPLE_RATES) else 0
+
+    @property
+    def audio_channels(self):
+        return 2 if self.flags & 0x01 else 1
+
+    @property
+    def audio_bits(self):
+        return 16 if self.flags & 0x02 else 8
+
+    def __repr__(self):
+        if self.is_audio:
+            return (f"FrameInfo(codec={CODEC_NAMES.get(self.codec_id, hex(self.codec_id))}, "
+                    f"rate={self.audio_sample_rate}, bits={self.audio_bits}, ch={self.audio_channels}, ts={self.timestamp})")
+        codec = CODEC_NAMES.get(self.codec_id, hex(self.codec_id))
+        return (f"FrameInfo(codec={codec}, flags=0x{self.flags:02x}, cam={self.cam_index}, "
+                f"online={self.online_num}, ts={self.timestamp})")
+
 class AVClientStartInConfig(ctypes.Structure):
     _fields_ = [
         ("cb", ctypes.c_uint32),
@@ -68,7 +178,10 @@ class St_IOTCConnectInput(ctypes.Structure):
         ("timeout", ctypes.c_uint32),
     ]
 
-def IOTC_Set_Log_Attr(log_level, path):
+def IOTC_Set_Log_Attr(log_level, path, max_size=0, max_count=0):
+    """
+    max_size (bytes) and max_count rotate the native log; 0 means unbounded.
+    """
     try:
         fn = _lib.IOTC_Set_Log_Attr
         fn.argtypes = [ctypes.POINTER(LogAttr)]
@@ -80,8 +193,8 @@ def IOTC_Set_Log_Attr(log_level, path):
             log_attr.path = path.encode('utf-8')
         
         log_attr.log_level = log_level
-        log_attr.file_max_size = 0
-        log_attr.file_max_count = 0
+        log_attr.file_max_size = max_size
+        log_attr.file_max_count = max_count
         
         fn(ctypes.byref(log_attr))
     except Exception as e:
@@ -147,6 +260,21 @@ def IOTC_Initialize2(udp_port):
         print(f"IOTC_Initialize2 error: {e}", file=sys.stderr)
         return -1
 
+def IOTC_Set_Max_Session_Number(max_sessions):
+    # Must be called before IOTC_Initialize2
+    try:
+        fn = _lib.IOTC_Set_Max_Session_Number
+        fn.argtypes = [ctypes.c_uint]
+        fn.restype = None
+        fn(max_sessions)
+        return 0
+    except AttributeError:
+        print("IOTC_Set_Max_Session_Number not found in library.", file=sys.stderr)
+        return 0
+    except Exception as e:
+        print(f"IOTC_Set_Max_Session_Number error: {e}", file=sys.stderr)
+        return -1
+
 def IOTC_DeInitialize():
     try:
         fn = _lib.IOTC_DeInitialize
@@ -202,6 +330,25 @@ def IOTC_Session_Close(sid):
     except:
         pass
 
+# st_SInfo is about 160 bytes depending on the SDK version; only the
+# return code is used
+SESSION_INFO_SIZE = 512
+
+def IOTC_Session_Check(sid):
+    """
+    0 while the session is alive, otherwise the IOTC error (session closed
+    by the camera, timed out...). Cheap; no traffic to the camera.
+    """
+    try:
+        fn = _lib.IOTC_Session_Check
+        fn.argtypes = [ctypes.c_int, ctypes.c_void_p]
+        fn.restype = ctypes.c_int
+        info = ctypes.create_string_buffer(SESSION_INFO_SIZE)
+        return fn(sid, info)
+    except Exception as e:
+        print(f"IOTC_Session_Check error: {e}", file=sys.stderr)
+        return -1
+
 def avInitialize(max_channel_num):
     try:
         fn = _av_lib.avInitialize
@@ -289,11 +436,172 @@ def avSendIOCtrl(av_index, type, payload):
         print(f"avSendIOCtrl error: {e}", file=sys.stderr)
         return -1
 
-def avRecvFrameData2(av_index, buf, size, out_buf_size, out_frame_size, out_frame_info, frame_idx):
-    try:
+_avRecvFrameData2 = None
+
+def _bind_avRecvFrameData2():
+    """
+    Returns avRecvFrameData2 with its prototype bound. Only the first call
+    touches argtypes/restype.
+    """
+    global _avRecvFrameData2
+    if _avRecvFrameData2 is None:
         fn = _av_lib.avRecvFrameData2
         # int avRecvFrameData2(int avIndex, char *buf, int bufSize, int *outBufSize, int *outFrameSize, char *pFrameInfo, int frameInfoSize, int *outFrameInfoSize, int *outFrameIndex);
-        
+        # Args - 9 args (Wyze confirmed: frame_info_actual_len is arg 8)
+        fn.argtypes = [ctypes.c_int, ctypes.POINTER(ctypes.c_char), ctypes.c_int,
+                       ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int),
+                       ctypes.POINTER(ctypes.c_byte), ctypes.c_int, ctypes.POINTER(ctypes.c_int),
+                       ctypes.POINTER(ctypes.c_int)]
+        fn.restype = ctypes.c_int
+        _avRecvFrameData2 = fn
+    return _avRecvFrameData2
+
+# Frame Info is a struct of size 24 usually. We pass a buffer.
+# SAFEGUARD: Allocate 128 bytes to prevent overflow if struct is larger
+FRAME_INFO_MAX_SIZE = 128
+
+class FrameReceiver:
+    """
+    Persistent receiver for avRecvFrameData2.
+
+    Binds the prototype once and owns the receive buffer, its ctypes view and
+    all out-params, so the steady-state recv() call does not allocate buffers
+    or ctypes objects. Use one receiver per AV channel and per thread.
+    """
+
+    def __init__(self, av_index, buf_size=1024 * 1024):
+        self._fn = _bind_avRecvFrameData2()
+        self.av_index = av_index
+        self.resize(buf_size)
+
+        self._out_buf_size = ctypes.c_int(0)
+        self._out_frame_size = ctypes.c_int(0)
+        self._frame_idx = ctypes.c_int(0)
+        self._frame_info_size = ctypes.c_int(0)
+        self._frame_info = (ctypes.c_byte * FRAME_INFO_MAX_SIZE)()
+        self.frame_info_raw = memoryview(self._frame_info).cast('B')
+        # Decoded view over the same bytes, refreshed by every recv()
+        self.frame_info = FrameInfo.from_buffer(self._frame_info)
+
+        # byref() builds a new object every time, so keep them around
+        self._p_out_buf_size = ctypes.byref(self._out_buf_size)
+        self._p_out_frame_size = ctypes.byref(self._out_frame_size)
+        self._p_frame_idx = ctypes.byref(self._frame_idx)
+        self._p_frame_info_size = ctypes.byref(self._frame_info_size)
+
+    def resize(self, buf_size):
+        """
+        Replaces the receive buffer. Views of the old buffer stay valid
+        (they keep the old bytearray alive) but no longer see new frames.
+        """
+        self.buf = bytearray(buf_size)
+        self.view = memoryview(self.buf)
+        self._c_buf = (ctypes.c_char * buf_size).from_buffer(self.buf)
+        self._size = buf_size
+
+    @property
+    def out_buf_size(self):
+        return self._out_buf_size.value
+
+    @property
+    def out_frame_size(self):
+        return self._out_frame_size.value
+
+    @property
+    def frame_info_size(self):
+        return self._frame_info_size.value
+
+    def recv(self):
+        """
+        Receives one frame into self.buf.
+        Returns (length, frame_index, frame_info). A negative length is the SDK
+        error code. frame_info is a FrameInfo view that the next call overwrites.
+        """
+        ret = self._fn(self.av_index, self._c_buf, self._size, self._p_out_buf_size, self._p_out_frame_size,
+                       self._frame_info, FRAME_INFO_MAX_SIZE, self._p_frame_info_size, self._p_frame_idx)
+        return ret, self._frame_idx.value, self.frame_info
+
+_avRecvAudioData = None
+
+def _bind_avRecvAudioData():
+    global _avRecvAudioData
+    if _avRecvAudioData is None:
+        fn = _av_lib.avRecvAudioData
+        # int avRecvAudioData(int avIndex, char *buf, int bufSize, char *pFrameInfo, int frameInfoSize, unsigned int *outFrameIndex);
+        fn.argtypes = [ctypes.c_int, ctypes.POINTER(ctypes.c_char), ctypes.c_int,
+                       ctypes.POINTER(ctypes.c_byte), ctypes.c_int, ctypes.POINTER(ctypes.c_uint)]
+        fn.restype = ctypes.c_int
+        _avRecvAudioData = fn
+    return _avRecvAudioData
+
+class AudioReceiver:
+    """
+    Persistent receiver for avRecvAudioData, the audio counterpart of
+    FrameReceiver. Same recv() contract: (length, frame_index, frame_info).
+    """
+
+    def __init__(self, av_index, buf_size=64 * 1024):
+        self._fn = _bind_avRecvAudioData()
+        self.av_index = av_index
+        self.buf = bytearray(buf_size)
+        self.view = memoryview(self.buf)
+        self._c_buf = (ctypes.c_char * buf_size).from_buffer(self.buf)
+        self._size = buf_size
+
+        self._frame_idx = ctypes.c_uint(0)
+        self._p_frame_idx = ctypes.byref(self._frame_idx)
+        self._frame_info = (ctypes.c_byte * FRAME_INFO_MAX_SIZE)()
+        self.frame_info_raw = memoryview(self._frame_info).cast('B')
+        self.frame_info = FrameInfo.from_buffer(self._frame_info)
+
+    def recv(self):
+        ret = self._fn(self.av_index, self._c_buf, self._size, self._frame_info, FRAME_INFO_MAX_SIZE, self._p_frame_idx)
+        return ret, self._frame_idx.value, self.frame_info
+
+_avRecvIOCtrl = None
+
+def _bind_avRecvIOCtrl():
+    global _avRecvIOCtrl
+    if _avRecvIOCtrl is None:
+        fn = _av_lib.avRecvIOCtrl
+        # int avRecvIOCtrl(int avIndex, unsigned int *pnIOCtrlType, char *abIOCtrlData, int nIOCtrlMaxDataSize, unsigned int nTimeout);
+        fn.argtypes = [ctypes.c_int, ctypes.POINTER(ctypes.c_uint), ctypes.POINTER(ctypes.c_char), ctypes.c_int, ctypes.c_uint]
+        fn.restype = ctypes.c_int
+        _avRecvIOCtrl = fn
+    return _avRecvIOCtrl
+
+# Largest IOCtrl payload the SDK sends (AV_MAX_IOCTRL_DATA_SIZE)
+IOCTRL_MAX_SIZE = 1024
+
+class IOCtrlReceiver:
+    """
+    Persistent receiver for avRecvIOCtrl (camera responses and
+    notifications), with its own buffer and out-param like FrameReceiver.
+    """
+
+    def __init__(self, av_index, buf_size=IOCTRL_MAX_SIZE):
+        self._fn = _bind_avRecvIOCtrl()
+        self.av_index = av_index
+        self.buf = bytearray(buf_size)
+        self.view = memoryview(self.buf)
+        self._c_buf = (ctypes.c_char * buf_size).from_buffer(self.buf)
+        self._size = buf_size
+        self._io_type = ctypes.c_uint(0)
+        self._p_io_type = ctypes.byref(self._io_type)
+
+    def recv(self, timeout_ms):
+        """
+        Waits up to timeout_ms for one IOCtrl. Returns (length, io_type,
+        view); a negative length is the SDK error code (AV_ER_TIMEOUT when
+        nothing came). The view is overwritten by the next call.
+        """
+        ret = self._fn(self.av_index, self._p_io_type, self._c_buf, self._size, timeout_ms)
+        return ret, self._io_type.value, self.view
+
+def avRecvFrameData2(av_index, buf, size, out_buf_size, out_frame_size, out_frame_info, frame_idx):
+    try:
+        fn = _bind_avRecvFrameData2()
+
         # We need to handle 'buf' (bytearray) as mutable buffer.
         c_buf = (ctypes.c_char * len(buf)).from_buffer(buf)
         
@@ -301,25 +609,16 @@ def avRecvFrameData2(av_index, buf, size, out_buf_size, out_frame_size, out_fram
         c_out_frame_size = ctypes.c_int(0)
         c_frame_idx = ctypes.c_int(0)
         c_frame_info_size = ctypes.c_int(0)
-        
-        # Frame Info is a struct of size 24 usually. We pass a buffer.
-        # SAFEGUARD: Allocate 128 bytes to prevent overflow if struct is larger
-        c_frame_info = (ctypes.c_byte * 128)() 
-        
-        # Args - 9 args (Wyze confirmed: frame_info_actual_len is arg 8)
-        fn.argtypes = [ctypes.c_int, ctypes.POINTER(ctypes.c_char), ctypes.c_int, 
-                       ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int),
-                       ctypes.POINTER(ctypes.c_byte), ctypes.c_int, ctypes.POINTER(ctypes.c_int),
-                       ctypes.POINTER(ctypes.c_int)]
-        fn.restype = ctypes.c_int
+        c_frame_info = (ctypes.c_byte * FRAME_INFO_MAX_SIZE)()
         
         ret = fn(av_index, c_buf, size, ctypes.byref(c_out_buf_size), ctypes.byref(c_out_frame_size),
-                 c_frame_info, 128, ctypes.byref(c_frame_info_size), ctypes.byref(c_frame_idx))
+                 c_frame_info, FRAME_INFO_MAX_SIZE, ctypes.byref(c_frame_info_size), ctypes.byref(c_frame_idx))
         
         # Update python mutable args (lists)
         if out_buf_size: out_buf_size[0] = c_out_buf_size.value
         if out_frame_size: out_frame_size[0] = c_out_frame_size.value
         if frame_idx: frame_idx[0] = c_frame_idx.value
+        if out_frame_info: out_frame_info[0] = FrameInfo.from_buffer_copy(c_frame_info)
         
         return ret
     except Exception as e:
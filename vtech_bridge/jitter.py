@@ -0,0 +1,134 @@
+import time
+
+# Jitter buffer for the output stage. P2P/relay delivery comes in bursts, and
+# writing each frame the moment avRecvFrameData2 returns makes players
+# stutter and rush in turn. With a jitter buffer the writer thread releases
+# every frame at
+#
+#     camera timestamp + base transit + delay
+#
+# where base transit is the fastest arrival (local clock minus camera clock)
+# seen over the last WINDOW frames and delay is the latency target. Frames
+# wait in the FrameRing (no extra copies, no extra memory); if the ring gets
+# half full they are released early, so a paced stream never makes the ring
+# drop frames.
+
+# Frames whose transit times are kept (fixed memory: one float each)
+WINDOW = 256
+
+# Frames between recomputing the base transit and the adaptive target
+UPDATE_EVERY = 16
+
+# The adaptive target covers this share of the observed transit spread...
+PERCENTILE = 0.95
+# ...plus this much headroom (seconds)
+MARGIN = 0.005
+
+# Largest change of the applied delay per frame (seconds), so a new target
+# is reached by stretching or speeding up playback slightly, not by a
+# freeze or a jump
+SLEW = 0.002
+
+# Camera timestamp steps outside 0 < step <= RESYNC_MS (reconnect, camera
+# restart, clock jump) start the clock mapping over
+RESYNC_MS = 2000
+
+# Released late if due more than this long before it could be written (s)
+LATE_TOLERANCE = 0.001
+
+class JitterBuffer:
+    """
+    Pacing decisions for WriterThread. schedule() is called once per frame
+    with its arrival time (perf_counter seconds) and camera timestamp (ms)
+    and returns the perf_counter time the frame is due; wait() says how
+    long to keep holding it. With adaptive=True the latency target follows
+    the spread of transit times, up to max_ms; otherwise it is max_ms.
+    """
+
+    def __init__(self, max_ms, adaptive=True, window=WINDOW):
+        self.max_delay = max_ms / 1000.0
+        self.adaptive = adaptive
+        self.target = 0.0 if adaptive else self.max_delay
+        self.delay = self.target
+        self.transit = [0.0] * window
+        self.pos = 0
+        self.filled = 0
+        self.since_update = 0
+        self.base = 0.0
+        self.cam_time = None # camera clock, seconds, unwrapped
+        self.last_ts = 0
+
+        # Stats
+        self.frames = 0
+        self.late = 0
+        self.early = 0
+        self.resyncs = 0
+        self.held_total = 0.0
+
+    def _resync(self, transit):
+        self.pos = self.filled = self.since_update = 0
+        self.base = transit
+
+    def _update(self):
+        samples = sorted(self.transit[:self.filled])
+        self.base = samples[0]
+        if self.adaptive:
+            spread = samples[min(self.filled - 1, int(self.filled * PERCENTILE))] - self.base
+            self.target = min(spread + MARGIN, self.max_delay)
+
+    def schedule(self, arrival, timestamp):
+        self.frames += 1
+        step = (timestamp - self.last_ts) & 0xFFFFFFFF
+        self.last_ts = timestamp
+        if self.cam_time is not None and step == 0:
+            # No usable timestamp (or a second slice of the same picture)
+            return arrival
+        if self.cam_time is None or step > RESYNC_MS:
+            if self.cam_time is not None:
+                self.resyncs += 1
+            self.cam_time = 0.0
+            self._resync(arrival)
+        else:
+            self.cam_time += step / 1000.0
+        transit = arrival - self.cam_time
+
+        self.transit[self.pos] = transit
+        self.pos = (self.pos + 1) % len(self.transit)
+        if self.filled < len(self.transit):
+            self.filled += 1
+        if transit < self.base:
+            self.base = transit
+        self.since_update += 1
+        if self.since_update >= UPDATE_EVERY:
+            self.since_update = 0
+            self._update()
+
+        if self.filled < len(self.transit):
+            # Still learning (start, resync): nothing smooth to protect yet
+            self.delay = self.target
+        else:
+            self.delay += max(-SLEW, min(SLEW, self.target - self.delay))
+        due = self.cam_time + self.base + self.delay
+        if arrival - due > LATE_TOLERANCE:
+            self.late += 1
+        return due
+
+    def wait(self, arrival, due, ring):
+        """
+        Seconds to keep holding the oldest frame in ring, 0 to write it now.
+        """
+        now = time.perf_counter()
+        left = due - now
+        if left > 0:
+            if ring.occupancy * 2 < ring.slots and ring.used_bytes * 2 < ring.capacity:
+                return left
+            self.early += 1
+        self.held_total += now - arrival
+        return 0
+
+    def stats_line(self):
+        held = self.held_total / self.frames * 1000 if self.frames else 0
+        late = self.late / self.frames * 100 if self.frames else 0
+        return (f"target {self.target * 1000:.0f} ms{' (adaptive)' if self.adaptive else ''}, "
+                f"delay {self.delay * 1000:.0f} ms, mean hold {held:.0f} ms, late {self.late}/{self.frames} "
+                f"frames ({late:.1f}%), released early {self.early} (ring half full), resyncs {self.resyncs}")
@@ -0,0 +1,189 @@
+import argparse
+import ctypes
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import logs
+
+log = logging.getLogger(__name__)
+
+# Picks which TUTK build the bridge loads (exported as IOTC_LIB_DIR for
+# iotc.py). Every candidate is probed in a child process - load, version,
+# IOTC_Initialize2 - because a bad build can crash or hang the interpreter.
+# The verdict is cached keyed by the libraries' hashes, so later boots only
+# hash the files and skip probing entirely.
+
+# Probed in this order; the first one that passes wins
+CANDIDATE_DIRS = ["/usr/lib", "/libs/x86", "/libs/x86_TS269HX", "/libs/x86_X1000"]
+
+LIB_FILES = ["libIOTCAPIs.so", "libAVAPIs.so"]
+
+CACHE_FILE = "/data/libselect.json"
+
+# Seconds a single probe may take before the build is written off
+PROBE_TIMEOUT = 10
+
+def fingerprint(dirs):
+    """
+    sha256 over path and content of every candidate library, so replacing or
+    adding a build invalidates the cache.
+    """
+    h = hashlib.sha256()
+    for d in dirs:
+        for name in LIB_FILES:
+            path = os.path.join(d, name)
+            h.update(path.encode())
+            try:
+                with open(path, 'rb') as f:
+                    h.update(hashlib.sha256(f.read()).digest())
+            except OSError:
+                h.update(b"missing")
+    return h.hexdigest()
+
+def probe_in_process(lib_dir):
+    """
+    Runs in the child: load both libraries, read the version, initialise and
+    deinitialise IOTC. Returns a result dict.
+    """
+    result = {"dir": lib_dir, "ok": False, "version": None, "init": None, "error": None}
+    try:
+        lib = ctypes.CDLL(os.path.join(lib_dir, "libIOTCAPIs.so"), mode=ctypes.RTLD_GLOBAL)
+        ctypes.CDLL(os.path.join(lib_dir, "libAVAPIs.so"))
+    except OSError as e:
+        result["error"] = f"load failed: {e}"
+        return result
+
+    try:
+        ver_fn = lib.IOTC_Get_Version
+        ver_fn.argtypes = [ctypes.POINTER(ctypes.c_uint)]
+        ver_fn.restype = None
+        ver = ctypes.c_uint(0)
+        ver_fn(ctypes.byref(ver))
+        v = ver.value
+        result["version"] = f"{(v >> 24) & 0xff}.{(v >> 16) & 0xff}.{(v >> 8) & 0xff}.{v & 0xff}"
+    except AttributeError:
+        pass
+
+    try:
+        init_fn = lib.IOTC_Initialize2
+        init_fn.argtypes = [ctypes.c_ushort]
+        init_fn.restype = ctypes.c_int
+        result["init"] = init_fn(0)
+    except AttributeError:
+        result["error"] = "IOTC_Initialize2 not found"
+        return result
+
+    if result["init"] < 0:
+        result["error"] = f"IOTC_Initialize2 returned {result['init']}"
+        return result
+    try:
+        lib.IOTC_DeInitialize()
+    except AttributeError:
+        pass
+    result["ok"] = True
+    return result
+
+def probe(lib_dir, timeout=PROBE_TIMEOUT):
+    """
+    Probes one build in a child process. Returns the child's result dict.
+    """
+    if not all(os.path.exists(os.path.join(lib_dir, name)) for name in LIB_FILES):
+        return {"dir": lib_dir, "ok": False, "version": None, "init": None, "error": "missing"}
+    t0 = time.monotonic()
+    try:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--probe", lib_dir],
+                              capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"dir": lib_dir, "ok": False, "version": None, "init": None, "error": f"timed out after {timeout}s"}
+    try:
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        result = {"dir": lib_dir, "ok": False, "version": None, "init": None,
+                  "error": f"probe exited with {proc.returncode}"}
+    result["probe_ms"] = round((time.monotonic() - t0) * 1000)
+    return result
+
+def _load_cache(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        log.warning("[LibSelect] Ignoring unreadable %s: %s", path, e)
+        return None
+
+def _save_cache(path, data):
+    tmp = None
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".libselect.")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp, path)
+        tmp = None
+    except OSError as e:
+        log.warning("[LibSelect] Failed to save %s: %s", path, e)
+    finally:
+        if tmp:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+def select(dirs=CANDIDATE_DIRS, cache_path=CACHE_FILE, force=False):
+    """
+    Returns the library directory to use, or None if no build passed.
+    """
+    key = fingerprint(dirs)
+    cache = None if force else _load_cache(cache_path)
+    if cache and cache.get("fingerprint") == key:
+        log.info("[LibSelect] Using cached choice %s", cache["selected"])
+        return cache["selected"]
+
+    selected = None
+    results = []
+    for d in dirs:
+        result = probe(d)
+        results.append(result)
+        status = "ok" if result["ok"] else result["error"]
+        log.info("[LibSelect] %s: %s (version %s, %d ms)", d, status, result["version"], result.get("probe_ms", 0))
+        if result["ok"]:
+            selected = d
+            break
+
+    if selected is None:
+        log.warning("[LibSelect] No library build passed the probe")
+    else:
+        log.info("[LibSelect] Selected %s", selected)
+    # A failed verdict is cached too: probing again would fail the same way
+    # until the files change
+    _save_cache(cache_path, {"fingerprint": key, "selected": selected, "results": results, "time": time.time()})
+    return selected
+
+def main():
+    parser = argparse.ArgumentParser(description="Select a working TUTK library build")
+    parser.add_argument("--cache", default=CACHE_FILE, help="Cache file for the selection")
+    parser.add_argument("--force", action="store_true", help="Ignore the cache and probe again")
+    parser.add_argument("--probe", metavar="DIR", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        print(json.dumps(probe_in_process(args.probe)))
+        return
+
+    # stdout is the selected directory (run.sh captures it); logs go to stderr
+    logs.setup()
+
+    selected = select(cache_path=args.cache, force=args.force)
+    if selected is None:
+        sys.exit(1)
+    print(selected)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import logging
+import logging.handlers
+import multiprocessing.util
+import os
+import queue
+import sys
+import threading
+import time
+
+# Python-side logging for the stream threads. Records go through a bounded
+# queue to a listener thread that does the stderr writes, so a receive loop
+# never blocks on the log file. Repeats of the same message are rate
+# limited per template; use %-style arguments in hot paths so that
+# "Error receiving audio: %d" counts as one message whatever the code.
+
+LOG_LEVELS = ("debug", "info", "warning", "error")
+
+# Records waiting for the listener; beyond this they are dropped and counted
+QUEUE_SIZE = 1024
+
+# At most RATE_BURST records per message template and RATE_WINDOW seconds
+RATE_BURST = 5
+RATE_WINDOW = 10.0
+
+# Templates tracked by the rate limiter before it starts over
+RATE_KEYS = 512
+
+class RateLimit(logging.Filter):
+    """
+    Drops repeats of a message (same logger and template) beyond RATE_BURST
+    per RATE_WINDOW. The first record of the next window carries the number
+    that were suppressed.
+    """
+
+    def __init__(self, burst=RATE_BURST, window=RATE_WINDOW):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.seen = {} # (logger, template) -> [window start, count, suppressed]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.seen.get(key)
+            if entry is not None and now - entry[0] < self.window:
+                entry[1] += 1
+                if entry[1] <= self.burst:
+                    return True
+                entry[2] += 1
+                return False
+            if len(self.seen) >= RATE_KEYS:
+                self.seen.clear()
+            self.seen[key] = [now, 1, 0]
+        if entry is not None and entry[2]:
+            record.msg = f"{record.msg} ({entry[2]} similar messages suppressed)"
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks: with the queue full, records are
+    dropped and counted, and the next record that fits says how many.
+    """
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        if self.dropped:
+            note = logging.LogRecord("logs", logging.WARNING, __file__, 0,
+                                     "[Log] Queue full, dropped %d records", (self.dropped,), None)
+            try:
+                self.queue.put_nowait(note)
+            except queue.Full:
+                pass
+            else:
+                self.dropped = 0
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_listener = None
+_pid = None
+
+def setup(level="info"):
+    """
+    Routes the root logger through the queue to stderr. Call at the start of
+    every process: the listener thread does not survive fork, so a worker
+    has to set up its own.
+    """
+    global _listener, _pid
+    if _pid == os.getpid():
+        return
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    q = queue.Queue(QUEUE_SIZE)
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(logging.Formatter("%(message)s"))
+    _listener = logging.handlers.QueueListener(q, output)
+    _listener.start()
+    handler = DroppingQueueHandler(q)
+    handler.addFilter(RateLimit())
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    _pid = os.getpid()
+    # Flush what is queued on exit; multiprocessing runs these in workers too
+    multiprocessing.util.Finalize(None, _listener.stop, exitpriority=10)
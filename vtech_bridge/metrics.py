@@ -0,0 +1,287 @@
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+# Stream health metrics. Updates are plain attribute arithmetic so they can
+# stay on in the receive loop; every metric has a single writer thread and
+# readers (scrapes, JSON dumps) tolerate a momentarily torn histogram.
+
+# Seconds between rewrites of the JSON metrics file
+JSON_INTERVAL = 60
+
+# Histogram buckets (upper bounds)
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+INTERVAL_BUCKETS = (0.01, 0.02, 0.033, 0.04, 0.05, 0.067, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 131072, 262144, 524288, 1048576)
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def snapshot(self):
+        return self.value
+
+class Gauge:
+    """
+    Set explicitly, or computed at read time from fn().
+    """
+    kind = "gauge"
+
+    def __init__(self, fn=None):
+        self.value = 0
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        if self.fn is not None:
+            try:
+                return self.fn()
+            except Exception:
+                return 0
+        return self.value
+
+class Histogram:
+    """
+    Fixed buckets, non-cumulative counts internally; cumulative on export.
+    """
+    kind = "histogram"
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        for n in self.counts:
+            total += n
+            cumulative.append(total)
+        return {"buckets": dict(zip([*map(str, self.buckets), "+Inf"], cumulative)),
+                "sum": self.sum, "count": self.count}
+
+def _labels_text(labels, extra=None):
+    items = list(labels) + (extra or [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+class Registry:
+    """
+    Metric families by name, one metric per label set. Asking again for the
+    same name and labels returns the existing metric, so a restarted stream
+    keeps counting where the previous one stopped.
+    """
+
+    def __init__(self):
+        self._families = {} # name -> (kind, help, {labels tuple: metric})
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, *args):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = (cls.kind, help, {})
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = cls(*args)
+            return metric
+
+    def counter(self, name, help, labels=None):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=None, fn=None):
+        gauge = self._get(Gauge, name, help, labels)
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name, help, buckets, labels=None):
+        return self._get(Histogram, name, help, labels, buckets)
+
+    def _items(self):
+        with self._lock:
+            return [(name, kind, help, list(metrics.items()))
+                    for name, (kind, help, metrics) in sorted(self._families.items())]
+
+    def render_prometheus(self):
+        lines = []
+        for name, kind, help, metrics in self._items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in metrics:
+                value = metric.snapshot()
+                if kind == "histogram":
+                    for le, n in value["buckets"].items():
+                        lines.append(f"{name}_bucket{_labels_text(labels, [('le', le)])} {n}")
+                    lines.append(f"{name}_sum{_labels_text(labels)} {value['sum']}")
+                    lines.append(f"{name}_count{_labels_text(labels)} {value['count']}")
+                else:
+                    lines.append(f"{name}{_labels_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        {name: [{"labels": {...}, "value": ...}]} for the JSON file.
+        """
+        return {name: [{"labels": dict(labels), "value": metric.snapshot()} for labels, metric in metrics]
+                for name, kind, help, metrics in self._items()}
+
+# Process-wide default registry
+REGISTRY = Registry()
+
+class MetricsServer:
+    """
+    Small HTTP server on a daemon thread. Serves GET /metrics (Prometheus
+    text) and GET /metrics.json; other modules can register more routes
+    with add_route(method, path, handler), where handler(body) returns
+    (status, content_type, bytes).
+    """
+
+    def __init__(self, port, registry=REGISTRY, host=""):
+        self.registry = registry
+        self.routes = {}
+        self.add_route("GET", "/metrics", lambda body: (200, "text/plain; version=0.0.4", registry.render_prometheus().encode()))
+        self.add_route("GET", "/metrics.json", lambda body: (200, "application/json", json.dumps(registry.snapshot()).encode()))
+
+        routes = self.routes
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self, method):
+                handler = routes.get((method, self.path.split("?", 1)[0]))
+                if handler is None:
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                try:
+                    status, content_type, data = handler(body)
+                except Exception as e:
+                    status, content_type, data = 500, "text/plain", f"{e}\n".encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="metrics-http", daemon=True)
+        self._thread.start()
+        log.info("[Metrics] Serving on port %d", port)
+
+    def add_route(self, method, path, handler):
+        self.routes[(method, path)] = handler
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class JsonDumper(threading.Thread):
+    """
+    Rewrites `path` atomically every `interval` seconds with the registry
+    snapshot plus per-second rates of every counter since the last dump.
+    """
+
+    def __init__(self, path, registry=REGISTRY, interval=JSON_INTERVAL):
+        super().__init__(name="metrics-json", daemon=True)
+        self.path = path
+        self.registry = registry
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._last = {}
+        self._last_time = time.monotonic()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def dump(self):
+        now = time.monotonic()
+        elapsed = max(now - self._last_time, 1e-6)
+        snapshot = self.registry.snapshot()
+        last = {}
+        for name, samples in snapshot.items():
+            for sample in samples:
+                value = sample["value"]
+                if isinstance(value, (int, float)):
+                    key = (name, tuple(sorted(sample["labels"].items())))
+                    if key in self._last:
+                        sample["rate"] = round((value - self._last[key]) / elapsed, 3)
+                    last[key] = value
+        self._last = last
+        self._last_time = now
+
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", prefix=".metrics.")
+            with os.fdopen(fd, 'w') as f:
+                json.dump({"time": time.time(), "metrics": snapshot}, f)
+            os.replace(tmp, self.path)
+            tmp = None
+        except OSError as e:
+            log.warning("[Metrics] Failed to write %s: %s", self.path, e)
+        finally:
+            if tmp:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.dump()
+        self.dump()
+
+def start(port=0, json_path=None, registry=REGISTRY):
+    """
+    Starts whichever exporters are configured. Returns (server, dumper),
+    either may be None. A port already in use only costs the HTTP endpoint.
+    """
+    server = dumper = None
+    if port:
+        try:
+            server = MetricsServer(port, registry)
+        except OSError as e:
+            log.warning("[Metrics] Cannot listen on port %d: %s", port, e)
+    if json_path:
+        dumper = JsonDumper(json_path, registry)
+        dumper.start()
+        log.info("[Metrics] Writing %s every %ss", json_path, dumper.interval)
+    return server, dumper
+
+def stop(server, dumper):
+    if server:
+        server.close()
+    if dumper:
+        dumper.stop()
+        dumper.join(timeout=2)
@@ -0,0 +1,241 @@
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+import session as session_mod
+from session import CameraSession
+from stream import CameraStream
+from fanout import FanoutServer
+from scoreboard import Scoreboard
+from buffers import BufferManager
+import metrics
+import recorder
+from watchdog import Heartbeat, Watchdog
+
+log = logging.getLogger(__name__)
+
+# Per-camera socket; run.sh points one go2rtc stream (via attach.py) at each
+SOCKET_TEMPLATE = "/tmp/vtech_{name}.sock"
+
+# Seconds between per-camera resource log lines
+STATS_INTERVAL = 60
+
+# Pause before a camera that failed or gave up is connected again
+CAMERA_RESTART_DELAY = 5
+
+def camera_name(name, index):
+    """
+    Stream/socket-safe camera name. Must match the jq expression in run.sh.
+    """
+    name = re.sub(r"[^A-Za-z0-9_]", "_", name or "")
+    return name or f"camera{index + 1}"
+
+def load_cameras(path):
+    """
+    Reads the cameras list ([{name, uid, auth_key}]) from the add-on options.
+    """
+    with open(path, 'r') as f:
+        data = json.load(f)
+    cameras = []
+    names = set()
+    for i, cam in enumerate(data.get("cameras") or []):
+        name = camera_name(cam.get("name"), i)
+        if not cam.get("uid") or not cam.get("auth_key"):
+            log.warning("[Multi] Skipping camera %s: uid and auth_key are required", name)
+            continue
+        if name in names:
+            log.warning("[Multi] Skipping camera %s: duplicate name", name)
+            continue
+        names.add(name)
+        cameras.append({"name": name, "uid": cam["uid"], "auth_key": cam["auth_key"]})
+    return cameras
+
+def pick_strategies(scoreboard, cameras, strategies, region=None):
+    """
+    The SDK region is process-global, so all cameras share one: the given
+    region, or the best known strategy's region for the first camera. Each
+    camera then uses its own best strategy within that region.
+    Returns (region, {camera name: strategy}).
+    """
+    if region is None:
+        region = strategies[scoreboard.order(cameras[0]["uid"], strategies)[0]]["region"]
+    picked = {}
+    for cam in cameras:
+        for i in scoreboard.order(cam["uid"], strategies):
+            if strategies[i]["region"] == region:
+                picked[cam["name"]] = strategies[i]
+                break
+        else:
+            picked[cam["name"]] = {"region": region, "method": "sequential", "name": f"Region {region} / Sequential"}
+    return region, picked
+
+class CameraWorker(threading.Thread):
+    """
+    Drives one camera inside the shared process: connect, stream through a
+    CameraStream, and start over after CAMERA_RESTART_DELAY when the stream
+    gives up. The FanoutServer outlives the session, so attached readers
+    just see a gap.
+    """
+
+    def __init__(self, cam, strategy, opts, scoreboard, scoreboard_lock, buffers):
+        super().__init__(name=f"camera-{cam['name']}", daemon=True)
+        self.cam = cam
+        self.strategy = strategy
+        self.opts = opts
+        self.scoreboard = scoreboard
+        self.scoreboard_lock = scoreboard_lock
+        self.buffers = buffers
+        self.socket = SOCKET_TEMPLATE.format(name=cam["name"])
+        self.stream = None
+        self.heartbeat = Heartbeat()
+        self.watchdog = Watchdog(self.heartbeat, opts.stall_seconds, name=cam["name"]) if opts.stall_seconds > 0 else None
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.stream:
+            self.stream.stop()
+
+    def _record(self, success, latency):
+        with self.scoreboard_lock:
+            self.scoreboard.record(self.cam["uid"], self.strategy["name"], success, latency)
+            self.scoreboard.save()
+
+    def run(self):
+        cam = self.cam
+        writer = FanoutServer(self.socket)
+        try:
+            while not self._stop_event.is_set():
+                self.heartbeat.starting()
+                session = CameraSession(cam["uid"], cam["auth_key"], self.strategy["method"], name=cam["name"])
+                t0 = time.monotonic()
+                connected = session.connect()
+                self._record(connected, time.monotonic() - t0)
+                if connected and session.start_av():
+                    session.start_stream()
+                    self.stream = CameraStream(cam["name"], session, writer, self.opts,
+                                               audio_fifo=f"{self.opts.audio_fifo}_{cam['name']}", buffers=self.buffers,
+                                               heartbeat=self.heartbeat)
+                    try:
+                        if not self._stop_event.is_set():
+                            self.stream.run()
+                    except Exception as e:
+                        log.error("[%s] Stream failed: %s", cam["name"], e)
+                session.close()
+                self._stop_event.wait(CAMERA_RESTART_DELAY)
+        finally:
+            writer.close()
+
+    def supervise(self, now):
+        """
+        Runs this camera's watchdog. A hung native call cannot be interrupted
+        from inside the process, so "restart" only stops the stream; the
+        worker thread starts over once the call returns.
+        """
+        if self.watchdog is None or self.stream is None:
+            return
+        action = self.watchdog.check(now)
+        if action == "reconnect":
+            self.stream.request_reconnect()
+        elif action == "restart":
+            log.warning("[%s] Stopping the stream; a receive call stuck in the SDK only returns on its own timeout",
+                        self.cam["name"])
+            self.stream.stop()
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+def log_stats(workers, last, interval, buffers):
+    """
+    One line per camera with CPU share over the last interval, buffer memory,
+    ring occupancy and drops, then the process totals. `last` maps camera
+    name -> (stream, cpu seconds) from the previous call.
+    """
+    attributed = 0
+    for worker in workers:
+        name = worker.cam["name"]
+        stream = worker.stream
+        if stream is None:
+            log.info("[Multi] %s: not connected", name)
+            continue
+        s = stream.stats()
+        prev_stream, prev_cpu = last.get(name, (None, 0.0))
+        # A new CameraStream (after a restart) has new threads, so no baseline
+        cpu = s["cpu_seconds"] - (prev_cpu if prev_stream is stream else 0.0)
+        last[name] = (stream, s["cpu_seconds"])
+        attributed += s["buffer_bytes"]
+        log.info("[Multi] %s: cpu %.1f%%, buffers %.1fMiB, ring %d frames, dropped %d, reconnects %d, readers %d",
+                 name, cpu / interval * 100, s["buffer_bytes"] / 1048576, s["ring_frames"], s["dropped_frames"],
+                 s["reconnects"], s["readers"])
+    log.info("[Multi] Receive buffers: %s", buffers.stats_line())
+    rss = _rss_bytes()
+    log.info("[Multi] Process: rss %.1fMiB (%.1fMiB in camera buffers), cpu %.1fs total", rss / 1048576,
+             attributed / 1048576, sum(os.times()[:2]))
+
+def run(args, strategies):
+    """
+    Serves every camera from this one process: a single IOTC/AV
+    initialisation sized for all of them, then one CameraWorker per camera.
+    Runs until interrupted.
+    """
+    cameras = load_cameras(args.cameras)
+    if not cameras:
+        log.error("[Multi] No usable cameras in %s", args.cameras)
+        sys.exit(1)
+
+    scoreboard = Scoreboard(args.scoreboard)
+    region, picked = pick_strategies(scoreboard, cameras, strategies, args.region)
+    log.info("[Multi] %d cameras, region %s", len(cameras), region)
+
+    # One session and one AV channel per camera, plus one spare each so a
+    # reconnect never waits for the old session to be released
+    if not session_mod.initialize(region, max_sessions=len(cameras) * 2, max_channels=len(cameras) * 2,
+                                  log_level=args.native_log_level, log_kb=args.native_log_kb,
+                                  log_files=args.native_log_files):
+        sys.exit(1)
+
+    metrics_server, metrics_dumper = metrics.start(args.metrics_port, args.metrics_file)
+    if metrics_server:
+        recorder.add_routes(metrics_server)
+    lock = threading.Lock()
+    # All cameras share one receive-buffer budget
+    buffers = BufferManager(args.buffer_ceiling_kb * 1024)
+    workers = []
+    for cam in cameras:
+        log.info("[Multi] %s: %s, serving on %s", cam["name"], picked[cam["name"]]["name"], SOCKET_TEMPLATE.format(name=cam["name"]))
+        worker = CameraWorker(cam, picked[cam["name"]], args, scoreboard, lock, buffers)
+        worker.start()
+        workers.append(worker)
+
+    last = {}
+    tick = min([w.watchdog.interval for w in workers if w.watchdog] or [STATS_INTERVAL])
+    last_stats = time.monotonic()
+    try:
+        while True:
+            time.sleep(tick)
+            now = time.monotonic()
+            for worker in workers:
+                worker.supervise(now)
+            if now - last_stats >= STATS_INTERVAL:
+                log_stats(workers, last, now - last_stats, buffers)
+                last_stats = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.join(timeout=5)
+        metrics.stop(metrics_server, metrics_dumper)
+        session_mod.deinitialize()
@@ -0,0 +1,87 @@
+import os
+import time
+
+FLUSH_IMMEDIATE = "immediate"
+FLUSH_KEYFRAME = "keyframe"
+FLUSH_INTERVAL = "interval"
+FLUSH_POLICIES = (FLUSH_IMMEDIATE, FLUSH_KEYFRAME, FLUSH_INTERVAL)
+
+class FrameWriter:
+    """
+    Output stage between the receive loop and go2rtc.
+
+    Frames are passed in as memoryviews of the receive buffer.
+      immediate - every frame is written straight from the view (no copy, one
+                  os.write per frame).
+      keyframe  - frames are coalesced into a preallocated staging buffer and
+                  written out after each keyframe, or earlier when max_delay_ms
+                  or max_bytes is reached.
+      interval  - frames are coalesced until max_delay_ms or max_bytes.
+    Staging is needed because the receive buffer is overwritten by the next
+    recv. Call tick() when no frame arrived so pending data is not held back.
+    """
+
+    def __init__(self, fd, policy=FLUSH_IMMEDIATE, max_delay_ms=40, max_bytes=64 * 1024):
+        if policy not in FLUSH_POLICIES:
+            raise ValueError(f"Unknown flush policy: {policy}")
+        self.fd = fd
+        self.policy = policy
+        self.max_delay = max_delay_ms / 1000.0
+        self.max_bytes = max_bytes
+        self._stage = bytearray(max_bytes if policy != FLUSH_IMMEDIATE else 0)
+        self._stage_view = memoryview(self._stage)
+        self._pending = 0
+        self._pending_since = 0.0
+
+        # Stats
+        self.frames = 0
+        self.writes = 0
+        self.bytes = 0
+
+    def write(self, view, keyframe=False, codec=0, timestamp=0):
+        self.frames += 1
+        if self.policy == FLUSH_IMMEDIATE:
+            self._write_all(view)
+            return
+
+        n = len(view)
+        if self._pending + n > self.max_bytes:
+            self.flush()
+            if n > self.max_bytes:
+                # Does not fit the staging buffer at all, send it as is
+                self._write_all(view)
+                return
+
+        if not self._pending:
+            self._pending_since = time.monotonic()
+        self._stage_view[self._pending:self._pending + n] = view
+        self._pending += n
+
+        if keyframe and self.policy == FLUSH_KEYFRAME:
+            self.flush()
+        else:
+            self.tick()
+
+    def tick(self):
+        """
+        Flushes pending data once it is older than max_delay_ms or larger than
+        max_bytes.
+        """
+        if self._pending and (self._pending >= self.max_bytes or
+                              time.monotonic() - self._pending_since >= self.max_delay):
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            n = self._pending
+            self._pending = 0
+            self._write_all(self._stage_view[:n])
+
+    def _write_all(self, view):
+        # os.write may be partial on pipes
+        total = len(view)
+        written = os.write(self.fd, view)
+        while written < total:
+            written += os.write(self.fd, view[written:])
+        self.writes += 1
+        self.bytes += total
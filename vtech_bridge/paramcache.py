@@ -0,0 +1,108 @@
+from iotc import MEDIA_CODEC_VIDEO_H264, MEDIA_CODEC_VIDEO_HEVC
+
+# Keeps what a decoder needs to start: the latest parameter sets (H.264
+# SPS/PPS, H.265 VPS/SPS/PPS) and the most recent keyframe access unit. A
+# reader that attaches mid-GOP is sent these first, so it has a picture at
+# once instead of waiting up to a GOP for the camera's next keyframe.
+
+# Largest keyframe kept; bigger ones are not cached (readers then wait for
+# the next keyframe as before)
+KEYFRAME_CAPACITY = 1024 * 1024
+
+# Room for the parameter sets, start codes included
+PARAM_CAPACITY = 4096
+
+START_CODE = b"\x00\x00\x00\x01"
+
+# NAL unit types: parameter sets, and the first VCL (slice) type - parameter
+# sets come before the first slice of an access unit, so parsing stops there
+H264_PARAM_SETS = (7, 8)
+HEVC_PARAM_SETS = (32, 33, 34)
+H264_VCL = range(1, 6)
+HEVC_VCL = range(0, 32)
+
+def nal_type(codec, header):
+    if codec == MEDIA_CODEC_VIDEO_HEVC:
+        return (header >> 1) & 0x3F
+    return header & 0x1F
+
+class ParamCache:
+    """
+    update() is called with every keyframe (Annex-B) and copies it into a
+    preallocated buffer, collecting the parameter sets that lead the access
+    unit. prime() returns what a new reader should get first. Both run
+    under the caller's lock; nothing is allocated per keyframe.
+    """
+
+    def __init__(self, capacity=KEYFRAME_CAPACITY):
+        self.keyframe = bytearray(capacity)
+        self.keyframe_view = memoryview(self.keyframe)
+        self.keyframe_size = 0
+        self.params = bytearray(PARAM_CAPACITY)
+        self.params_view = memoryview(self.params)
+        self.params_size = 0
+        self.keyframe_has_params = False
+        self.oversize = 0
+
+    def update(self, view, codec):
+        n = len(view)
+        if n > len(self.keyframe):
+            # Keep nothing rather than a keyframe older than the stream
+            self.keyframe_size = 0
+            self.oversize += 1
+            return
+        self.keyframe_view[:n] = view
+        self.keyframe_size = n
+        self.keyframe_has_params = False
+        if codec in (MEDIA_CODEC_VIDEO_H264, MEDIA_CODEC_VIDEO_HEVC):
+            self._collect_params(codec)
+
+    def _collect_params(self, codec):
+        buf = self.keyframe
+        n = self.keyframe_size
+        param_sets = HEVC_PARAM_SETS if codec == MEDIA_CODEC_VIDEO_HEVC else H264_PARAM_SETS
+        vcl = HEVC_VCL if codec == MEDIA_CODEC_VIDEO_HEVC else H264_VCL
+        size = 0
+        pos = buf.find(b"\x00\x00\x01", 0, n)
+        while 0 <= pos and pos + 3 < n:
+            header = pos + 3
+            kind = nal_type(codec, buf[header])
+            if kind in vcl:
+                break
+            end = buf.find(b"\x00\x00\x01", header, n)
+            nxt = end
+            if end < 0:
+                end = n
+            elif buf[end - 1] == 0:
+                # 4-byte start code of the next NAL unit
+                end -= 1
+            if kind in param_sets:
+                length = end - header
+                if size + 4 + length > PARAM_CAPACITY:
+                    break
+                self.params_view[size:size + 4] = START_CODE
+                self.params_view[size + 4:size + 4 + length] = self.keyframe_view[header:end]
+                size += 4 + length
+            pos = nxt
+        if size:
+            self.params_size = size
+            self.keyframe_has_params = True
+
+    def clear(self):
+        """
+        Forgets the keyframe, e.g. while the stream is paused and it would
+        only show a stale picture. The parameter sets stay.
+        """
+        self.keyframe_size = 0
+
+    def prime(self):
+        """
+        Views to send a new reader before the live stream: the parameter sets
+        (unless the cached keyframe carries its own) and the keyframe.
+        Empty while nothing is cached. Valid until the next update().
+        """
+        if not self.keyframe_size:
+            return ()
+        if self.params_size and not self.keyframe_has_params:
+            return (self.params_view[:self.params_size], self.keyframe_view[:self.keyframe_size])
+        return (self.keyframe_view[:self.keyframe_size],)
@@ -0,0 +1,202 @@
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+class FrameRing:
+    """
+    Bounded frame queue between the receive thread and the writer thread.
+
+    Frame bytes are copied into one preallocated arena and described by a
+    fixed number of slots, so nothing is allocated per frame. The producer
+    never blocks: when the arena or the slots are full the frame is dropped,
+    and so is everything after it up to the next keyframe (P-frames that
+    reference a dropped frame would only smear the picture).
+    """
+
+    def __init__(self, capacity=4 * 1024 * 1024, slots=128):
+        self.capacity = capacity
+        self.slots = slots
+        self.arena = bytearray(capacity)
+        self.view = memoryview(self.arena)
+
+        self._offset = [0] * slots
+        self._length = [0] * slots
+        self._keyframe = [False] * slots
+        self._timestamp = [0] * slots
+        self._frame_idx = [0] * slots
+        self._codec = [0] * slots
+        self._arrival = [0.0] * slots
+
+        self._head = 0       # oldest slot (being written out or next to be)
+        self._count = 0      # slots in use, including a peeked one
+        self._write_pos = 0  # arena offset for the next frame
+        self._used = 0       # arena bytes in use, excluding wrap waste
+        self._dropping = False
+        self._cond = threading.Condition()
+        self.closed = False
+
+        # Stats
+        self.frames_in = 0
+        self.frames_out = 0
+        self.dropped_frames = 0
+        self.dropped_bytes = 0
+        self.peak_frames = 0
+        self.peak_bytes = 0
+
+    def _alloc(self, n):
+        # Returns an arena offset for n bytes, or None if it does not fit
+        if self._count >= self.slots or n > self.capacity:
+            return None
+        if self._count == 0:
+            return 0
+        r = self._offset[self._head]
+        w = self._write_pos
+        if w > r:
+            if w + n <= self.capacity:
+                return w
+            if n < r:
+                return 0
+            return None
+        if w + n < r:
+            return w
+        return None
+
+    def push(self, src, n, keyframe, timestamp=0, frame_idx=0, codec=0, arrival=0.0):
+        """
+        Copies src[:n] into the ring. Returns False if the frame was dropped.
+        """
+        with self._cond:
+            if self.closed:
+                return False
+            off = None
+            if keyframe or not self._dropping:
+                off = self._alloc(n)
+            if off is None:
+                self._dropping = True
+                self.dropped_frames += 1
+                self.dropped_bytes += n
+                return False
+            self._dropping = False
+
+            self.view[off:off + n] = src[:n]
+            slot = (self._head + self._count) % self.slots
+            self._offset[slot] = off
+            self._length[slot] = n
+            self._keyframe[slot] = keyframe
+            self._timestamp[slot] = timestamp
+            self._frame_idx[slot] = frame_idx
+            self._codec[slot] = codec
+            self._arrival[slot] = arrival
+            self._write_pos = off + n
+            self._count += 1
+            self._used += n
+            self.frames_in += 1
+            if self._count > self.peak_frames:
+                self.peak_frames = self._count
+            if self._used > self.peak_bytes:
+                self.peak_bytes = self._used
+            self._cond.notify()
+            return True
+
+    def drop_until_keyframe(self):
+        """
+        Makes the producer discard frames until the next keyframe, e.g. after
+        frame loss or a reconnect.
+        """
+        with self._cond:
+            self._dropping = True
+
+    def peek(self, timeout=None):
+        """
+        Returns (view, keyframe, timestamp, frame_idx, codec, arrival) for the
+        oldest frame without removing it, or None on timeout/close. The view stays
+        valid until release().
+        """
+        with self._cond:
+            if not self._count and not self.closed:
+                self._cond.wait(timeout)
+            if not self._count:
+                return None
+            slot = self._head
+            off = self._offset[slot]
+            return (self.view[off:off + self._length[slot]], self._keyframe[slot],
+                    self._timestamp[slot], self._frame_idx[slot], self._codec[slot], self._arrival[slot])
+
+    def release(self):
+        with self._cond:
+            if self._count:
+                self._used -= self._length[self._head]
+                self._head = (self._head + 1) % self.slots
+                self._count -= 1
+                self.frames_out += 1
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    @property
+    def occupancy(self):
+        return self._count
+
+    @property
+    def used_bytes(self):
+        return self._used
+
+    def stats_line(self):
+        return (f"occupancy {self._count}/{self.slots} frames (peak {self.peak_frames}), "
+                f"{self._used // 1024}/{self.capacity // 1024} KiB (peak {self.peak_bytes // 1024}), "
+                f"in {self.frames_in}, out {self.frames_out}, dropped {self.dropped_frames} frames "
+                f"({self.dropped_bytes // 1024} KiB)")
+
+class WriterThread(threading.Thread):
+    """
+    Drains a FrameRing into an output stage (FrameWriter) so a stalled
+    consumer never stops the receive loop from calling into the SDK.
+    If the output fails the ring is closed, which ends the receive loop.
+    With a pacer (JitterBuffer) each frame stays in the ring until it is
+    due.
+    """
+
+    def __init__(self, ring, writer, pacer=None):
+        super().__init__(name="writer", daemon=True)
+        self.ring = ring
+        self.writer = writer
+        self.pacer = pacer
+        self.error = None
+
+    def run(self):
+        ring = self.ring
+        writer = self.writer
+        pacer = self.pacer
+        due = None
+        timeout = min(getattr(writer, "max_delay", 0.1), 0.1)
+        try:
+            while True:
+                item = ring.peek(timeout)
+                if item is None:
+                    if ring.closed:
+                        break
+                    writer.tick()
+                    continue
+                if pacer:
+                    if due is None:
+                        due = pacer.schedule(item[5], item[2])
+                    wait = pacer.wait(item[5], due, ring)
+                    if wait:
+                        # Look again after the wait: the ring may fill up
+                        time.sleep(min(wait, timeout))
+                        writer.tick()
+                        continue
+                    due = None
+                writer.write(item[0], item[1], item[4], item[2])
+                ring.release()
+            writer.flush()
+        except OSError as e:
+            # BrokenPipeError etc. - the reader went away
+            self.error = e
+            log.warning("[Writer] Output error: %s", e)
+        finally:
+            ring.close()
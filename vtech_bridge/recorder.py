@@ -0,0 +1,458 @@
+import argparse
+import collections
+import datetime
+import glob
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Rolling DVR for the raw elementary stream.
+#
+# Each camera records into a fixed set of preallocated segment files that are
+# reused in turn, so disk use is bounded by segments * SEGMENT_SIZE. A
+# segment is written through mmap and starts with a header holding a
+# keyframe index (data offset, camera timestamp, wall clock), so seeking and
+# clip export read the index instead of scanning the data.
+#
+# Segment layout:
+#   0              SEGMENT_HEADER
+#   4096           INDEX_ENTRIES * INDEX_ENTRY
+#   DATA_OFFSET    H.264/H.265 Annex B data, data_length bytes
+
+SEGMENT_MAGIC = b"VDVR"
+SEGMENT_VERSION = 1
+# magic, version, codec id (MEDIA_CODEC_VIDEO_*, 0: unknown, i.e. written
+# before it was recorded), sequence, start time, data length, index count
+SEGMENT_HEADER = struct.Struct("<4sHHQdII")
+# data offset, camera timestamp (ms), wall clock (ms)
+INDEX_ENTRY = struct.Struct("<IIQ")
+INDEX_ENTRIES = 4096
+INDEX_OFFSET = 4096
+DATA_OFFSET = INDEX_OFFSET + INDEX_ENTRIES * INDEX_ENTRY.size
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+# In-RAM pre-event buffer
+PRE_EVENT_SECONDS = 10
+PRE_EVENT_MAX_BYTES = 8 * 1024 * 1024
+
+# Seconds recorded after a clip trigger
+CLIP_SECONDS = 20
+
+# name -> Recorder, for the /clip route
+RECORDERS = {}
+
+class Segment:
+    """
+    One mmap'd segment file. Header fields are updated in place after every
+    write, so a crash loses at most the frame being written.
+    """
+
+    def __init__(self, path, size, sequence, codec=0):
+        self.path = path
+        self.size = size
+        self.codec = codec
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self.fd).st_size != size:
+            os.ftruncate(self.fd, size)
+            try:
+                # Reserve the blocks now so recording never hits ENOSPC mid-segment
+                os.posix_fallocate(self.fd, 0, size)
+            except (AttributeError, OSError):
+                pass
+        self.mm = mmap.mmap(self.fd, size)
+        self.sequence = sequence
+        self.data_length = 0
+        self.index_count = 0
+        self.start_time = time.time()
+        self._write_header()
+
+    @property
+    def remaining(self):
+        return self.size - DATA_OFFSET - self.data_length
+
+    def _write_header(self):
+        SEGMENT_HEADER.pack_into(self.mm, 0, SEGMENT_MAGIC, SEGMENT_VERSION, self.codec, self.sequence,
+                                 self.start_time, self.data_length, self.index_count)
+
+    def append(self, view, keyframe, timestamp, wall):
+        n = len(view)
+        if keyframe and self.index_count < INDEX_ENTRIES:
+            INDEX_ENTRY.pack_into(self.mm, INDEX_OFFSET + self.index_count * INDEX_ENTRY.size,
+                                  self.data_length, timestamp & 0xffffffff, int(wall * 1000))
+            self.index_count += 1
+        pos = DATA_OFFSET + self.data_length
+        self.mm[pos:pos + n] = view
+        self.data_length += n
+        self._write_header()
+
+    def close(self):
+        self.mm.flush()
+        self.mm.close()
+        os.close(self.fd)
+
+def read_segment(path):
+    """
+    Returns (header dict, [(offset, camera ts, wall seconds)]) or None if
+    the file is not a segment.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(DATA_OFFSET)
+    if len(head) < DATA_OFFSET:
+        return None
+    magic, version, codec, sequence, start, length, count = SEGMENT_HEADER.unpack_from(head, 0)
+    if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+        return None
+    index = [INDEX_ENTRY.unpack_from(head, INDEX_OFFSET + i * INDEX_ENTRY.size) for i in range(min(count, INDEX_ENTRIES))]
+    header = {"path": path, "sequence": sequence, "codec": codec, "start": start, "data_length": length,
+              "keyframes": len(index)}
+    return header, [(off, ts, wall / 1000.0) for off, ts, wall in index]
+
+def codec_extension(codec):
+    """
+    File extension for a raw elementary stream of this codec id; unknown
+    ids (segments from before the codec was recorded) count as H.264.
+    """
+    # Imported here: list/export only need iotc for this, not at startup
+    from iotc import MEDIA_CODEC_VIDEO_HEVC
+    return ".h265" if codec == MEDIA_CODEC_VIDEO_HEVC else ".h264"
+
+class PreEventBuffer:
+    """
+    The last `seconds` of video in a preallocated arena, trimmed so it always
+    starts at a keyframe. Written and read on the recorder thread only.
+    """
+
+    def __init__(self, seconds=PRE_EVENT_SECONDS, capacity=PRE_EVENT_MAX_BYTES):
+        self.seconds = seconds
+        self.capacity = capacity
+        self.arena = bytearray(capacity)
+        self.view = memoryview(self.arena)
+        self.frames = collections.deque() # (offset, length, keyframe, wall)
+        self._write_pos = 0
+
+    def push(self, view, keyframe, wall):
+        n = len(view)
+        if n > self.capacity:
+            self.frames.clear()
+            return
+        frames = self.frames
+        off = self._write_pos
+        if off + n > self.capacity:
+            # Wrap: whatever lies beyond the write position is the oldest data
+            while frames and frames[0][0] >= off:
+                frames.popleft()
+            off = 0
+        while frames and frames[0][0] < off + n and frames[0][0] + frames[0][1] > off:
+            frames.popleft()
+        self.view[off:off + n] = view
+        frames.append((off, n, keyframe, wall))
+        self._write_pos = off + n
+
+        if keyframe:
+            # Drop everything before the newest keyframe that is already old
+            # enough to cover the whole pre-event window
+            cut = None
+            for i, (_, _, key, t) in enumerate(frames):
+                if key and wall - t >= self.seconds:
+                    cut = i
+            for _ in range(cut or 0):
+                frames.popleft()
+
+    def dump(self, f):
+        """
+        Writes the buffered frames, from the oldest keyframe on, to f.
+        Returns the number of bytes written.
+        """
+        written = 0
+        started = False
+        for off, n, keyframe, _ in self.frames:
+            started = started or keyframe
+            if started:
+                f.write(self.view[off:off + n])
+                written += n
+        return written
+
+class Recorder:
+    """
+    Rolling segment recorder plus pre-event buffer for one camera. All
+    writes happen on the RecorderThread; save_clip() may be called from any
+    thread and only hands the request over.
+    """
+
+    def __init__(self, name, directory, total_bytes, clips_dir, segment_size=SEGMENT_SIZE,
+                 pre_event_seconds=PRE_EVENT_SECONDS, clip_seconds=CLIP_SECONDS):
+        self.name = name
+        self.directory = directory
+        self.clips_dir = clips_dir
+        self.segment_size = segment_size
+        self.segments = total_bytes // segment_size if total_bytes else 0
+        self.clip_seconds = clip_seconds
+        self.pre_event = PreEventBuffer(pre_event_seconds)
+        self.segment = None
+        self.codec = 0 # of the frames being recorded
+        self._slot = 0
+        self._sequence = 0
+        self._gop_bytes = 0
+        self._since_keyframe = 0
+        self._clip_request = None
+        self._clip = None # (file, path, until)
+
+        # Stats
+        self.bytes = 0
+        self.rotations = 0
+        self.clips = 0
+
+        if self.segments:
+            os.makedirs(directory, exist_ok=True)
+            self._resume()
+            log.info("[Recorder] %s: %d x %d MiB segments in %s", name, self.segments, segment_size // 1048576, directory)
+        RECORDERS[name] = self
+
+    def _segment_path(self, slot):
+        return os.path.join(self.directory, f"seg_{slot:03d}.dvr")
+
+    def _resume(self):
+        # Continue after the newest existing segment instead of overwriting it
+        newest = None
+        for slot in range(self.segments):
+            path = self._segment_path(slot)
+            if not os.path.exists(path):
+                continue
+            info = read_segment(path)
+            if info and (newest is None or info[0]["sequence"] > newest[1]):
+                newest = (slot, info[0]["sequence"])
+        if newest:
+            self._slot = (newest[0] + 1) % self.segments
+            self._sequence = newest[1] + 1
+
+    def _rotate(self):
+        if self.segment:
+            self.segment.close()
+            self.rotations += 1
+        self.segment = Segment(self._segment_path(self._slot), self.segment_size, self._sequence, self.codec)
+        self._slot = (self._slot + 1) % self.segments
+        self._sequence += 1
+
+    def write(self, view, keyframe, timestamp=0, codec=0):
+        wall = time.time()
+        n = len(view)
+        if codec:
+            self.codec = codec
+        if keyframe:
+            self._gop_bytes = self._since_keyframe
+            self._since_keyframe = 0
+        self._since_keyframe += n
+        if self._clip_request:
+            self._start_clip(wall)
+
+        if self.segments:
+            seg = self.segment
+            # A segment holds one codec, so its header can say which
+            if seg is None or seg.codec != self.codec or n > seg.remaining or (keyframe and (seg.remaining < 2 * self._gop_bytes or seg.index_count >= INDEX_ENTRIES)):
+                # Segments start at a keyframe whenever the last GOP suggests
+                # the next one would not fit
+                self._rotate()
+                seg = self.segment
+            if n <= seg.remaining:
+                seg.append(view, keyframe, timestamp, wall)
+                self.bytes += n
+
+        if self._clip:
+            f, path, until = self._clip
+            f.write(view)
+            if wall >= until:
+                self._finish_clip()
+        self.pre_event.push(view, keyframe, wall)
+
+    def save_clip(self, seconds=None):
+        """
+        Requests a clip: the pre-event buffer plus `seconds` from now. The
+        recorder thread opens the file with the next frame; returns its path.
+        """
+        os.makedirs(self.clips_dir, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(self.clips_dir, f"{self.name}_{stamp}{codec_extension(self.codec)}")
+        self._clip_request = (path, seconds or self.clip_seconds)
+        return path
+
+    def _start_clip(self, wall):
+        path, seconds = self._clip_request
+        self._clip_request = None
+        if self._clip:
+            # Already recording one, just extend it
+            f, old_path, until = self._clip
+            self._clip = (f, old_path, max(until, wall + seconds))
+            return
+        try:
+            f = open(path, 'wb')
+        except OSError as e:
+            log.warning("[Recorder] Cannot write clip %s: %s", path, e)
+            return
+        pre = self.pre_event.dump(f)
+        self._clip = (f, path, wall + seconds)
+        log.info("[Recorder] %s: clip %s started (%d KiB pre-event)", self.name, path, pre // 1024)
+
+    def _finish_clip(self):
+        f, path, _ = self._clip
+        self._clip = None
+        f.close()
+        self.clips += 1
+        log.info("[Recorder] %s: clip %s saved", self.name, path)
+
+    def stats_line(self):
+        return (f"{self.bytes // 1048576} MiB recorded, {self.rotations} segment rotations, "
+                f"{self.clips} clips, pre-event {len(self.pre_event.frames)} frames")
+
+    def close(self):
+        if self._clip:
+            self._finish_clip()
+        if self.segment:
+            self.segment.close()
+            self.segment = None
+        if RECORDERS.get(self.name) is self:
+            del RECORDERS[self.name]
+
+class RecorderThread(threading.Thread):
+    """
+    Drains the recorder's own FrameRing, so disk stalls only ever drop
+    recorded frames and never hold up live output.
+    """
+
+    def __init__(self, ring, recorder):
+        super().__init__(name="recorder", daemon=True)
+        self.ring = ring
+        self.recorder = recorder
+
+    def run(self):
+        ring = self.ring
+        recorder = self.recorder
+        try:
+            while True:
+                item = ring.peek(0.5)
+                if item is None:
+                    if ring.closed:
+                        break
+                    continue
+                recorder.write(item[0], item[1], item[2], item[4])
+                ring.release()
+        except OSError as e:
+            log.warning("[Recorder] Write error: %s", e)
+        finally:
+            ring.close()
+            recorder.close()
+
+def clip_route(body):
+    """
+    POST /clip handler for MetricsServer. Body (optional JSON):
+    {"camera": name, "seconds": n}; camera may be omitted with one camera.
+    """
+    try:
+        request = json.loads(body) if body else {}
+    except ValueError:
+        return 400, "text/plain", b"invalid JSON\n"
+    name = request.get("camera")
+    if name is None and len(RECORDERS) == 1:
+        name = next(iter(RECORDERS))
+    recorder = RECORDERS.get(name)
+    if recorder is None:
+        return 404, "text/plain", f"unknown camera {name}, recording: {sorted(RECORDERS)}\n".encode()
+    path = recorder.save_clip(request.get("seconds"))
+    return 200, "application/json", json.dumps({"camera": name, "path": path}).encode()
+
+def add_routes(server):
+    server.add_route("POST", "/clip", clip_route)
+
+def list_segments(directory):
+    """
+    All readable segments in a camera directory, oldest first.
+    """
+    segments = []
+    for path in glob.glob(os.path.join(directory, "seg_*.dvr")):
+        info = read_segment(path)
+        if info and info[0]["data_length"]:
+            segments.append(info)
+    segments.sort(key=lambda s: s[0]["sequence"])
+    return segments
+
+def export(directory, start, end, out):
+    """
+    Copies the recording between wall clock times start and end (seconds)
+    to the file object out, from the last keyframe at or before start up to
+    the first keyframe after end. Returns (bytes written, codec id of the
+    first exported segment).
+    """
+    segments = list_segments(directory)
+    # One keyframe timeline across segments: (wall, segment number, offset)
+    keyframes = [(wall, n, off) for n, (_, index) in enumerate(segments) for off, _, wall in index]
+    if not keyframes or keyframes[0][0] > end:
+        return 0, 0
+    first = 0
+    for i, (wall, _, _) in enumerate(keyframes):
+        if wall <= start:
+            first = i
+    last = next((i for i, (wall, _, _) in enumerate(keyframes) if wall > end), None)
+
+    _, seg_from, off_from = keyframes[first]
+    if last is None:
+        seg_to, off_to = len(segments) - 1, segments[-1][0]["data_length"]
+    else:
+        _, seg_to, off_to = keyframes[last]
+
+    written = 0
+    for n in range(seg_from, seg_to + 1):
+        header = segments[n][0]
+        begin = off_from if n == seg_from else 0
+        stop = off_to if n == seg_to else header["data_length"]
+        with open(header["path"], 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                out.write(mm[DATA_OFFSET + begin:DATA_OFFSET + stop])
+        written += stop - begin
+    return written, segments[seg_from][0]["codec"]
+
+def _parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and export VTech bridge recordings")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_list = sub.add_parser("list", help="List segments of a camera")
+    p_list.add_argument("directory")
+    p_export = sub.add_parser("export", help="Export a time range as a raw elementary stream")
+    p_export.add_argument("directory")
+    p_export.add_argument("--start", required=True, help="Epoch seconds or ISO time (local)")
+    p_export.add_argument("--end", required=True, help="Epoch seconds or ISO time (local)")
+    p_export.add_argument("-o", "--output", required=True)
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for header, index in list_segments(args.directory):
+            first = datetime.datetime.fromtimestamp(index[0][2]).isoformat(timespec="seconds") if index else "-"
+            last = datetime.datetime.fromtimestamp(index[-1][2]).isoformat(timespec="seconds") if index else "-"
+            codec = f"0x{header['codec']:02X}" if header["codec"] else "-"
+            print(f"{os.path.basename(header['path'])}  seq {header['sequence']:6d}  codec {codec}  "
+                  f"{header['data_length'] // 1048576:4d} MiB  {header['keyframes']:5d} keyframes  {first} .. {last}")
+        return
+
+    start, end = _parse_time(args.start), _parse_time(args.end)
+    with open(args.output, 'wb') as out:
+        n, codec = export(args.directory, start, end, out)
+    print(f"Wrote {n} bytes to {args.output}", file=sys.stderr)
+    if n and not args.output.endswith(codec_extension(codec)):
+        print(f"Note: the recording is {codec_extension(codec)[1:].upper()}; name the file *{codec_extension(codec)} "
+              f"so players detect it", file=sys.stderr)
+    if not n:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
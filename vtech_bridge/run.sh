@@ -2,15 +2,6 @@
 
 echo "Starting VTech Bridge Add-on..."
 
-# Diagnostic Checks
-echo "--- DIAGNOSTICS ---"
-python3 --version
-echo "Checking IOTC library..."
-python3 /iotc.py
-echo "Listing root directory:"
-ls -la /
-echo "-------------------"
-
 # Read config from Home Assistant options
 CONFIG_PATH="/data/options.json"
 
@@ -18,11 +9,71 @@ if [ -f "$CONFIG_PATH" ]; then
     CAMERA_UID=$(jq -r '.uid // empty' $CONFIG_PATH)
     AUTH_KEY=$(jq -r '.auth_key // empty' $CONFIG_PATH)
     SDK_KEY=$(jq -r '.sdk_key // empty' $CONFIG_PATH)
+    OUTPUT_FORMAT=$(jq -r '.output_format // "raw"' $CONFIG_PATH)
+    FLUSH_POLICY=$(jq -r '.flush_policy // "immediate"' $CONFIG_PATH)
+    FLUSH_MS=$(jq -r '.flush_interval_ms // 40' $CONFIG_PATH)
+    FLUSH_BYTES=$(jq -r '.flush_bytes // 65536' $CONFIG_PATH)
+    RING_KB=$(jq -r '.ring_kb // 4096' $CONFIG_PATH)
+    RING_FRAMES=$(jq -r '.ring_frames // 128' $CONFIG_PATH)
+    BUFFER_CEILING_KB=$(jq -r '.buffer_ceiling_kb // 8192' $CONFIG_PATH)
+    JITTER_MS=$(jq -r '.jitter_ms // 0' $CONFIG_PATH)
+    JITTER_ADAPTIVE=$(jq -r 'if .jitter_adaptive == null then true else .jitter_adaptive end' $CONFIG_PATH)
+    ABR=$(jq -r '.abr // false' $CONFIG_PATH)
+    AUDIO=$(jq -r '.audio // false' $CONFIG_PATH)
+    AUDIO_FORMAT=$(jq -r '.audio_format // "mpegts"' $CONFIG_PATH)
+    DAEMON=$(jq -r 'if .daemon == null then true else .daemon end' $CONFIG_PATH)
+    IDLE_SECONDS=$(jq -r '.idle_seconds // 30' $CONFIG_PATH)
+    RACE=$(jq -r '.race_concurrency // 3' $CONFIG_PATH)
+    METRICS_PORT=$(jq -r '.metrics_port // 0' $CONFIG_PATH)
+    REQUEST_KEYFRAME=$(jq -r '.request_keyframe // false' $CONFIG_PATH)
+    RECORD=$(jq -r '.record // false' $CONFIG_PATH)
+    RECORD_MB=$(jq -r '.record_mb // 1024' $CONFIG_PATH)
+    PRE_EVENT_SECONDS=$(jq -r '.pre_event_seconds // 10' $CONFIG_PATH)
+    CLIP_SECONDS=$(jq -r '.clip_seconds // 20' $CONFIG_PATH)
+    CAPTURE=$(jq -r '.capture // false' $CONFIG_PATH)
+    CAPTURE_MB=$(jq -r '.capture_mb // 512' $CONFIG_PATH)
+    STALL_SECONDS=$(jq -r '.stall_seconds // 10' $CONFIG_PATH)
+    STANDBY=$(jq -r 'if .standby == null then true else .standby end' $CONFIG_PATH)
+    LOG_LEVEL=$(jq -r '.log_level // "info"' $CONFIG_PATH)
+    NATIVE_LOG_LEVEL=$(jq -r '.native_log_level // "warning"' $CONFIG_PATH)
+    NATIVE_LOG_KB=$(jq -r '.native_log_kb // 1024' $CONFIG_PATH)
+    NATIVE_LOG_FILES=$(jq -r '.native_log_files // 2' $CONFIG_PATH)
+    # Camera names as multicam.camera_name() sanitises them
+    CAMERA_NAMES=$(jq -r '(.cameras // []) | to_entries[] | select((.value.uid // "") != "" and (.value.auth_key // "") != "") | ((.value.name // "") | gsub("[^A-Za-z0-9_]"; "_")) as $n | if $n == "" then "camera\(.key + 1)" else $n end' $CONFIG_PATH | awk '!seen[$0]++')
 else
     echo "Warning: /data/options.json not found. Using environment variables if available."
     CAMERA_UID=${CAMERA_UID}
     AUTH_KEY=${AUTH_KEY}
     SDK_KEY=${SDK_KEY}
+    OUTPUT_FORMAT=${OUTPUT_FORMAT:-raw}
+    FLUSH_POLICY=${FLUSH_POLICY:-immediate}
+    FLUSH_MS=${FLUSH_MS:-40}
+    FLUSH_BYTES=${FLUSH_BYTES:-65536}
+    RING_KB=${RING_KB:-4096}
+    RING_FRAMES=${RING_FRAMES:-128}
+    BUFFER_CEILING_KB=${BUFFER_CEILING_KB:-8192}
+    JITTER_MS=${JITTER_MS:-0}
+    JITTER_ADAPTIVE=${JITTER_ADAPTIVE:-true}
+    ABR=${ABR:-false}
+    AUDIO=${AUDIO:-false}
+    AUDIO_FORMAT=${AUDIO_FORMAT:-mpegts}
+    DAEMON=${DAEMON:-true}
+    IDLE_SECONDS=${IDLE_SECONDS:-30}
+    RACE=${RACE:-3}
+    METRICS_PORT=${METRICS_PORT:-0}
+    REQUEST_KEYFRAME=${REQUEST_KEYFRAME:-false}
+    RECORD=${RECORD:-false}
+    RECORD_MB=${RECORD_MB:-1024}
+    PRE_EVENT_SECONDS=${PRE_EVENT_SECONDS:-10}
+    CLIP_SECONDS=${CLIP_SECONDS:-20}
+    CAPTURE=${CAPTURE:-false}
+    CAPTURE_MB=${CAPTURE_MB:-512}
+    STALL_SECONDS=${STALL_SECONDS:-10}
+    STANDBY=${STANDBY:-true}
+    LOG_LEVEL=${LOG_LEVEL:-info}
+    NATIVE_LOG_LEVEL=${NATIVE_LOG_LEVEL:-warning}
+    NATIVE_LOG_KB=${NATIVE_LOG_KB:-1024}
+    NATIVE_LOG_FILES=${NATIVE_LOG_FILES:-2}
 fi
 
 # Export SDK_KEY if found
@@ -30,13 +81,80 @@ if [ -n "$SDK_KEY" ]; then
     export SDK_KEY="$SDK_KEY"
 fi
 
-if [ -z "$CAMERA_UID" ] || [ -z "$AUTH_KEY" ]; then
-    echo "ERROR: UID or Auth Key is missing! Please configure the add-on."
+if [ -z "$CAMERA_NAMES" ] && { [ -z "$CAMERA_UID" ] || [ -z "$AUTH_KEY" ]; }; then
+    echo "ERROR: UID or Auth Key is missing! Please configure the add-on (uid/auth_key or cameras)."
     exit 1
 fi
 
+# Pick the TUTK build that loads and initialises on this host. Probing only
+# happens when the libraries changed; otherwise this is a cache lookup.
+# (Manual diagnostics: python3 /libselect.py --force, python3 /test_libs.py)
+IOTC_LIB_DIR=$(python3 /libselect.py)
+if [ -n "$IOTC_LIB_DIR" ]; then
+    export IOTC_LIB_DIR
+    echo "Using TUTK libraries from $IOTC_LIB_DIR"
+else
+    echo "Warning: no TUTK library build passed the probe, falling back to /usr/lib"
+fi
+
 echo "Configuring go2rtc..."
 
+BRIDGE_ARGS="--flush-policy $FLUSH_POLICY --flush-ms $FLUSH_MS --flush-bytes $FLUSH_BYTES --ring-kb $RING_KB --ring-frames $RING_FRAMES --buffer-ceiling-kb $BUFFER_CEILING_KB --race $RACE"
+# raw: bare H.264/H.265, mpegts: timestamped MPEG-TS (go2rtc detects either)
+BRIDGE_ARGS="$BRIDGE_ARGS --output-format $OUTPUT_FORMAT"
+if [ "$JITTER_MS" != "0" ]; then
+    # Pace output by camera timestamps; adaptive: JITTER_MS is the ceiling
+    BRIDGE_ARGS="$BRIDGE_ARGS --jitter-ms $JITTER_MS"
+    if [ "$JITTER_ADAPTIVE" = "true" ]; then
+        BRIDGE_ARGS="$BRIDGE_ARGS --jitter-adaptive"
+    fi
+fi
+# Reconnect/restart a camera that stays connected but stops sending frames
+BRIDGE_ARGS="$BRIDGE_ARGS --stall-seconds $STALL_SECONDS"
+# Bridge log level; the native SDK log rotates through a few small files
+BRIDGE_ARGS="$BRIDGE_ARGS --log-level $LOG_LEVEL --native-log-level $NATIVE_LOG_LEVEL --native-log-kb $NATIVE_LOG_KB --native-log-files $NATIVE_LOG_FILES"
+if [ "$STANDBY" = "true" ]; then
+    # Second worker with the SDK already initialised, promoted on failover
+    BRIDGE_ARGS="$BRIDGE_ARGS --standby"
+fi
+# Stream health: Prometheus text on METRICS_PORT, JSON snapshot every minute
+BRIDGE_ARGS="$BRIDGE_ARGS --metrics-port $METRICS_PORT --metrics-file /data/metrics.json"
+if [ "$ABR" = "true" ]; then
+    # Lower the camera's stream quality while frames go missing
+    BRIDGE_ARGS="$BRIDGE_ARGS --abr"
+fi
+# Daemon mode: stop the camera's stream while nobody watches, keep the session
+BRIDGE_ARGS="$BRIDGE_ARGS --idle-seconds $IDLE_SECONDS"
+if [ "$REQUEST_KEYFRAME" = "true" ]; then
+    BRIDGE_ARGS="$BRIDGE_ARGS --request-keyframe"
+fi
+if [ "$RECORD" = "true" ]; then
+    # Rolling segments per camera plus clips under /media/vtech (see README)
+    BRIDGE_ARGS="$BRIDGE_ARGS --record-dir /media/vtech --record-mb $RECORD_MB --pre-event-seconds $PRE_EVENT_SECONDS --clip-seconds $CLIP_SECONDS"
+    echo "Recording enabled: /media/vtech (${RECORD_MB} MiB per camera)"
+fi
+if [ "$CAPTURE" = "true" ]; then
+    # Raw session capture for offline replay (python3 /capture.py replay ...)
+    BRIDGE_ARGS="$BRIDGE_ARGS --capture-dir /media/vtech/captures --capture-mb $CAPTURE_MB"
+    echo "Capture enabled: /media/vtech/captures (${CAPTURE_MB} MiB per camera)"
+fi
+if [ "$AUDIO" = "true" ]; then
+    # Audio is written to a FIFO next to the video stream (see README)
+    BRIDGE_ARGS="$BRIDGE_ARGS --audio --audio-fifo /tmp/vtech_audio --audio-format $AUDIO_FORMAT"
+    echo "Audio enabled: /tmp/vtech_audio ($AUDIO_FORMAT)"
+fi
+
+# One go2rtc stream: the video source, plus the audio FIFO as a second
+# source when go2rtc can read it (mpegts)
+stream_entry() {
+    if [ "$AUDIO" = "true" ] && [ "$AUDIO_FORMAT" = "mpegts" ]; then
+        [ -p "$3" ] || mkfifo "$3"
+        printf '  %s:\n    - %s\n    - exec:python3 -u /attach.py --fifo %s\n' "$1" "$2" "$3"
+    else
+        printf '  %s: %s\n' "$1" "$2"
+    fi
+}
+
 # Create debug wrapper
 cat > /debug_wrapper.sh <<'EOF'
 #!/bin/bash
@@ -50,11 +168,34 @@ touch /var/log/bridge.err
 touch /var/log/iotc_native.log
 tail -F /var/log/bridge.err /var/log/iotc_native.log &
 
+BRIDGE_SOCKET=/tmp/vtech_bridge.sock
+if [ -n "$CAMERA_NAMES" ]; then
+    # Multi-camera: one bridge process for all cameras, one socket and one
+    # go2rtc stream per camera
+    echo "$(date): Starting multi-camera bridge" >> /var/log/bridge.err
+    python3 -u /bridge.py --cameras "$CONFIG_PATH" $BRIDGE_ARGS 2>> /var/log/bridge.err &
+    STREAMS=""
+    for NAME in $CAMERA_NAMES; do
+        STREAMS="$STREAMS$(stream_entry "$NAME" "exec:python3 -u /attach.py --socket /tmp/vtech_$NAME.sock" "/tmp/vtech_audio_$NAME")
+"
+        echo "Camera stream: $NAME"
+    done
+elif [ "$DAEMON" = "true" ]; then
+    # One long-lived bridge keeps the P2P session and stream warm. go2rtc
+    # (and any other reader) attaches to its socket in milliseconds.
+    echo "$(date): Starting bridge daemon" >> /var/log/bridge.err
+    python3 -u /bridge.py --uid "$CAMERA_UID" --auth_key "$AUTH_KEY" $BRIDGE_ARGS --daemon --socket "$BRIDGE_SOCKET" 2>> /var/log/bridge.err &
+    STREAMS="$(stream_entry baby_monitor "exec:python3 -u /attach.py --socket $BRIDGE_SOCKET" /tmp/vtech_audio)
+"
+else
+    STREAMS="$(stream_entry baby_monitor "exec:/debug_wrapper.sh --uid \"$CAMERA_UID\" --auth_key \"$AUTH_KEY\" $BRIDGE_ARGS" /tmp/vtech_audio)
+"
+fi
+
 # Create go2rtc config
 cat > /tmp/go2rtc.yaml <<EOF
 streams:
-  baby_monitor: exec:/debug_wrapper.sh --uid "$CAMERA_UID" --auth_key "$AUTH_KEY"
-  
+$STREAMS
 api:
   listen: ":1984"
 
@@ -0,0 +1,140 @@
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+SCOREBOARD_FILE = "/data/strategy_scores.json"
+
+# Connect latencies kept per strategy
+LATENCY_WINDOW = 20
+
+# Stats not refreshed for this long are forgotten, so a strategy that failed
+# once gets a fresh chance eventually (seconds)
+EXPIRY = 7 * 24 * 3600
+
+def _percentile(sorted_values, pct):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    rank = math.ceil(pct / 100.0 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+class Scoreboard:
+    """
+    Persistent record of how each connection strategy performs, per camera UID:
+
+        {uid: {strategy name: {"attempts", "successes", "latencies",
+                               "last_success", "last_attempt"}}}
+
+    Used to order strategies so each start goes straight to the historically
+    fastest working one. Writes are atomic (temp file + fsync + rename).
+    """
+
+    def __init__(self, path=SCOREBOARD_FILE, expiry=EXPIRY):
+        self.path = path
+        self.expiry = expiry
+        self.data = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                return data
+            print(f"[Scoreboard] Ignoring malformed {self.path}", file=sys.stderr)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"[Scoreboard] Ignoring unreadable {self.path}: {e}", file=sys.stderr)
+        return {}
+
+    def save(self):
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", prefix=".scores.")
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            tmp = None
+        except OSError as e:
+            print(f"[Scoreboard] Failed to save {self.path}: {e}", file=sys.stderr)
+        finally:
+            if tmp:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+
+    def _entry(self, uid, name, now):
+        entry = self.data.get(uid, {}).get(name)
+        if entry is None or now - entry.get("last_attempt", 0) > self.expiry:
+            return None
+        return entry
+
+    def record(self, uid, name, success, latency=None, now=None):
+        """
+        Records one connect attempt. latency is the time to CONNECTED (s).
+        """
+        now = now or time.time()
+        entry = self._entry(uid, name, now)
+        if entry is None:
+            entry = {"attempts": 0, "successes": 0, "latencies": [], "last_success": None, "last_attempt": 0}
+            self.data.setdefault(uid, {})[name] = entry
+        entry["attempts"] += 1
+        entry["last_attempt"] = now
+        if success:
+            entry["successes"] += 1
+            entry["last_success"] = now
+            if latency is not None:
+                entry["latencies"] = (entry["latencies"] + [round(latency, 3)])[-LATENCY_WINDOW:]
+
+    def stats(self, uid, name, now=None):
+        """
+        Returns {"attempts", "success_rate", "median", "p95", "last_success"}
+        or None if nothing (recent) is known about this strategy.
+        """
+        entry = self._entry(uid, name, now or time.time())
+        if entry is None or not entry["attempts"]:
+            return None
+        latencies = sorted(entry["latencies"])
+        return {
+            "attempts": entry["attempts"],
+            "success_rate": entry["successes"] / entry["attempts"],
+            "median": _percentile(latencies, 50),
+            "p95": _percentile(latencies, 95),
+            "last_success": entry["last_success"],
+        }
+
+    def order(self, uid, strategies, now=None):
+        """
+        Returns strategy indices, best first: strategies that worked, by
+        expected time to connect (median / success rate), then untried ones
+        in list order, then ones that only ever failed.
+        """
+        now = now or time.time()
+
+        def key(i):
+            s = self.stats(uid, strategies[i]["name"], now)
+            if s is None:
+                return (1, 0, i)
+            if not s["success_rate"] or s["median"] is None:
+                return (2, s["attempts"], i)
+            return (0, s["median"] / s["success_rate"], i)
+
+        return sorted(range(len(strategies)), key=key)
+
+    def describe(self, uid, name, now=None):
+        now = now or time.time()
+        s = self.stats(uid, name, now)
+        if s is None:
+            return "untried"
+        text = f"{s['success_rate'] * 100:.0f}% of {s['attempts']}"
+        if s["median"] is not None:
+            text += f", median {s['median']:.2f}s, p95 {s['p95']:.2f}s"
+        if s["last_success"]:
+            text += f", last ok {(now - s['last_success']) / 3600:.1f}h ago"
+        return text
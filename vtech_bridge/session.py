@@ -0,0 +1,216 @@
+import logging
+import os
+import random
+import time
+
+import iotc
+import vtech_stream_codes as vtech
+
+log = logging.getLogger(__name__)
+
+# Native SDK log (IOTC_Set_Log_Attr): level names to the SDK's LogLevel
+# values; "off" leaves the native log disabled
+NATIVE_LOG_PATH = "/var/log/iotc_native.log"
+NATIVE_LOG_LEVELS = {"verbose": 0, "debug": 1, "info": 2, "warning": 3, "error": 4}
+NATIVE_LOG_CHOICES = ("off",) + tuple(NATIVE_LOG_LEVELS)
+
+# Reconnect backoff: first retry right away, then base * 2^n with jitter, capped
+RECONNECT_BASE_DELAY = 0.2
+RECONNECT_MAX_DELAY = 10.0
+RECONNECT_ATTEMPTS = 8
+
+def initialize(region, max_sessions=None, max_channels=0, log_level="warning", log_kb=1024, log_files=2):
+    """
+    Process-wide SDK setup: native log, region, license key, IOTC_Initialize2
+    and avInitialize. Returns False if IOTC could not be initialized.
+    max_sessions/max_channels size the SDK tables when one process serves
+    several cameras; the defaults keep the SDK's own limits. The native log
+    rotates through log_files files of log_kb KiB each.
+    """
+    # 0. Enable Logging
+    if log_level != "off":
+        try:
+            iotc.IOTC_Set_Log_Attr(NATIVE_LOG_LEVELS[log_level], NATIVE_LOG_PATH, log_kb * 1024, log_files)
+            log.info("[Worker] Enabled IOTC native logging (%s, %d x %d KiB)", log_level, log_files, log_kb)
+        except Exception as e:
+            log.warning("[Worker] Failed to set log attr: %s", e)
+
+    # 0.5 Set Region
+    try:
+        iotc.TUTK_SDK_Set_Region(region)
+        log.info("[Worker] Set Region: %s", region)
+    except Exception as e:
+        log.warning("[Worker] Failed to set region: %s", e)
+
+    # 0.6 Set License Key
+    sdk_key = os.getenv("SDK_KEY") or os.getenv("TUTK_LICENSE_KEY")
+    if sdk_key:
+        try:
+            log.info("[Worker] Setting License Key (len=%s)...", len(sdk_key))
+            iotc.TUTK_SDK_Set_License_Key(sdk_key)
+        except Exception as e:
+            log.warning("[Worker] Failed to set license key: %s", e)
+    else:
+        log.info("[Worker] No SDK_KEY provided. Connection may hang if library requires it.")
+
+    # 1. Initialize IOTC
+    if max_sessions:
+        iotc.IOTC_Set_Max_Session_Number(max_sessions)
+    init_ret = iotc.IOTC_Initialize2(0)
+    if init_ret < 0:
+        log.warning("[Worker] Failed to initialize IOTC: %s", init_ret)
+        return False
+
+    # Initialize AV
+    av_ret = iotc.avInitialize(max_channels)
+    if av_ret < 0:
+        log.warning("[Worker] Failed to initialize AV: %s", av_ret)
+    return True
+
+def deinitialize():
+    iotc.avDeInitialize()
+    iotc.IOTC_DeInitialize()
+
+class CameraSession:
+    """
+    One camera's IOTC session and AV channel.
+
+    close() and reconnect() only tear down the session and AV channel
+    (avClientStop / IOTC_Session_Close); the process-wide state set up by
+    initialize() is kept, so recovering from a network blip does not pay
+    for a full SDK restart.
+    """
+
+    def __init__(self, uid, auth_key, method="sequential", channel=0, name="Worker"):
+        self.tag = f"[{name}]"
+        self.log = log.getChild(name)
+        self.uid = uid
+        self.auth_key = auth_key
+        self.method = method
+        self.channel = channel
+        self.sid = -1
+        self.av_index = -1
+        self.streaming = False
+        self.reconnects = 0
+
+    def connect(self):
+        sid = -1
+        self.log.info("%s Connecting...", self.tag)
+
+        # Check if IOTC_Connect_ByUIDEx is available
+        has_ex = hasattr(iotc, 'IOTC_Connect_ByUIDEx')
+
+        if self.method == "parallel" and not has_ex: # Only use parallel if Ex is not preferred or available?
+            try:
+                sid_pre = iotc.IOTC_Get_SessionID()
+                if sid_pre < 0:
+                    self.log.warning("%s Failed to get Session ID: %s", self.tag, sid_pre)
+                else:
+                    sid_ret = iotc.IOTC_Connect_ByUID_Parallel(self.uid, sid_pre)
+                    if sid_ret < 0:
+                        self.log.warning("%s Parallel connect failed: %s", self.tag, sid_ret)
+                    else:
+                        sid = sid_ret
+            except Exception as e:
+                self.log.warning("%s Parallel exception: %s", self.tag, e)
+        else:
+            # Prefer Ex if available, as VTech DTLS likely requires auth_key during connection
+            if has_ex:
+                try:
+                    self.log.info("%s Using IOTC_Connect_ByUIDEx with auth_key...", self.tag)
+                    sid_pre = iotc.IOTC_Get_SessionID()
+                    sid = iotc.IOTC_Connect_ByUIDEx(self.uid, sid_pre, self.auth_key)
+                    if sid < 0:
+                        self.log.warning("%s ConnectEx failed: %s", self.tag, sid)
+                except Exception as e:
+                    self.log.warning("%s ConnectEx exception: %s", self.tag, e)
+            else:
+                try:
+                    sid = iotc.IOTC_Connect_ByUID(self.uid)
+                    if sid < 0:
+                        self.log.warning("%s Sequential connect failed: %s", self.tag, sid)
+                except Exception as e:
+                    self.log.warning("%s Sequential exception: %s", self.tag, e)
+
+        if sid < 0:
+            self.log.warning("%s Connection failed.", self.tag)
+            return False
+
+        self.log.info("%s Connected! SID: %s", self.tag, sid)
+        self.sid = sid
+        return True
+
+    def start_av(self, attempts=3):
+        av_index = -1
+        # Simple retry for AV start
+        for i in range(attempts):
+            # Try avClientStartEx with DTLS (SecurityMode=2) as VTech uses it
+            self.log.info("%s Starting AV Client (Attempt %s)...", self.tag, i+1)
+            # Using resend=1 as Wyze does
+            av_index = iotc.avClientStartEx(self.sid, "admin", self.auth_key, 30, self.channel, resend=1, security_mode=2, auth_type=0)
+            if av_index >= 0:
+                break
+            self.log.warning("%s AV start failed: %s. Retrying...", self.tag, av_index)
+            time.sleep(1)
+
+        if av_index < 0:
+            self.log.warning("%s Failed to start AV client: %s", self.tag, av_index)
+            return False
+
+        self.log.info("%s AV Client Started. AVIndex: %s", self.tag, av_index)
+        self.av_index = av_index
+        return True
+
+    def start_stream(self):
+        vtech.start_stream(self.sid, self.av_index, self.channel)
+        self.streaming = True
+
+    def stop_stream(self):
+        if self.streaming:
+            vtech.stop_stream(self.sid, self.av_index, self.channel)
+            self.streaming = False
+
+    def check(self):
+        """
+        True while the IOTC session is alive.
+        """
+        return self.sid >= 0 and iotc.IOTC_Session_Check(self.sid) >= 0
+
+    def close(self):
+        """
+        Closes the AV channel and the session, nothing else.
+        """
+        self.stop_stream()
+        if self.av_index >= 0:
+            iotc.avClientStop(self.av_index)
+            self.av_index = -1
+        if self.sid >= 0:
+            iotc.IOTC_Session_Close(self.sid)
+            self.sid = -1
+
+    def reconnect(self, should_stop=None):
+        """
+        Re-establishes session, AV channel and stream with jittered
+        exponential backoff. Returns True once streaming again, False after
+        RECONNECT_ATTEMPTS failures or if should_stop() becomes true.
+        """
+        t0 = time.monotonic()
+        self.close()
+        for attempt in range(RECONNECT_ATTEMPTS):
+            if attempt:
+                delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** (attempt - 1))
+                time.sleep(random.uniform(delay / 2, delay))
+            if should_stop and should_stop():
+                return False
+            self.log.info("%s Reconnect attempt %s/%s...", self.tag, attempt + 1, RECONNECT_ATTEMPTS)
+            if self.connect():
+                if self.start_av():
+                    self.start_stream()
+                    self.reconnects += 1
+                    self.log.info("%s Recovered in %.0f ms (attempt %d, reconnect #%d)",
+                                  self.tag, (time.monotonic() - t0) * 1000, attempt + 1, self.reconnects)
+                    return True
+                self.close()
+        self.log.warning("%s Giving up after %d reconnect attempts (%.1fs)",
+                         self.tag, RECONNECT_ATTEMPTS, time.monotonic() - t0)
+        return False
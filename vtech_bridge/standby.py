@@ -0,0 +1,129 @@
+import logging
+import multiprocessing
+import queue
+import time
+
+from watchdog import HB_FRAMES, HB_LAST_FRAME, HB_RESUMED
+
+log = logging.getLogger(__name__)
+
+# Warm standby for the single-camera supervisor. A standby worker process is
+# forked while the active one streams and runs the SDK setup (region,
+# license, IOTC_Initialize2, avInitialize) straight away, then waits. When
+# the active worker dies or is restarted by the watchdog, the standby is
+# promoted and only has to connect, start AV and ask for the stream. The
+# FailoverLog measures the resulting video gap so warm and cold failovers
+# can be compared.
+
+class Standby:
+    """
+    A worker process initialised up to the connect step. target is called
+    with kwargs plus status_queue= and go=; it must report
+    ("READY", idx) when initialised, wait for go, and then report
+    ("CONNECTED"|"FAILED", idx) like a racing worker.
+    """
+
+    def __init__(self, target, kwargs, strategy_idx):
+        self.strategy_idx = strategy_idx
+        self.queue = multiprocessing.Queue()
+        self.go = multiprocessing.Event()
+        self.ready = False
+        self.connect_time = None
+        self.process = multiprocessing.Process(target=target,
+                                               kwargs=dict(kwargs, status_queue=self.queue, go=self.go))
+        self.process.start()
+
+    def _poll(self, timeout=None):
+        try:
+            kind, _ = self.queue.get(timeout=timeout) if timeout else self.queue.get_nowait()
+        except queue.Empty:
+            return None
+        if kind == "READY":
+            self.ready = True
+        return kind
+
+    def available(self):
+        """
+        True if the standby finished its SDK setup and is still alive.
+        """
+        while not self.ready and self._poll() is not None:
+            pass
+        return self.ready and self.process.is_alive()
+
+    def promote(self, timeout):
+        """
+        Lets the standby connect. Returns its process once it reports
+        CONNECTED, or None (and stops it) if it fails or takes longer than
+        timeout.
+        """
+        t0 = time.monotonic()
+        self.go.set()
+        while time.monotonic() - t0 < timeout:
+            kind = self._poll(timeout=0.2)
+            self.connect_time = time.monotonic() - t0
+            if kind == "CONNECTED":
+                log.info("[Standby] Promoted, connected after %.2fs", self.connect_time)
+                return self.process
+            if kind == "FAILED" or (kind is None and not self.process.is_alive()):
+                break
+        log.warning("[Standby] Promotion failed after %.2fs", time.monotonic() - t0)
+        self.cancel()
+        return None
+
+    def cancel(self):
+        # Never connected (or failed to), so there is no session to close
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+class FailoverLog:
+    """
+    Video gap per failover: from the last frame of the old worker to the
+    first frame of the new one, split into detection (last frame until the
+    supervisor noticed) and recovery (until video is back). Reads the
+    times from the shared Heartbeat; kept separately for "warm" (standby
+    promoted) and "cold" (new race) failovers.
+    """
+
+    def __init__(self, heartbeat):
+        self.heartbeat = heartbeat
+        self.pending = None
+        self.stats = {}
+
+    def failed(self, now):
+        """
+        The active worker is gone (exited or stopped by the supervisor).
+        """
+        v = self.heartbeat.values
+        if v[HB_LAST_FRAME] > 0 and self.pending is None:
+            self.pending = {"last_frame": v[HB_LAST_FRAME], "frames": v[HB_FRAMES], "detected": now}
+
+    def replaced(self, kind):
+        """
+        A new worker took over; kind is "warm" or "cold".
+        """
+        if self.pending is not None:
+            self.pending["kind"] = kind
+
+    def check(self):
+        """
+        Call periodically; logs the gap once the new worker has delivered
+        its first frame.
+        """
+        pending = self.pending
+        v = self.heartbeat.values
+        if pending is None or "kind" not in pending or v[HB_FRAMES] <= pending["frames"]:
+            return
+        self.pending = None
+        first_frame = v[HB_RESUMED] if v[HB_RESUMED] > pending["last_frame"] else v[HB_LAST_FRAME]
+        gap = first_frame - pending["last_frame"]
+        detect = pending["detected"] - pending["last_frame"]
+        kind = pending["kind"]
+        count, total = self.stats.get(kind, (0, 0.0))
+        self.stats[kind] = (count + 1, total + gap)
+        means = ", ".join(f"{k} {t / n:.2f}s over {n}" for k, (n, t) in sorted(self.stats.items()))
+        log.info("[Failover] Video gap %.2fs (%s): detected after %.2fs, video back %.2fs later. Mean gap: %s",
+                 gap, kind, detect, gap - detect, means)
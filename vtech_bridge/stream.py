@@ -0,0 +1,461 @@
+import logging
+import os
+import threading
+import time
+
+import vtech_stream_codes as vtech
+from iotc import FrameReceiver, AudioReceiver, IOCtrlReceiver, AV_ER_DATA_NOREADY, AV_ER_INCOMPLETE_FRAME, AV_ER_LOSED_THIS_FRAME, AV_ER_BUFPARA_MAXSIZE_INSUFF
+from pipeline import FrameRing, WriterThread
+from audio import AudioThread, FifoWriter
+from frameloss import LossTracker
+from buffers import AdaptiveBuffer, BufferManager
+from recorder import Recorder, RecorderThread
+from capture import CaptureWriter
+from fanout import FanoutServer
+from ts_mux import TsMuxer
+from jitter import JitterBuffer
+from ioctrl import IOCtrlChannel
+from abr import AbrController
+from idle import IdleControl
+from watchdog import HB_FRAMES, HB_LAST_FRAME, HB_LOOP, HB_STATE, HB_RESUMED, HB_STARTED, RESUME_GAP, STATE_STREAMING, STATE_RECONNECTING, STATE_IDLE
+import metrics
+
+log = logging.getLogger(__name__)
+
+# Seconds between ring/occupancy log lines
+STATS_INTERVAL = 60
+
+# Time-to-clean-picture histogram buckets (seconds)
+RECOVERY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0)
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+def thread_cpu_seconds(native_id):
+    """
+    CPU time (user + system) used by one thread of this process, from /proc.
+    """
+    if native_id is None:
+        return 0.0
+    try:
+        with open(f"/proc/self/task/{native_id}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime and stime are fields 14 and 15 (1-based) of the full line
+        return (int(fields[11]) + int(fields[12])) / _CLK_TCK
+    except (OSError, IndexError, ValueError):
+        return 0.0
+
+class StreamMetrics:
+    """
+    The per-camera metric handles the receive loop updates.
+    """
+
+    def __init__(self, name, registry=metrics.REGISTRY):
+        labels = {"camera": name}
+        self.frames = registry.counter("vtech_frames_total", "Video frames received", labels)
+        self.keyframes = registry.counter("vtech_keyframes_total", "Video keyframes received", labels)
+        self.bytes = registry.counter("vtech_bytes_total", "Video bytes received", labels)
+        self.noready = registry.counter("vtech_recv_noready_total", "avRecvFrameData2 calls that found no data (-20012)", labels)
+        self.lost = registry.counter("vtech_recv_lost_total", "Frames reported incomplete or lost by the SDK", labels)
+        self.errors = registry.counter("vtech_recv_errors_total", "Receive errors that forced a reconnect", labels)
+        self.reconnects = registry.counter("vtech_reconnects_total", "Successful reconnects", labels)
+        self.gaps = registry.counter("vtech_frame_gaps_total", "Breaks in frame index continuity (incl. SDK-reported losses)", labels)
+        self.missing = registry.counter("vtech_frames_missing_total", "Frames missing according to the frame index", labels)
+        self.keyframe_requests = registry.counter("vtech_keyframe_requests_total", "Keyframe requests sent after a loss", labels)
+        self.recovery_seconds = registry.histogram("vtech_recovery_seconds", "Time from frame loss to the next keyframe (clean picture)", RECOVERY_BUCKETS, labels)
+        self.recv_seconds = registry.histogram("vtech_recv_seconds", "Time spent inside avRecvFrameData2", metrics.LATENCY_BUCKETS, labels)
+        self.frame_interval = registry.histogram("vtech_frame_interval_seconds", "Time between consecutive video frames", metrics.INTERVAL_BUCKETS, labels)
+        self.frame_bytes = registry.histogram("vtech_frame_bytes", "Video frame size", metrics.SIZE_BUCKETS, labels)
+        self.registry = registry
+        self.labels = labels
+
+    def bind(self, stream):
+        # Gauges read the current stream's state at scrape time
+        r, labels = self.registry, self.labels
+        r.gauge("vtech_ring_frames", "Frames queued between receive and output", labels, lambda: stream.ring.occupancy)
+        r.gauge("vtech_ring_bytes", "Bytes queued between receive and output", labels, lambda: stream.ring.used_bytes)
+        r.gauge("vtech_ring_dropped_frames", "Frames dropped because the output fell behind (this stream)", labels, lambda: stream.ring.dropped_frames)
+        r.gauge("vtech_readers", "Attached readers", labels, lambda: getattr(stream.writer, "client_count", 1))
+        r.gauge("vtech_recv_buffer_bytes", "Current receive buffer size", labels, lambda: stream.buffer.size)
+        r.gauge("vtech_recv_buffer_grows", "Receive buffer grow operations (this stream)", labels, lambda: stream.buffer.grows)
+        r.gauge("vtech_recv_buffer_shrinks", "Receive buffer shrink operations (this stream)", labels, lambda: stream.buffer.shrinks)
+        r.gauge("vtech_recv_oversize_frames", "Frames that did not fit the receive buffer (this stream)", labels, lambda: stream.buffer.oversize)
+        if stream.jitter:
+            r.gauge("vtech_jitter_delay_seconds", "Current jitter buffer delay", labels, lambda: stream.jitter.delay)
+            r.gauge("vtech_jitter_target_seconds", "Jitter buffer latency target", labels, lambda: stream.jitter.target)
+            r.gauge("vtech_jitter_late_frames", "Frames that arrived after they were due (this stream)", labels, lambda: stream.jitter.late)
+        if stream.idle:
+            r.gauge("vtech_stream_paused", "1 while the camera stream is paused for lack of readers", labels, lambda: int(stream.idle.paused))
+            r.gauge("vtech_stream_pauses", "Times the camera stream was paused (this stream)", labels, lambda: stream.idle.pauses)
+        if stream.abr:
+            r.gauge("vtech_abr_quality", "Stream quality level requested by the controller (1 = max, 5 = min)", labels, lambda: stream.abr.quality)
+
+class CameraStream:
+    """
+    Receive side of one camera: pulls frames from a connected CameraSession
+    into a FrameRing that a WriterThread drains into `writer` (FrameWriter
+    or FanoutServer). Handles reconnects and the optional audio thread.
+
+    run() blocks until the stream ends; in multi-camera mode every camera
+    runs it on its own thread.
+    """
+
+    def __init__(self, name, session, writer, opts, audio_fifo=None, buffers=None, label=None, receiver=None, heartbeat=None):
+        self.name = name
+        self.tag = f"[{name}]"
+        self.log = log.getChild(name)
+        # Camera name for metrics and recordings (the go2rtc stream name)
+        self.label = label or name
+        self.session = session
+        self.writer = writer
+        self.opts = opts
+        self.audio_fifo = audio_fifo or opts.audio_fifo
+        # Sized by AdaptiveBuffer below, under the process-wide ceiling.
+        # A capture replay passes its own receiver.
+        self.receiver = receiver or FrameReceiver(session.av_index, 0)
+        self.buffers = buffers or BufferManager(opts.buffer_ceiling_kb * 1024)
+        self.buffer = AdaptiveBuffer(name, self.receiver, self.buffers, tag=self.tag)
+        self.ring = FrameRing(opts.ring_kb * 1024, opts.ring_frames)
+        # MPEG-TS muxing runs on the writer thread, in front of the writer
+        self.muxer = TsMuxer(writer) if opts.output_format == "mpegts" else None
+        self.jitter = JitterBuffer(opts.jitter_ms, opts.jitter_adaptive) if opts.jitter_ms else None
+        self.writer_thread = WriterThread(self.ring, self.muxer or writer, self.jitter)
+        self.audio_thread = None
+        # IOCtrl responses are received on their own thread, one per AV channel
+        self.ioctrl = None
+        self.abr = AbrController(self) if opts.abr else None
+        # Pausing the camera only makes sense when readers come and go; a
+        # recorder or an audio listener always needs the stream
+        self.idle = None
+        if opts.idle_seconds and isinstance(writer, FanoutServer) and not opts.record_dir and not opts.audio:
+            self.idle = IdleControl(writer, opts.idle_seconds)
+        self.native_id = None
+        self.metrics = StreamMetrics(self.label)
+        self.metrics.bind(self)
+        self.recorder = None
+        self.record_ring = None
+        if opts.record_dir:
+            # Own ring and thread: disk stalls drop recorded frames, never live ones
+            self.recorder = Recorder(self.label, os.path.join(opts.record_dir, self.label), opts.record_mb * 1024 * 1024,
+                                     os.path.join(opts.record_dir, "clips"), pre_event_seconds=opts.pre_event_seconds,
+                                     clip_seconds=opts.clip_seconds)
+            self.record_ring = FrameRing(opts.ring_kb * 1024, opts.ring_frames)
+            self.recorder_thread = RecorderThread(self.record_ring, self.recorder)
+        # Progress for a supervising Watchdog; request_reconnect() is its lever
+        self.heartbeat = heartbeat
+        self.reconnect_requested = False
+        self.capture = None
+        if opts.capture_dir:
+            self.capture = CaptureWriter(opts.capture_dir, self.label, opts.capture_mb * 1024 * 1024)
+        self.loss = LossTracker(self.request_keyframe if opts.request_keyframe else None,
+                                on_recovery=self.metrics.recovery_seconds.observe)
+
+    def request_keyframe(self):
+        self.metrics.keyframe_requests.inc()
+        vtech.request_keyframe(self.session.sid, self.session.av_index, self.session.channel)
+
+    def start_audio(self):
+        session = self.session
+        try:
+            vtech.start_audio(session.sid, session.av_index, 0)
+            self.audio_thread = AudioThread(AudioReceiver(session.av_index), FifoWriter(self.audio_fifo), self.opts.audio_format)
+            self.audio_thread.start()
+            self.log.info("%s Audio enabled. Writing %s audio to %s", self.tag, self.opts.audio_format, self.audio_fifo)
+        except Exception as e:
+            self.log.warning("%s Failed to start audio: %s", self.tag, e)
+            self.audio_thread = None
+
+    def stop_audio(self):
+        if self.audio_thread:
+            self.audio_thread.stop()
+            self.audio_thread.join(timeout=2)
+            self.audio_thread = None
+            if self.session.av_index >= 0:
+                vtech.stop_audio(self.session.sid, self.session.av_index, 0)
+
+    def start_ioctrl(self):
+        self.ioctrl = IOCtrlChannel(IOCtrlReceiver(self.session.av_index), self.name)
+        self.ioctrl.start()
+
+    def stop_ioctrl(self):
+        if self.ioctrl:
+            self.ioctrl.stop()
+            self.ioctrl.join(timeout=2)
+            self.log.info("%s IOCtrl: %s", self.tag, self.ioctrl.stats_line())
+            self.ioctrl = None
+
+    def stop(self):
+        self.ring.close()
+
+    def request_reconnect(self):
+        """
+        Makes the receive loop rebuild the session at its next iteration.
+        Safe to call from a signal handler or another thread.
+        """
+        self.reconnect_requested = True
+
+    def _reconnect(self):
+        """
+        Rebuilds the session and AV channel (IOTC/AV init stays). Returns
+        False if the session gave up or the stream was stopped.
+        """
+        session = self.session
+        beat = self.heartbeat.values if self.heartbeat else None
+        if beat is not None:
+            beat[HB_STATE] = STATE_RECONNECTING
+        self.stop_audio()
+        self.stop_ioctrl()
+        if not session.reconnect(lambda: self.ring.closed):
+            return False
+        self.metrics.reconnects.inc()
+        self.loss.reset()
+        self.receiver.av_index = session.av_index
+        self.drop_until_keyframe()
+        if self.opts.audio:
+            self.start_audio()
+        if self.abr:
+            self.start_ioctrl()
+        if beat is not None:
+            beat[HB_STATE] = STATE_STREAMING
+            beat[HB_STARTED] = beat[HB_LOOP] = time.monotonic()
+        return True
+
+    def _idle(self):
+        """
+        Stops the camera's stream until a reader attaches, keeping the
+        session and AV channel. Returns False if the stream was stopped or
+        the session could not be kept.
+        """
+        idle = self.idle
+        session = self.session
+        beat = self.heartbeat.values if self.heartbeat else None
+        now = time.monotonic()
+        idle.pause(now)
+        session.stop_stream()
+        self.log.info("%s No readers for %ss, camera stream paused (session kept)", self.tag, self.opts.idle_seconds)
+        if beat is not None:
+            beat[HB_STATE] = STATE_IDLE
+        while not idle.wait_for_reader():
+            now = time.monotonic()
+            if beat is not None:
+                beat[HB_LOOP] = now
+            if self.ring.closed:
+                return False
+            if self.reconnect_requested:
+                self.reconnect_requested = False
+                self.log.info("%s Reconnect requested while paused", self.tag)
+            elif idle.keepalive_due(now) and not session.check():
+                idle.keepalive_failures += 1
+                self.log.info("%s Session lost while paused, reconnecting", self.tag)
+            else:
+                continue
+            if not self._reconnect():
+                return False
+            # The reconnect restarted the stream
+            session.stop_stream()
+            if beat is not None:
+                beat[HB_STATE] = STATE_IDLE
+        now = time.monotonic()
+        paused = idle.resumed(now)
+        self.loss.reset()
+        self.drop_until_keyframe()
+        session.start_stream()
+        self.log.info("%s Reader attached, camera stream resumed after %.0fs paused", self.tag, paused)
+        if beat is not None:
+            beat[HB_STATE] = STATE_STREAMING
+            beat[HB_STARTED] = beat[HB_LOOP] = now
+        return not self.ring.closed
+
+    def drop_until_keyframe(self):
+        self.ring.drop_until_keyframe()
+        if self.record_ring:
+            self.record_ring.drop_until_keyframe()
+
+    def run(self):
+        # Receiving and writing run on separate threads so a stalled reader
+        # cannot stop us from draining the SDK buffers (ctypes drops the GIL)
+        self.native_id = threading.get_native_id()
+        receiver = self.receiver
+        ring = self.ring
+        m = self.metrics
+        loss = self.loss
+        buffer = self.buffer
+        record_ring = self.record_ring
+        capture = self.capture
+        idle = self.idle
+        beat = self.heartbeat.values if self.heartbeat else None
+        if beat is not None:
+            # The stall window starts now, not at the last frame of a
+            # previous stream
+            beat[HB_STARTED] = beat[HB_LOOP] = time.monotonic()
+            beat[HB_STATE] = STATE_STREAMING
+        self.writer_thread.start()
+        if record_ring:
+            self.recorder_thread.start()
+        if self.opts.audio:
+            self.start_audio()
+        if self.abr:
+            self.start_ioctrl()
+            self.abr.start()
+        self.log.info("%s Stream started (ring=%sKiB/%s frames)...", self.tag, self.opts.ring_kb, self.opts.ring_frames)
+
+        first_frame = True
+        last_stats = time.monotonic()
+        last_frame = None
+        clock = time.perf_counter
+        try:
+            while not ring.closed:
+                t_recv = clock()
+                ret, frame_idx, frame_info = receiver.recv()
+                t_done = clock()
+                m.recv_seconds.observe(t_done - t_recv)
+
+                if ret > 0:
+                    if first_frame:
+                        self.log.info("%s First frame: %s bytes, %s", self.tag, ret, frame_info)
+                        first_frame = False
+                    keyframe = frame_info.is_keyframe
+                    buffer.frame(ret)
+                    m.frames.inc()
+                    m.bytes.inc(ret)
+                    m.frame_bytes.observe(ret)
+                    if keyframe:
+                        m.keyframes.inc()
+                    if last_frame is not None:
+                        m.frame_interval.observe(t_done - last_frame)
+                    last_frame = t_done
+                    missing = loss.missing
+                    if loss.frame(frame_idx, keyframe, t_done):
+                        # P-frames referencing the missing ones would smear
+                        # the picture, hold output until the next keyframe
+                        self.drop_until_keyframe()
+                    if loss.missing != missing:
+                        m.gaps.inc()
+                        m.missing.inc(loss.missing - missing)
+                    ring.push(receiver.view, ret, keyframe, frame_info.timestamp, frame_idx, frame_info.codec_id, t_done)
+                    if record_ring:
+                        record_ring.push(receiver.view, ret, keyframe, frame_info.timestamp, frame_idx, frame_info.codec_id)
+                    if capture:
+                        capture.frame(t_done, ret, frame_idx, receiver.frame_info_raw, receiver.frame_info_size,
+                                      receiver.view, keyframe)
+                elif ret == AV_ER_DATA_NOREADY:
+                    # Nothing buffered yet; the call does not block, so don't spin
+                    m.noready.inc()
+                    time.sleep(0.005)
+                elif ret == AV_ER_BUFPARA_MAXSIZE_INSUFF:
+                    # Frame bigger than the buffer; the SDK dropped it but
+                    # told us its size, so make room for the next one
+                    if capture:
+                        capture.error(t_done, ret, frame_idx)
+                    buffer.grow(receiver.out_frame_size)
+                    m.lost.inc()
+                    m.gaps.inc()
+                    m.missing.inc()
+                    loss.lost(frame_idx, t_done)
+                    self.drop_until_keyframe()
+                elif ret in (AV_ER_INCOMPLETE_FRAME, AV_ER_LOSED_THIS_FRAME):
+                    # Frame lost in transit, the session itself is fine
+                    if capture:
+                        capture.error(t_done, ret, frame_idx)
+                    m.lost.inc()
+                    m.gaps.inc()
+                    m.missing.inc()
+                    loss.lost(frame_idx, t_done)
+                    self.drop_until_keyframe()
+                elif ret < 0:
+                    self.log.warning("%s Error receiving frame: %s. Reconnecting...", self.tag, ret)
+                    if capture:
+                        capture.error(t_done, ret, frame_idx)
+                    m.errors.inc()
+                    if not self._reconnect():
+                        break
+                    last_frame = None
+
+                now = time.monotonic()
+                if beat is not None:
+                    beat[HB_LOOP] = now
+                    if ret > 0:
+                        last = beat[HB_LAST_FRAME]
+                        if now - last >= RESUME_GAP or last < beat[HB_STARTED]:
+                            beat[HB_RESUMED] = now
+                        beat[HB_FRAMES] += 1
+                        beat[HB_LAST_FRAME] = now
+                if self.reconnect_requested:
+                    self.reconnect_requested = False
+                    self.log.info("%s Reconnect requested by the watchdog", self.tag)
+                    if not self._reconnect():
+                        break
+                    last_frame = None
+                if idle is not None:
+                    if ret > 0 and idle.resume_started is not None:
+                        self.log.info("%s First frame %.0f ms after resume (mean %.0f ms over %d)", self.tag,
+                                      idle.first_frame(now) * 1000, idle.resume_seconds / idle.resumes * 1000,
+                                      idle.resumes)
+                    elif idle.should_pause(now):
+                        if not self._idle():
+                            break
+                        last_frame = None
+                if now - last_stats >= STATS_INTERVAL:
+                    last_stats = now
+                    self.log.info("%s Ring: %s", self.tag, ring.stats_line())
+                    self.log.info("%s Loss: %s", self.tag, loss.stats_line())
+                    self.log.info("%s Receive buffers: %s", self.tag, self.buffers.stats_line())
+                    if isinstance(self.writer, FanoutServer):
+                        self.log.info("%s Fanout: %s", self.tag, self.writer.stats_line())
+                    if self.muxer:
+                        self.log.info("%s MPEG-TS: %s", self.tag, self.muxer.stats_line())
+                    if self.jitter:
+                        self.log.info("%s Jitter buffer: %s", self.tag, self.jitter.stats_line())
+                    if self.abr:
+                        self.log.info("%s ABR: %s", self.tag, self.abr.stats_line())
+                    if idle:
+                        self.log.info("%s Idle: %s", self.tag, idle.stats_line())
+                    if self.ioctrl:
+                        self.log.info("%s IOCtrl: %s", self.tag, self.ioctrl.stats_line())
+                    if self.recorder:
+                        self.log.info("%s Recorder: %s, ring %s", self.tag, self.recorder.stats_line(), record_ring.stats_line())
+                    if capture:
+                        self.log.info("%s Capture: %s", self.tag, capture.stats_line())
+        finally:
+            ring.close()
+            self.writer_thread.join(timeout=2)
+            if record_ring:
+                record_ring.close()
+                self.recorder_thread.join(timeout=5)
+            self.log.info("%s Ring: %s", self.tag, ring.stats_line())
+            self.log.info("%s Loss: %s", self.tag, loss.stats_line())
+            if self.jitter:
+                self.log.info("%s Jitter buffer: %s", self.tag, self.jitter.stats_line())
+            if self.abr:
+                self.abr.stop()
+                self.log.info("%s ABR: %s", self.tag, self.abr.stats_line())
+            if idle:
+                self.log.info("%s Idle: %s", self.tag, idle.stats_line())
+            self.stop_ioctrl()
+            self.stop_audio()
+            buffer.close()
+            if capture:
+                capture.close()
+                self.log.info("%s Capture: %s", self.tag, capture.stats_line())
+
+    def stats(self):
+        """
+        Per-camera resource use: CPU seconds of its threads and the bytes held
+        in its buffers (receive buffers, ring arena, reader backlogs).
+        """
+        cpu = thread_cpu_seconds(self.native_id) + thread_cpu_seconds(self.writer_thread.native_id)
+        buffers = len(self.receiver.buf) + self.ring.capacity
+        if self.audio_thread:
+            cpu += thread_cpu_seconds(self.audio_thread.native_id)
+            buffers += len(self.audio_thread.receiver.buf)
+        if self.recorder:
+            buffers += self.record_ring.capacity + self.recorder.pre_event.capacity
+        for client in getattr(self.writer, "clients", ()):
+            buffers += len(client.pending)
+        return {
+            "cpu_seconds": cpu,
+            "buffer_bytes": buffers,
+            "ring_frames": self.ring.occupancy,
+            "dropped_frames": self.ring.dropped_frames,
+            "reconnects": self.session.reconnects,
+            "readers": getattr(self.writer, "client_count", 1),
+        }
@@ -0,0 +1,294 @@
+import logging
+
+from iotc import MEDIA_CODEC_VIDEO_H264, MEDIA_CODEC_VIDEO_HEVC, MEDIA_CODEC_AUDIO_AAC_ADTS, MEDIA_CODEC_AUDIO_G711A
+
+log = logging.getLogger(__name__)
+
+OUTPUT_FORMATS = ("raw", "mpegts")
+
+# MPEG-TS output: every frame becomes one PES packet with a PTS taken from
+# the FRAMEINFO timestamp (camera clock, ms), so players don't have to
+# probe the codec or invent timing. Audio gets its own single-stream TS on
+# the audio FIFO (AudioThread, audio_format mpegts), muxed the same way on
+# the same camera clock. All headers are built once, so muxing a frame is slice copies into a
+# preallocated buffer.
+
+TS_PACKET = 188
+TS_PAYLOAD = TS_PACKET - 4
+
+PID_PAT = 0x0000
+PID_PMT = 0x1000
+PID_VIDEO = 0x0100
+PID_AUDIO = 0x0101
+PROGRAM = 1
+
+# PES stream ids
+STREAM_ID_VIDEO = 0xE0
+STREAM_ID_AUDIO = 0xC0
+
+# 0x90 is G.711 A-law as Tapo cameras send it, which go2rtc reads
+STREAM_TYPES = {MEDIA_CODEC_VIDEO_H264: 0x1B, MEDIA_CODEC_VIDEO_HEVC: 0x24,
+                MEDIA_CODEC_AUDIO_AAC_ADTS: 0x0F, MEDIA_CODEC_AUDIO_G711A: 0x90}
+
+# 90 kHz clock. PTS starts one second in so PCR (PTS minus PCR_DELAY) never
+# goes negative; both wrap at 33 bits.
+PTS_START = 90000
+PCR_DELAY = 9000
+PTS_MASK = (1 << 33) - 1
+
+# Largest camera timestamp step taken at face value; anything else (camera
+# restart, reconnect, clock jump) continues PTS with the previous step, so
+# PTS and PCR stay continuous
+MAX_STEP_MS = 5000
+
+# Output buffer for one frame, grown for larger frames
+INITIAL_CAPACITY = 512 * 1024
+
+# Adaptation field flags
+AF_RANDOM_ACCESS = 0x40
+AF_PCR = 0x10
+
+def _crc32_table():
+    table = []
+    for i in range(256):
+        c = i << 24
+        for _ in range(8):
+            c = ((c << 1) ^ 0x04C11DB7) if c & 0x80000000 else c << 1
+        table.append(c & 0xFFFFFFFF)
+    return table
+
+_CRC_TABLE = _crc32_table()
+
+def crc32_mpeg(data):
+    """
+    CRC-32/MPEG-2 (not the reflected zlib CRC) as used by PSI sections.
+    """
+    crc = 0xFFFFFFFF
+    for b in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _CRC_TABLE[(crc >> 24) ^ b]
+    return crc
+
+def psi_packet(pid, section):
+    """
+    One TS packet carrying a PSI section (CRC appended), continuity counter
+    0; the muxer patches byte 3 per use.
+    """
+    section = bytes(section)
+    section += crc32_mpeg(section).to_bytes(4, "big")
+    packet = bytes((0x47, 0x40 | (pid >> 8), pid & 0xFF, 0x10, 0x00)) + section
+    return packet + b"\xff" * (TS_PACKET - len(packet))
+
+def pat_packet():
+    section = (0x00, 0xB0, 0x0D, 0x00, 0x01, 0xC1, 0x00, 0x00,
+               PROGRAM >> 8, PROGRAM & 0xFF, 0xE0 | (PID_PMT >> 8), PID_PMT & 0xFF)
+    return psi_packet(PID_PAT, section)
+
+def pmt_packet(stream_type, version=0, pid=PID_VIDEO):
+    # The one elementary stream also carries the PCR
+    section = (0x02, 0xB0, 0x12, PROGRAM >> 8, PROGRAM & 0xFF, 0xC1 | ((version & 0x1F) << 1), 0x00, 0x00,
+               0xE0 | (pid >> 8), pid & 0xFF, 0xF0, 0x00,
+               stream_type, 0xE0 | (pid >> 8), pid & 0xFF, 0xF0, 0x00)
+    return psi_packet(PID_PMT, section)
+
+def _headers(pusi, afc, pid):
+    # The 16 continuity counter variants of one elementary stream packet header
+    return [bytes((0x47, (0x40 if pusi else 0) | (pid >> 8), pid & 0xFF, afc | cc)) for cc in range(16)]
+
+class TsMuxer:
+    """
+    Output stage wrapper: write(view, keyframe, codec, timestamp) muxes the
+    frame into TS packets and hands them to the wrapped writer as one
+    write. PAT and PMT go out in front of every keyframe, so a reader can
+    start at any keyframe; the fanout cache keeps that whole block. Frames
+    of a codec TS can't carry here (MJPEG...) are passed through raw.
+    With audio=True the stream is an audio PES stream instead; mux() returns
+    the packets of one frame (None for an unsupported codec) for callers
+    that write them themselves.
+    """
+
+    def __init__(self, writer, capacity=INITIAL_CAPACITY, audio=False):
+        self.writer = writer
+        self.audio = audio
+        self.pid = PID_AUDIO if audio else PID_VIDEO
+        self.out = bytearray(capacity)
+        self.out_view = memoryview(self.out)
+        self.pat = pat_packet()
+        self.pmt = None
+        self.codec = None
+        self.pmt_version = 0
+        self.psi_cc = [0, 0]
+        self.cc = 0
+        self.pts = None
+        self.last_ts = 0
+        self.step = 3600 # 40 ms until the first real step is seen
+
+        self.stuffing = memoryview(b"\xff" * TS_PACKET)
+        self.pes = bytearray(b"\x00\x00\x01\x00\x00\x00\x80\x80\x05" + bytes(5))
+        self.pes[3] = STREAM_ID_AUDIO if audio else STREAM_ID_VIDEO
+        self.first = _headers(True, 0x30, self.pid)
+        self.middle = _headers(False, 0x10, self.pid)
+        self.last = _headers(False, 0x30, self.pid)
+
+        # Stats
+        self.frames = 0
+        self.packets = 0
+        self.payload_bytes = 0
+        self.rebases = 0
+        self.passthrough = 0
+
+    @property
+    def max_delay(self):
+        return getattr(self.writer, "max_delay", 0.1)
+
+    def tick(self):
+        self.writer.tick()
+
+    def flush(self):
+        self.writer.flush()
+
+    def write(self, view, keyframe=False, codec=0, timestamp=0):
+        out = self.mux(view, keyframe, codec, timestamp)
+        if out is None:
+            self.passthrough += 1
+            self.writer.write(view, keyframe)
+            return
+        # codec 0: what follows is opaque TS, not an Annex-B access unit
+        self.writer.write(out, keyframe, 0)
+
+    def mux(self, view, keyframe, codec, timestamp):
+        """
+        TS packets for one frame (a view of the muxer's buffer, valid until
+        the next call), or None if TS can't carry its codec.
+        """
+        if codec != self.codec and not self._set_codec(codec):
+            return None
+        self._advance(timestamp)
+        return self.out_view[:self._mux(view, keyframe)]
+
+    def _set_codec(self, codec):
+        stream_type = STREAM_TYPES.get(codec)
+        if stream_type is None:
+            if codec != self.codec:
+                log.warning("[MPEG-TS] Codec 0x%02X is not supported, %s", codec,
+                            "dropping its frames" if self.audio else "passing it through raw")
+                self.codec = codec
+            return False
+        if self.codec is not None:
+            self.pmt_version += 1
+        self.codec = codec
+        self.pmt = pmt_packet(stream_type, self.pmt_version, self.pid)
+        return True
+
+    def _advance(self, timestamp):
+        if self.pts is None:
+            self.pts = PTS_START
+        else:
+            delta = (timestamp - self.last_ts) & 0xFFFFFFFF
+            if delta <= MAX_STEP_MS:
+                step = delta * 90
+                if step:
+                    self.step = step
+            else:
+                step = self.step
+                self.rebases += 1
+            self.pts += step
+        self.last_ts = timestamp
+
+    def _psi(self, pos, packet, which):
+        out = self.out_view
+        out[pos:pos + TS_PACKET] = packet
+        self.out[pos + 3] = 0x10 | self.psi_cc[which]
+        self.psi_cc[which] = (self.psi_cc[which] + 1) & 0x0F
+        return pos + TS_PACKET
+
+    def _mux(self, view, keyframe):
+        n = len(view)
+        packets = (n + len(self.pes) + 8) // TS_PAYLOAD + 4
+        if packets * TS_PACKET > len(self.out):
+            self.out = bytearray(packets * TS_PACKET * 2)
+            self.out_view = memoryview(self.out)
+        out = self.out
+        ov = self.out_view
+        pos = 0
+        if keyframe or self.frames == 0:
+            pos = self._psi(pos, self.pat, 0)
+            pos = self._psi(pos, self.pmt, 1)
+
+        pts = self.pts & PTS_MASK
+        pes = self.pes
+        pes[9] = 0x21 | ((pts >> 29) & 0x0E)
+        pes[10] = (pts >> 22) & 0xFF
+        pes[11] = ((pts >> 14) & 0xFE) | 1
+        pes[12] = (pts >> 7) & 0xFF
+        pes[13] = ((pts << 1) & 0xFE) | 1
+        if self.audio:
+            # Only video PES may leave the length open
+            length = len(pes) - 6 + n
+            pes[4] = length >> 8
+            pes[5] = length & 0xFF
+        pcr = (self.pts - PCR_DELAY) & PTS_MASK
+
+        # First packet: adaptation field with PCR (and stuffing for tiny
+        # frames), then the PES header and the start of the frame
+        cc = self.cc
+        flags = AF_PCR
+        if keyframe:
+            flags |= AF_RANDOM_ACCESS
+        room = TS_PAYLOAD - 8 - len(pes)
+        take = min(n, room)
+        stuffing = room - take
+        ov[pos:pos + 4] = self.first[cc]
+        out[pos + 4] = 7 + stuffing
+        out[pos + 5] = flags
+        out[pos + 6] = pcr >> 25
+        out[pos + 7] = (pcr >> 17) & 0xFF
+        out[pos + 8] = (pcr >> 9) & 0xFF
+        out[pos + 9] = (pcr >> 1) & 0xFF
+        out[pos + 10] = ((pcr & 1) << 7) | 0x7E
+        out[pos + 11] = 0
+        p = pos + 12
+        if stuffing:
+            ov[p:p + stuffing] = self.stuffing[:stuffing]
+            p += stuffing
+        ov[p:p + len(pes)] = pes
+        p += len(pes)
+        ov[p:p + take] = view[:take]
+        pos += TS_PACKET
+        cc = (cc + 1) & 0x0F
+        off = take
+        packets = 1
+
+        # Full packets straight from the frame
+        middle = self.middle
+        while n - off >= TS_PAYLOAD:
+            ov[pos:pos + 4] = middle[cc]
+            ov[pos + 4:pos + TS_PACKET] = view[off:off + TS_PAYLOAD]
+            pos += TS_PACKET
+            off += TS_PAYLOAD
+            cc = (cc + 1) & 0x0F
+            packets += 1
+
+        # Last packet, padded with an adaptation field
+        rest = n - off
+        if rest:
+            stuffing = TS_PAYLOAD - rest
+            ov[pos:pos + 4] = self.last[cc]
+            out[pos + 4] = stuffing - 1
+            if stuffing > 1:
+                out[pos + 5] = 0x00
+                ov[pos + 6:pos + 4 + stuffing] = self.stuffing[:stuffing - 2]
+            ov[pos + 4 + stuffing:pos + TS_PACKET] = view[off:n]
+            pos += TS_PACKET
+            cc = (cc + 1) & 0x0F
+            packets += 1
+
+        self.cc = cc
+        self.frames += 1
+        self.packets += packets
+        self.payload_bytes += n
+        return pos
+
+    def stats_line(self):
+        overhead = self.packets * TS_PACKET / self.payload_bytes - 1 if self.payload_bytes else 0
+        return (f"{self.frames} frames in {self.packets} packets ({overhead * 100:.1f}% overhead), "
+                f"timestamp rebases {self.rebases}, passed through raw {self.passthrough}")
@@ -9,6 +9,20 @@ IOTYPE_USER_IPCAM_AUDIOSTART = 0x300 # 768
 IOTYPE_USER_IPCAM_AUDIOSTOP = 0x301  # 769
 IOTYPE_USER_IPCAM_SPEAKERSTART = 0x350 # 848
 IOTYPE_USER_IPCAM_SPEAKERSTOP = 0x351  # 849
+IOTYPE_USER_IPCAM_SETSTREAMCTRL_REQ = 0x320  # 800
+IOTYPE_USER_IPCAM_SETSTREAMCTRL_RESP = 0x321 # 801
+IOTYPE_USER_IPCAM_GETSTREAMCTRL_REQ = 0x322  # 802
+IOTYPE_USER_IPCAM_GETSTREAMCTRL_RESP = 0x323 # 803
+
+# ENUM_QUALITY_LEVEL, best to worst
+AVIOCTRL_QUALITY_UNKNOWN = 0x00
+AVIOCTRL_QUALITY_MAX = 0x01
+AVIOCTRL_QUALITY_HIGH = 0x02
+AVIOCTRL_QUALITY_MIDDLE = 0x03
+AVIOCTRL_QUALITY_LOW = 0x04
+AVIOCTRL_QUALITY_MIN = 0x05
+QUALITY_NAMES = {AVIOCTRL_QUALITY_UNKNOWN: "unknown", AVIOCTRL_QUALITY_MAX: "max", AVIOCTRL_QUALITY_HIGH: "high",
+                 AVIOCTRL_QUALITY_MIDDLE: "middle", AVIOCTRL_QUALITY_LOW: "low", AVIOCTRL_QUALITY_MIN: "min"}
 
 # Payload structure for SMsgAVIoctrlAVStream
 # int channel;
@@ -25,6 +39,36 @@ def create_start_stream_payload(channel=0):
     payload = struct.pack('<I', channel) + b'\x00' * 4
     return payload
 
+# Payload structure for SMsgAVIoctrlSetStreamCtrlReq / GetStreamCtrlResp
+# unsigned int channel;
+# unsigned char quality;
+# byte[] reserved = new byte[3];
+# Total size: 8 bytes
+# SMsgAVIoctrlSetStreamCtrlResp is int result (0 = ok) + 4 reserved bytes
+
+def create_stream_ctrl_payload(quality, channel=0):
+    """
+    Creates the payload for IOTYPE_USER_IPCAM_SETSTREAMCTRL_REQ (and, with
+    quality 0, GETSTREAMCTRL_REQ).
+    """
+    return struct.pack('<IB3x', channel, quality)
+
+def parse_stream_ctrl_result(data):
+    """
+    Result code of a SETSTREAMCTRL_RESP, or None if it is too short.
+    """
+    if len(data) < 4:
+        return None
+    return struct.unpack_from('<i', data)[0]
+
+def parse_stream_ctrl_quality(data):
+    """
+    Quality level of a GETSTREAMCTRL_RESP, or None if it is too short.
+    """
+    if len(data) < 5:
+        return None
+    return data[4]
+
 def start_stream(iotc_session_id, av_channel_id, channel=0):
     """
     Sends the start stream command to the camera.
@@ -52,3 +96,46 @@ def stop_stream(iotc_session_id, av_channel_id, channel=0):
         pass
     except Exception as e:
         print(f"Error sending stop command: {e}", file=sys.stderr)
+
+def request_keyframe(iotc_session_id, av_channel_id, channel=0):
+    """
+    Asks the camera for a fresh I-frame. There is no dedicated IOCtrl for
+    this on these cameras; repeating IOTYPE_USER_IPCAM_START restarts the
+    encoder's GOP, so the next frame sent is a keyframe.
+    """
+    try:
+        import iotc
+        payload = create_start_stream_payload(channel)
+        iotc.avSendIOCtrl(av_channel_id, IOTYPE_USER_IPCAM_START, payload)
+    except ImportError:
+        pass
+    except Exception as e:
+        print(f"Error sending keyframe request: {e}", file=sys.stderr)
+
+def start_audio(iotc_session_id, av_channel_id, channel=0):
+    """
+    Asks the camera to start sending audio frames (received with avRecvAudioData).
+    """
+    try:
+        import iotc
+        payload = create_start_stream_payload(channel)
+        print(f"Sending IOTYPE_USER_IPCAM_AUDIOSTART (0x{IOTYPE_USER_IPCAM_AUDIOSTART:X})", file=sys.stderr)
+        iotc.avSendIOCtrl(av_channel_id, IOTYPE_USER_IPCAM_AUDIOSTART, payload)
+    except ImportError:
+        pass
+    except Exception as e:
+        print(f"Error sending audio start command: {e}", file=sys.stderr)
+
+def stop_audio(iotc_session_id, av_channel_id, channel=0):
+    """
+    Sends the audio stop command.
+    """
+    try:
+        import iotc
+        payload = create_start_stream_payload(channel)
+        print(f"Sending IOTYPE_USER_IPCAM_AUDIOSTOP (0x{IOTYPE_USER_IPCAM_AUDIOSTOP:X})", file=sys.stderr)
+        iotc.avSendIOCtrl(av_channel_id, IOTYPE_USER_IPCAM_AUDIOSTOP, payload)
+    except ImportError:
+        pass
+    except Exception as e:
+        print(f"Error sending audio stop command: {e}", file=sys.stderr)
@@ -0,0 +1,131 @@
+import logging
+import multiprocessing
+
+log = logging.getLogger(__name__)
+
+# Stall detection for receive loops. The stream updates a Heartbeat in
+# shared memory (plain stores, no syscalls) on every loop iteration; a
+# supervisor polls it with a Watchdog, which picks a targeted reconnect or a
+# restart and keeps mean-time-to-recovery statistics. Times are
+# time.monotonic(), which is the same clock in every process.
+
+# Heartbeat slots
+HB_FRAMES = 0
+HB_LAST_FRAME = 1 # time of the last frame
+HB_LOOP = 2       # time of the last receive loop iteration
+HB_STATE = 3
+HB_RESUMED = 4    # time of the first frame of a stream or after a gap of RESUME_GAP or more
+HB_STARTED = 5    # time the stream (re)started; the stall window starts here too
+HB_SIZE = 6
+
+# Seconds without frames after which the next frame counts as a resume
+RESUME_GAP = 1.0
+
+STATE_STARTING = 0
+STATE_STREAMING = 1
+STATE_RECONNECTING = 2
+STATE_IDLE = 3 # stream paused on purpose, no readers
+
+# Seconds without frames before the watchdog acts
+STALL_SECONDS = 10
+
+# Windows a reconnect the stream started itself may take before the
+# watchdog steps in (its own backoff can be long)
+RECONNECT_GRACE = 6
+
+# Seconds between supervisor checks, as a fraction of the window
+CHECK_FRACTION = 0.25
+
+class Heartbeat:
+    """
+    Shared-memory counters one stream writes and one supervisor reads.
+    Created before the worker process starts, so it is inherited. The
+    frame count keeps going across workers and streams.
+    """
+
+    def __init__(self):
+        self.values = multiprocessing.RawArray('d', HB_SIZE)
+
+    def starting(self):
+        """
+        Call before (re)connecting; the watchdog leaves connects alone.
+        """
+        self.values[HB_STATE] = STATE_STARTING
+
+class Watchdog:
+    """
+    check(now) returns None, "reconnect" (no frames for stall_seconds but the
+    receive loop still runs, so rebuild the session in place) or "restart"
+    (the loop itself is stuck in a native call, or a reconnect brought no
+    frames back within another window). An incident ends with the first
+    frame after it; its length from the last good frame is logged along
+    with the running MTTR.
+    """
+
+    def __init__(self, heartbeat, stall_seconds=STALL_SECONDS, name="Watchdog"):
+        self.heartbeat = heartbeat
+        self.stall_seconds = stall_seconds
+        self.tag = f"[{name}]"
+        self.incident = None
+        self.recoveries = 0
+        self.recovery_total = 0.0
+        self.reconnects = 0
+        self.restarts = 0
+
+    @property
+    def interval(self):
+        return max(self.stall_seconds * CHECK_FRACTION, 0.1)
+
+    @property
+    def mttr(self):
+        return self.recovery_total / self.recoveries if self.recoveries else None
+
+    def check(self, now):
+        v = self.heartbeat.values
+        frames, last_frame, loop, state = v[HB_FRAMES], v[HB_LAST_FRAME], v[HB_LOOP], v[HB_STATE]
+        quiet_since = max(last_frame, v[HB_STARTED])
+
+        incident = self.incident
+        if incident and frames > incident["frames"]:
+            resumed = v[HB_RESUMED]
+            self._recovered(resumed if resumed > incident["start"] else last_frame)
+            incident = None
+
+        if state == STATE_STARTING:
+            # Connecting; the connect timeout covers this phase
+            return None
+        if state == STATE_RECONNECTING and now - loop < self.stall_seconds * RECONNECT_GRACE:
+            return None
+        if state == STATE_IDLE and now - loop < self.stall_seconds:
+            # Paused on purpose; only a stuck loop counts
+            return None
+        if now - quiet_since < self.stall_seconds:
+            return None
+
+        if incident is None:
+            loop_alive = now - loop < self.stall_seconds
+            action = "reconnect" if loop_alive else "restart"
+            incident = self.incident = {"start": last_frame or quiet_since, "frames": frames, "actions": []}
+            reason = "receive loop alive" if loop_alive else f"receive loop stuck for {now - loop:.1f}s"
+            log.warning("%s No frames for %.1fs (%s), %s", self.tag, now - incident["start"], reason, action)
+        elif now - incident["at"] >= self.stall_seconds:
+            action = "restart"
+            log.warning("%s Still no frames %.1fs after %s, restart", self.tag, now - incident["at"], incident["actions"][-1])
+        else:
+            return None
+        incident["at"] = now
+        incident["actions"].append(action)
+        if action == "reconnect":
+            self.reconnects += 1
+        else:
+            self.restarts += 1
+        return action
+
+    def _recovered(self, first_frame):
+        incident = self.incident
+        self.incident = None
+        duration = max(first_frame - incident["start"], 0.0)
+        self.recoveries += 1
+        self.recovery_total += duration
+        log.info("%s Recovered after %.1fs without frames (%s). MTTR %.1fs over %d incidents", self.tag, duration,
+                 " + ".join(incident["actions"]), self.mttr, self.recoveries)